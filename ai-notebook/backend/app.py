@@ -13,6 +13,16 @@ from routes.pomodoro import pomodoro_bp
 from routes.projects import projects_bp
 from utils.auto_connect import initialize_auto_connections
 from utils.log_filter import setup_secure_logging
+from utils.search_index import search_index
+from utils.http_cache import data_version_tracker
+from utils.write_behind import note_write_buffer
+from utils.todo_stats import todo_stats
+from utils.todo_categories import todo_categories
+from utils.migrations import migration_runner
+from utils.reminders import reminder_scheduler
+from utils.task_ordering import task_ordering
+from utils.task_graph import task_graph
+from utils.topic_summaries import topic_summarizer
 from config.database_config import init_database, DatabaseManager
 import os
 import logging
@@ -51,6 +61,36 @@ def create_app():
     with app.app_context():
         db.create_all()
         
+        # 执行数据库迁移（为已有数据库补齐索引和新增列）
+        migration_runner.init_app(app)
+        
+        # 初始化全文搜索索引（首次启动时回填已有笔记和待办事项）
+        search_index.init_app(app)
+        
+        # 初始化数据版本触发器（用于ETag条件请求）
+        data_version_tracker.init_app(app)
+        
+        # 初始化待办事项分类计数触发器
+        todo_categories.init_app(app)
+        
+        # 初始化待办事项统计计数器
+        todo_stats.init_app(app)
+        
+        # 启动待办事项到期提醒调度（有订阅者时才加载数据）
+        reminder_scheduler.init_app(app)
+        
+        # 初始化任务依赖图版本触发器（排期结果缓存）
+        task_graph.init_app(app)
+        
+        # 启动看板位置键的后台重新分配
+        task_ordering.init_app(app)
+        
+        # 启动话题滚动摘要的后台更新
+        topic_summarizer.init_app(app)
+        
+        # 启动笔记延迟写入（NOTE_WRITE_BEHIND=true时启用）
+        note_write_buffer.init_app(app)
+        
         # 创建默认Settings
         default_settings = [
             ('theme', 'dark'),
@@ -106,6 +146,7 @@ def create_app():
                     'stats': connection_stats,
                     'note_count': note_count
                 },
+                'note_write_behind': note_write_buffer.get_stats(),
                 'version': '1.0.0',
                 'message': 'AI Notebook backend service running normally'
             })
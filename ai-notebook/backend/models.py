@@ -1,17 +1,32 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import deferred
 from datetime import datetime
 from utils.time_utils import TimeUtils
+from utils.compression import CompressedText
+from utils.recurrence import RecurrenceRule
+from utils.content_hash import note_content_hash, todo_content_hash
+from utils.context_builder import estimate_tokens
 
 db = SQLAlchemy()
 
 class Note(db.Model):
     __tablename__ = 'notes'
+    __table_args__ = (
+        # 笔记列表按 (updated_at, id) 键集分页
+        db.Index('ix_notes_updated_at_id', 'updated_at', 'id'),
+        # 导入时按内容指纹去重
+        db.Index('ux_notes_content_hash', 'content_hash', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    content = db.Column(db.Text, nullable=True)
+    # 正文：超过阈值时压缩存储；延迟加载，只有需要正文的接口才读取
+    content = deferred(db.Column(CompressedText, nullable=True))
     created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
     updated_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None), onupdate=lambda: TimeUtils.now_local().replace(tzinfo=None))
+    # 内容指纹（标题、正文、创建时间），写入时自动维护
+    content_hash = db.Column(db.String(64), nullable=True)
     
     # 关联的待办事项
     todos = db.relationship('Todo', backref='note', lazy=True, cascade='all, delete-orphan')
@@ -25,18 +40,104 @@ class Note(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class TodoCategory(db.Model):
+    __tablename__ = 'todo_categories'
+    
+    # 待办事项分类：名称只保存在这里，重命名只需更新一行
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    # 由todos表上的触发器在同一事务内维护的计数
+    todo_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completed_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
+    
+    @classmethod
+    def for_name(cls, name):
+        """按名称获取分类，不存在时创建（随当前会话一起提交）"""
+        if not name:
+            return None
+        # 同一会话中尚未flush的新分类
+        for obj in db.session.new:
+            if isinstance(obj, cls) and obj.name == name:
+                return obj
+        with db.session.no_autoflush:
+            category = cls.query.filter_by(name=name).first()
+        if category is None:
+            category = cls(name=name)
+            db.session.add(category)
+        return category
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'todo_count': self.todo_count,
+            'completed_count': self.completed_count
+        }
+
+def _identity_changed(target, *fields):
+    """新对象或指纹相关字段有改动时需要重新计算指纹"""
+    state = db.inspect(target)
+    return state.key is None or any(state.attrs[field].history.has_changes() for field in fields)
+
+@event.listens_for(Note, 'before_insert')
+@event.listens_for(Note, 'before_update')
+def _sync_note_content_hash(mapper, connection, target):
+    if target.created_at is None:
+        target.created_at = TimeUtils.now_local().replace(tzinfo=None)
+    if _identity_changed(target, 'title', 'content', 'created_at'):
+        target.content_hash = note_content_hash(target.title, target.content, target.created_at)
+
 class Todo(db.Model):
     __tablename__ = 'todos'
+    __table_args__ = (
+        # 逾期统计按 is_completed + due_date 范围扫描索引
+        db.Index('ix_todos_completed_due_date', 'is_completed', 'due_date'),
+        # 列表按状态过滤并按创建时间排序
+        db.Index('ix_todos_completed_created_at', 'is_completed', 'created_at'),
+        # 按分类过滤（可同时按状态过滤）
+        db.Index('ix_todos_category_id_completed', 'category_id', 'is_completed'),
+        # 各排序方式的键集分页（SQLite索引隐含rowid，即id作为最后一个排序键）
+        db.Index('ix_todos_completed_priority_rank', 'is_completed', 'priority_rank'),
+        db.Index('ix_todos_priority_rank', 'priority_rank'),
+        db.Index('ix_todos_created_at', 'created_at'),
+        db.Index('ix_todos_due_date', 'due_date'),
+        # 只包含重复事项的部分索引，用于按窗口查找重复事项
+        db.Index('ix_todos_recurring_due_date', 'due_date', sqlite_where=db.column('recurrence_rule').isnot(None)),
+        # 导入时按内容指纹去重
+        db.Index('ux_todos_content_hash', 'content_hash', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     is_completed = db.Column(db.Boolean, default=False)
     priority = db.Column(db.String(20), default='medium')
-    category = db.Column(db.String(50), default='默认')
+    # 优先级的数值等级（high=3, medium=2, low=1），写入时根据priority自动维护，用于排序
+    priority_rank = db.Column(db.Integer, nullable=False, default=2, server_default='2')
+    category_id = db.Column(db.Integer, db.ForeignKey('todo_categories.id'), nullable=True)
     due_date = db.Column(db.DateTime, nullable=True)
+    # 重复规则（RRULE子集），due_date为首次发生时间；recurrence_end为最后一次发生时间，无限重复时为空
+    recurrence_rule = db.Column(db.String(200), nullable=True)
+    recurrence_end = db.Column(db.DateTime, nullable=True)
     source_note_id = db.Column(db.Integer, db.ForeignKey('notes.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
+    # 内容指纹（标题、描述、创建时间），写入时自动维护
+    content_hash = db.Column(db.String(64), nullable=True)
+    
+    # 多对一，随待办事项一起JOIN加载
+    category_ref = db.relationship('TodoCategory', lazy='joined')
+    
+    @property
+    def category(self):
+        return self.category_ref.name if self.category_ref else None
+    
+    @category.setter
+    def category(self, name):
+        # 与原category列的默认值一致：新建时未指定分类归入默认分类
+        if name is None and self.id is None:
+            name = '默认'
+        self.category_ref = TodoCategory.for_name(name)
     
     def to_dict(self):
         return {
@@ -46,11 +147,63 @@ class Todo(db.Model):
             'completed': self.is_completed,
             'priority': self.priority,
             'category': self.category,
+            'category_id': self.category_id,
             'due_date': self.due_date.isoformat() if self.due_date else None,
+            'recurrence_rule': self.recurrence_rule,
             'source_note_id': self.source_note_id,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+# 优先级标签对应的排序等级，未知标签按medium处理
+PRIORITY_RANKS = {'high': 3, 'medium': 2, 'low': 1}
+
+def priority_rank_for(priority):
+    return PRIORITY_RANKS.get(priority or 'medium', PRIORITY_RANKS['medium'])
+
+def recurrence_end_for(recurrence_rule, due_date):
+    """重复事项的最后一次发生时间（无限重复或非重复事项返回None）"""
+    if not recurrence_rule or due_date is None:
+        return None
+    return RecurrenceRule.parse(recurrence_rule).last_occurrence(due_date)
+
+@event.listens_for(Todo, 'before_insert')
+@event.listens_for(Todo, 'before_update')
+def _sync_todo_derived_columns(mapper, connection, target):
+    target.priority_rank = priority_rank_for(target.priority)
+    target.recurrence_end = recurrence_end_for(target.recurrence_rule, target.due_date)
+    # 指纹包含创建时间，插入前先确定创建时间
+    if target.created_at is None:
+        target.created_at = TimeUtils.now_local().replace(tzinfo=None)
+    if _identity_changed(target, 'title', 'description', 'created_at'):
+        target.content_hash = todo_content_hash(target.title, target.description, target.created_at)
+
+class TodoOccurrenceException(db.Model):
+    __tablename__ = 'todo_occurrence_exceptions'
+    __table_args__ = (
+        db.UniqueConstraint('todo_id', 'occurrence_date', name='uq_todo_occurrence_exceptions_todo_occurrence'),
+    )
+    
+    # 重复事项单次发生的例外记录：只有被完成或跳过的发生才会保存，其余发生按规则虚拟生成
+    id = db.Column(db.Integer, primary_key=True)
+    todo_id = db.Column(db.Integer, db.ForeignKey('todos.id'), nullable=False)
+    occurrence_date = db.Column(db.DateTime, nullable=False)  # 该次发生按规则计算的时间
+    status = db.Column(db.String(20), nullable=False, default='completed')  # 'completed', 'skipped'
+    created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
+    
+    def to_dict(self):
+        return {
+            'todo_id': self.todo_id,
+            'occurrence_date': self.occurrence_date.isoformat(),
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+@event.listens_for(Todo, 'after_delete')
+def _delete_todo_occurrence_exceptions(mapper, connection, target):
+    connection.execute(
+        TodoOccurrenceException.__table__.delete().where(TodoOccurrenceException.todo_id == target.id)
+    )
+
 class ChatHistory(db.Model):
     __tablename__ = 'chat_history'
     
@@ -89,35 +242,55 @@ class Setting(db.Model):
 
 class Topic(db.Model):
     __tablename__ = 'topics'
+    __table_args__ = (
+        # 话题列表按更新时间倒序
+        db.Index('ix_topics_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.String(50), primary_key=True)  # 使用字符串ID以支持前端生成的ID
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     last_message = db.Column(db.Text, nullable=True)
+    # 滚动摘要：覆盖id不超过summary_message_id的消息，之后的消息由后台增量并入
+    summary = db.Column(db.Text, nullable=True)
+    summary_message_id = db.Column(db.Integer, nullable=True)
+    summary_updated_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
     updated_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None), onupdate=lambda: TimeUtils.now_local().replace(tzinfo=None))
     
     # 关联的消息
     messages = db.relationship('Message', backref='topic', lazy=True, cascade='all, delete-orphan', order_by='Message.timestamp')
     
-    def to_dict(self):
+    def to_dict(self, message_count=None):
+        """话题摘要（不包含消息，消息通过 /api/topics/<id>/messages 分页读取）
+
+        message_count: 可选，预先分组统计的消息数；未提供时用一次聚合查询统计，不加载消息对象
+        """
+        if message_count is None:
+            message_count = db.session.query(db.func.count(Message.id)).filter(Message.topic_id == self.id).scalar()
         return {
             'id': self.id,
             'title': self.title,
             'description': self.description,
             'lastMessage': self.last_message,
+            'messageCount': message_count or 0,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
-            'updatedAt': self.updated_at.isoformat() if self.updated_at else None,
-            'messages': [message.to_dict() for message in self.messages]
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
         }
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # 按话题读取消息并按 (时间, id) 分页；SQLite索引项末尾隐含rowid，同一时间的消息按id有序
+        db.Index('ix_messages_topic_id_timestamp', 'topic_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     topic_id = db.Column(db.String(50), db.ForeignKey('topics.id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
+    # 内容的估算token数，话题摘要按它判断未摘要部分的大小，无需读取消息内容
+    token_count = db.Column(db.Integer, nullable=True)
     timestamp = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
     
     def to_dict(self):
@@ -129,30 +302,46 @@ class Message(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
 
+@event.listens_for(Message, 'before_insert')
+@event.listens_for(Message, 'before_update')
+def _sync_message_token_count(mapper, connection, target):
+    target.token_count = estimate_tokens(target.content)
+
 class Project(db.Model):
     __tablename__ = 'projects'
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
+    # 任务依赖图的版本号，任务增删、工期变化和依赖增删时由触发器递增（用于缓存排期结果）
+    graph_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
     updated_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None), onupdate=lambda: TimeUtils.now_local().replace(tzinfo=None))
     
     # 关联的任务
     tasks = db.relationship('Task', backref='project', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
+    def to_dict(self, task_counts=None):
+        """task_counts: 可选，预先分组统计的 (任务数, todo数, in_progress数, done数)；
+        未提供时用一次聚合查询统计，不加载任务对象"""
+        if task_counts is None:
+            task_counts = db.session.query(*project_task_count_columns()).filter(Task.project_id == self.id).one()
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'task_count': len(self.tasks) if self.tasks else 0
+            **project_task_stats(*task_counts)
         }
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # 项目任务列表按创建时间排序；看板按状态分列，列内按位置键排序
+        db.Index('ix_tasks_project_id_created_at', 'project_id', 'created_at'),
+        db.Index('ix_tasks_project_status_position', 'project_id', 'status', 'position'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
@@ -160,6 +349,9 @@ class Task(db.Model):
     description = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), default='todo')  # 'todo', 'in_progress', 'done'
     priority = db.Column(db.String(20), default='medium')  # 'low', 'medium', 'high'
+    # 看板列内的分数位置键（按字符串排序），新任务插入时由 utils.task_ordering 分配
+    position = db.Column(db.String(64), nullable=False, server_default=db.text("''"))
+    estimated_hours = db.Column(db.Float, nullable=True)  # 预估工时，排期时为空按默认工时计算
     created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
     updated_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None), onupdate=lambda: TimeUtils.now_local().replace(tzinfo=None))
     
@@ -171,12 +363,112 @@ class Task(db.Model):
             'description': self.description,
             'status': self.status,
             'priority': self.priority,
+            'position': self.position,
+            'estimated_hours': self.estimated_hours,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class TaskDependency(db.Model):
+    """任务依赖边：task_id 依赖 depends_on_id（前置任务完成后才能开始）"""
+    __tablename__ = 'task_dependencies'
+    __table_args__ = (
+        db.UniqueConstraint('task_id', 'depends_on_id', name='uq_task_dependencies_edge'),
+        # 排期按项目加载全部边；Delete任务时按前置任务查找
+        db.Index('ix_task_dependencies_project_id', 'project_id'),
+        db.Index('ix_task_dependencies_depends_on_id', 'depends_on_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
+    depends_on_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'task_id': self.task_id,
+            'depends_on_id': self.depends_on_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class TaskEvent(db.Model):
+    """任务事件日志（只追加）：创建、状态变化和Delete，与任务写入在同一事务中记录"""
+    __tablename__ = 'task_events'
+    __table_args__ = (
+        db.Index('ix_task_events_project_id_created_at', 'project_id', 'created_at'),
+        db.Index('ix_task_events_task_id', 'task_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, nullable=False)
+    task_id = db.Column(db.Integer, nullable=False)  # 任务Delete后事件仍保留，因此不设外键
+    event_type = db.Column(db.String(20), nullable=False)  # 'created', 'status_changed', 'deleted'
+    from_status = db.Column(db.String(20), nullable=True)
+    to_status = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'task_id': self.task_id,
+            'event_type': self.event_type,
+            'from_status': self.from_status,
+            'to_status': self.to_status,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class TaskFlowDaily(db.Model):
+    """按天汇总的任务状态变化量：某天某状态的任务数净增减，前缀和即为每天各状态的任务数（累积流图/燃尽图）"""
+    __tablename__ = 'task_flow_daily'
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'day', 'status', name='uq_task_flow_daily_project_day_status'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    delta = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+PROJECT_TASK_STATUSES = ('todo', 'in_progress', 'done')
+
+def project_task_count_columns():
+    """任务数和各状态任务数的聚合列，走 (project_id, status) 索引"""
+    return [db.func.count(Task.id)] + [
+        db.func.sum(db.case((Task.status == status, 1), else_=0)) for status in PROJECT_TASK_STATUSES
+    ]
+
+def project_task_counts_subquery():
+    """按项目分组的任务统计子查询：project_id, task_count, todo, in_progress, done"""
+    task_count, *status_counts = project_task_count_columns()
+    return db.session.query(
+        Task.project_id.label('project_id'),
+        task_count.label('task_count'),
+        *[column.label(status) for column, status in zip(status_counts, PROJECT_TASK_STATUSES)]
+    ).group_by(Task.project_id).subquery()
+
+def project_task_stats(task_count, *status_counts):
+    """项目的任务数、各状态数和完成进度（百分比）"""
+    task_count = task_count or 0
+    counts = {status: count or 0 for status, count in zip(PROJECT_TASK_STATUSES, status_counts)}
+    return {
+        'task_count': task_count,
+        'task_status_counts': counts,
+        'progress': round(counts['done'] / task_count * 100, 1) if task_count else 0
+    }
+
 class PomodoroSession(db.Model):
     __tablename__ = 'pomodoro_sessions'
+    __table_args__ = (
+        # 今日/本周统计：按类型过滤并按完成时间范围扫描
+        db.Index('ix_pomodoro_sessions_type_completed_at', 'session_type', 'completed_at'),
+        # 会话历史按任务过滤并按完成时间倒序
+        db.Index('ix_pomodoro_sessions_task_completed_at', 'associated_task_id', 'completed_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     completed_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
@@ -195,4 +487,56 @@ class PomodoroSession(db.Model):
             'associated_task_id': self.associated_task_id,
             'session_type': self.session_type,
             'associated_task': self.associated_task.to_dict() if self.associated_task else None
-        }
\ No newline at end of file
+        }
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    
+    # 已应用的数据库迁移版本，由 utils/migrations.py 在启动时维护
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    
+    # 每张表一个单调递增的版本号，由SQLite触发器在写入时维护，用于生成ETag
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class TodoCounter(db.Model):
+    __tablename__ = 'todo_counters'
+    
+    # 待办事项统计计数器，由SQLite触发器随todos的写入在同一事务内维护
+    # kind: total / completed / open_priority / category；key为空字符串表示NULL或无分组
+    kind = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(50), primary_key=True, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class NoteRevision(db.Model):
+    __tablename__ = 'note_revisions'
+    __table_args__ = (
+        db.UniqueConstraint('note_id', 'revision', name='uq_note_revisions_note_revision'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.Integer, db.ForeignKey('notes.id'), nullable=False)
+    revision = db.Column(db.Integer, nullable=False)  # 每篇笔记内递增的版本号
+    kind = db.Column(db.String(10), nullable=False)  # 'snapshot' 完整快照, 'delta' 相对上一版本的差异
+    title = db.Column(db.String(200), nullable=True)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib压缩的快照文本或差异操作
+    checksum = db.Column(db.String(40), nullable=False)  # 该版本完整内容的SHA1
+    content_length = db.Column(db.Integer, nullable=False, default=0)
+    stored_size = db.Column(db.Integer, nullable=False, default=0)  # data列的字节数
+    created_at = db.Column(db.DateTime, default=lambda: TimeUtils.now_local().replace(tzinfo=None))
+    
+    def to_dict(self):
+        return {
+            'note_id': self.note_id,
+            'revision': self.revision,
+            'kind': self.kind,
+            'title': self.title,
+            'content_length': self.content_length,
+            'stored_size': self.stored_size,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
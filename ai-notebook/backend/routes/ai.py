@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, g
 from models import db, Note, Todo, Setting
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import undefer
 from datetime import datetime
 from utils.time_utils import TimeUtils
 from utils.rate_limiter import rate_limit, security_check, SecurityValidator
@@ -8,6 +9,13 @@ from utils.log_filter import create_secure_logger
 from utils.ai_command_parser import command_parser, CommandType
 from utils.file_operations import file_manager
 from utils.web_search import web_search_tool
+from utils.search_index import search_index
+from utils.note_revisions import revision_store
+from utils.write_behind import note_write_buffer
+from utils.http_cache import conditional_get
+from utils.context_builder import context_builder
+from utils.topic_summaries import topic_summarizer
+from utils.pagination import CursorError, encode_cursor, decode_cursor, parse_datetime, parse_limit, keyset_condition
 from utils.timeout_service import timeout_decorator, async_timeout_decorator, OperationProgressTracker
 import os
 import requests
@@ -214,20 +222,30 @@ def handle_search_notes(query):
                 'error': '请提供搜索关键词'
             }
         
-        # 搜索笔记
-        notes = Note.query.filter(
-            db.or_(
-                Note.title.contains(search_query),
-                Note.content.contains(search_query)
-            )
-        ).order_by(Note.updated_at.desc()).limit(10).all()
+        # 搜索笔记（优先使用全文索引，按相关度排序）
+        note_write_buffer.flush_before_read()
+        hits = search_index.search_notes(search_query, limit=10)
+        if hits is not None:
+            notes_by_id = {note.id: note for note in Note.query.options(undefer(Note.content)).filter(Note.id.in_([hit['id'] for hit in hits])).all()}
+            matched = [(notes_by_id[hit['id']], hit) for hit in hits if hit['id'] in notes_by_id]
+        else:
+            # LIKE回退只能匹配未压缩存储的正文，压缩的长笔记仅按标题匹配
+            notes = Note.query.options(undefer(Note.content)).filter(
+                db.or_(
+                    Note.title.contains(search_query),
+                    Note.content.contains(search_query)
+                )
+            ).order_by(Note.updated_at.desc()).limit(10).all()
+            matched = [(note, None) for note in notes]
         
         results = []
-        for note in notes:
+        for note, hit in matched:
+            content = note.content or ''
             results.append({
                 'id': note.id,
                 'title': note.title,
-                'content': note.content[:200] + '...' if len(note.content) > 200 else note.content,
+                'content': content[:200] + '...' if len(content) > 200 else content,
+                'highlight': hit['highlight'] if hit else None,
                 'created_at': note.created_at.isoformat(),
                 'updated_at': note.updated_at.isoformat()
             })
@@ -247,7 +265,8 @@ def handle_search_notes(query):
 def handle_list_notes():
     """列出所有笔记"""
     try:
-        notes = Note.query.order_by(Note.updated_at.desc()).all()
+        note_write_buffer.flush_before_read()
+        notes = Note.query.options(undefer(Note.content)).order_by(Note.updated_at.desc()).all()
         
         results = []
         for note in notes:
@@ -394,6 +413,7 @@ def handle_edit_note(content):
     """编辑笔记"""
     try:
         # 简单实现：搜索最近的笔记进行编辑
+        note_write_buffer.flush_before_read()
         note = Note.query.order_by(Note.updated_at.desc()).first()
         if not note:
             return {
@@ -402,8 +422,10 @@ def handle_edit_note(content):
             }
         
         # 更新笔记内容
+        previous_content = note.content
         note.content = content
         note.updated_at = TimeUtils.now_local().replace(tzinfo=None)
+        revision_store.record(note, previous_content)
         db.session.commit()
         
         return {
@@ -721,6 +743,40 @@ def make_ai_request(provider, api_key, model, messages, max_tokens=1000, tempera
     
     return response.json()
 
+def get_summary_completion(settings, model=None):
+    """话题摘要使用的AI调用函数（在后台线程中执行），API未Configuration时返回None"""
+    model = model or settings.get('default_llm')
+    provider = get_provider_for_model(model)
+    if not provider:
+        return None
+    api_key = (
+        settings.get(f'{provider}.api_key') or 
+        settings.get(f'apiProviders.{provider}.apiKey') or
+        settings.get(f'{provider}_api_key')
+    )
+    is_connected = (
+        settings.get(f'{provider}.connected') or 
+        settings.get(f'apiProviders.{provider}.isConnected') or
+        settings.get(f'{provider}_connected', False)
+    )
+    if not api_key or not is_connected:
+        return None
+    
+    def complete(messages):
+        response = make_ai_request(
+            provider=provider,
+            api_key=api_key,
+            model=model,
+            messages=messages,
+            max_tokens=topic_summarizer.MAX_SUMMARY_TOKENS * 2,
+            temperature=0.3
+        )
+        if not response or not response.get('choices'):
+            return None
+        return response['choices'][0]['message']['content']
+    
+    return complete
+
 @ai_bp.route('/api/ai/test-connection', methods=['POST'])
 def test_ai_connection():
     """测试AI API连接"""
@@ -783,6 +839,8 @@ def ai_chat():
         
         user_message = data['message']
         context = data.get('context', [])
+        # 可选：话题ID，提供时历史消息改为读取话题的滚动摘要和未摘要的消息
+        topic_id = data.get('topic_id') or data.get('topicId')
         model = data.get('model', 'gpt-5-chat')
         max_tokens = data.get('max_tokens', 1000)
         temperature = data.get('temperature', 0.7)
@@ -816,20 +874,28 @@ def ai_chat():
                 'needs_api_setup': True
             }), 200
         
-        # 构建消息历史
-        messages = [
-            {
-                "role": "system",
-                "content": "你是一个智能助手，专门帮助用户管理笔记和待办事项。你具有文件操作能力，可以读取、创建、修改、Delete文件和列出目录内容。当用户请求文件操作时，你会自动执行相应的操作并提供结果。请用简洁、友好的语言回答用户的问题。"
-            }
-        ]
-        
-        # 添加上下文消息
-        for msg in context[-10:]:  # 只保留最近10条消息
-            messages.append({
-                "role": msg.get('role', 'user'),
-                "content": msg.get('content', '')
-            })
+        system_prompt = "你是一个智能助手，专门帮助用户管理笔记和待办事项。你具有文件操作能力，可以读取、创建、修改、Delete文件和列出目录内容。当用户请求文件操作时，你会自动执行相应的操作并提供结果。请用简洁、友好的语言回答用户的问题。"
+        
+        # 上下文消息按token预算保留，由 context_builder 从最早的消息开始丢弃
+        topic = None
+        history = []
+        if topic_id:
+            from models import Topic
+            topic = Topic.query.get(topic_id)
+        if topic is not None:
+            # 摘要覆盖较早的消息，只发送之后的消息；客户端先保存了当前消息时不重复发送
+            history = [{'role': role, 'content': content} for _, role, content in topic_summarizer.get_tail(topic)]
+            if history and history[-1] == {'role': 'user', 'content': user_message}:
+                history.pop()
+        if not history and not (topic is not None and topic.summary):
+            # 未提供话题或话题中还没有保存消息时使用客户端发送的上下文
+            history = [
+                {'role': msg.get('role', 'user'), 'content': msg.get('content') or ''}
+                for msg in context if isinstance(msg, dict)
+            ] if isinstance(context, list) else []
+        user_content = user_message
+        # 注入的工具数据 [(标签, 数据)]，压缩后附加到当前用户消息
+        attachments = []
         
         # 解析用户指令
         parsed_command = command_parser.parse_command(user_message)
@@ -850,22 +916,13 @@ def ai_chat():
             
             if app_operation_result['success']:
                 # 如果应用操作Success，将结果添加到消息中让AI回应
-                enhanced_message = f"{user_message}\n\n[操作结果]: {app_operation_result.get('message', '操作Success')}"
+                user_content = f"{user_message}\n\n[操作结果]: {app_operation_result.get('message', '操作Success')}"
                 
                 if app_operation_result.get('data'):
-                    enhanced_message += f"\n\n[操作数据]: {json.dumps(app_operation_result['data'], ensure_ascii=False, indent=2)}"
-                
-                messages.append({
-                    "role": "user",
-                    "content": enhanced_message
-                })
+                    attachments.append(('操作数据', app_operation_result['data']))
             else:
                 # 如果应用操作Failed，让AI解释Error
-                error_message = f"{user_message}\n\n[操作Error]: {app_operation_result.get('error', '操作Failed')}"
-                messages.append({
-                    "role": "user",
-                    "content": error_message
-                })
+                user_content = f"{user_message}\n\n[操作Error]: {app_operation_result.get('error', '操作Failed')}"
         
         # 检查是否为文件操作指令
         elif command_parser.is_file_operation(user_message):
@@ -873,11 +930,7 @@ def ai_chat():
             file_operations_enabled = settings.get('ai_file_operations_enabled', 'false')
             if file_operations_enabled.lower() != 'true':
                 # 文件操作功能被禁用，返回提示Info
-                permission_message = f"{user_message}\n\n[权限提示]: 抱歉，AI文件操作功能当前已被禁用。我只能帮助您进行页面操作，如创建笔记、管理待办事项等。如需启用文件操作功能，请在Settings中开启相关权限。"
-                messages.append({
-                    "role": "user",
-                    "content": permission_message
-                })
+                user_content = f"{user_message}\n\n[权限提示]: 抱歉，AI文件操作功能当前已被禁用。我只能帮助您进行页面操作，如创建笔记、管理待办事项等。如需启用文件操作功能，请在Settings中开启相关权限。"
             else:
                 # 文件操作功能已启用，正常处理
                 parsed_file_command = command_parser.parse_instruction(user_message)
@@ -888,22 +941,13 @@ def ai_chat():
                 if file_operation_result['success']:
                     # 如果文件操作Success，将结果添加到消息中让AI回应
                     operation_summary = command_parser.get_operation_summary(parsed_file_command)
-                    enhanced_message = f"{user_message}\n\n[文件操作结果]: {operation_summary} - {file_operation_result.get('message', '操作Success')}"
+                    user_content = f"{user_message}\n\n[文件操作结果]: {operation_summary} - {file_operation_result.get('message', '操作Success')}"
                     
                     if file_operation_result.get('content'):
-                        enhanced_message += f"\n\n[文件内容]:\n{file_operation_result['content']}"
-                    
-                    messages.append({
-                        "role": "user",
-                        "content": enhanced_message
-                    })
+                        attachments.append(('文件内容', file_operation_result['content']))
                 else:
                     # 如果文件操作Failed，让AI解释Error
-                    error_message = f"{user_message}\n\n[文件操作Error]: {file_operation_result.get('error', '操作Failed')}"
-                    messages.append({
-                        "role": "user",
-                        "content": error_message
-                    })
+                    user_content = f"{user_message}\n\n[文件操作Error]: {file_operation_result.get('error', '操作Failed')}"
         
         # 检查是否需要网络搜索
         elif detect_search_intent(user_message):
@@ -912,24 +956,15 @@ def ai_chat():
             
             if search_result['success']:
                 # 如果搜索Success，将搜索结果添加到消息中让AI回应
-                enhanced_message = f"{user_message}\n\n[网络搜索结果]: {search_result['data']['formatted_text']}"
-                messages.append({
-                    "role": "user",
-                    "content": enhanced_message
-                })
+                attachments.append(('网络搜索结果', search_result['data']['formatted_text']))
             else:
                 # 如果搜索Failed，让AI解释Error或提供替代方案
-                error_message = f"{user_message}\n\n[搜索提示]: {search_result.get('error', '搜索Failed')}"
-                messages.append({
-                    "role": "user",
-                    "content": error_message
-                })
-        else:
-            # 添加当前用户消息
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
+                user_content = f"{user_message}\n\n[搜索提示]: {search_result.get('error', '搜索Failed')}"
+        
+        messages, context_usage = context_builder.build(
+            model, system_prompt, history, user_content, attachments,
+            summary=topic.summary if topic is not None else None
+        )
         
         # 调用AI API
         print(f"DEBUG: 准备调用AI API - provider: {provider}, model: {model}")
@@ -957,12 +992,15 @@ def ai_chat():
             print(f"WARNING: AI响应为空")
             ai_response = "抱歉，我暂时无法回答您的问题，请稍后再试。"
         
+        if topic is not None:
+            topic_summarizer.schedule(topic, get_summary_completion(settings, model))
+        
         return jsonify({
             'response': ai_response,
             'success': True,
             'provider': provider,
             'model': model,
-            'usage': response.get('usage', {})
+            'usage': {**response.get('usage', {}), 'context': context_usage}
         }), 200
         
     except requests.exceptions.RequestException as e:
@@ -1213,6 +1251,20 @@ def improve_note():
     except Exception as e:
         return jsonify({'error': f'改进笔记时发生Error: {str(e)}'}), 500
 
+def merge_search_hits(model, hits):
+    """按全文索引的相关度顺序加载记录，并附加得分和高亮摘要"""
+    query = model.query.options(undefer(Note.content)) if model is Note else model.query
+    records = {record.id: record for record in query.filter(model.id.in_([hit['id'] for hit in hits])).all()}
+    merged = []
+    for hit in hits:
+        record = records.get(hit['id'])
+        if record:
+            item = record.to_dict()
+            item['score'] = hit['score']
+            item['highlight'] = hit['highlight']
+            merged.append(item)
+    return merged
+
 @ai_bp.route('/api/ai/smart-search', methods=['POST'])
 def smart_search():
     """AI智能搜索"""
@@ -1229,23 +1281,32 @@ def smart_search():
         
         # 搜索笔记
         if search_type in ['notes', 'all']:
-            notes = Note.query.filter(
-                db.or_(
-                    Note.title.contains(query),
-                    Note.content.contains(query)
-                )
-            ).limit(10).all()
-            results['notes'] = [note.to_dict() for note in notes]
+            note_write_buffer.flush_before_read()
+            hits = search_index.search_notes(query, limit=10)
+            if hits is not None:
+                results['notes'] = merge_search_hits(Note, hits)
+            else:
+                notes = Note.query.options(undefer(Note.content)).filter(
+                    db.or_(
+                        Note.title.contains(query),
+                        Note.content.contains(query)
+                    )
+                ).limit(10).all()
+                results['notes'] = [note.to_dict() for note in notes]
         
         # 搜索待办事项
         if search_type in ['todos', 'all']:
-            todos = Todo.query.filter(
-                db.or_(
-                    Todo.title.contains(query),
-                    Todo.description.contains(query)
-                )
-            ).limit(10).all()
-            results['todos'] = [todo.to_dict() for todo in todos]
+            hits = search_index.search_todos(query, limit=10)
+            if hits is not None:
+                results['todos'] = merge_search_hits(Todo, hits)
+            else:
+                todos = Todo.query.filter(
+                    db.or_(
+                        Todo.title.contains(query),
+                        Todo.description.contains(query)
+                    )
+                ).limit(10).all()
+                results['todos'] = [todo.to_dict() for todo in todos]
         
         # 如果启用了AI增强搜索
         if data.get('ai_enhanced', False) and openai.api_key:
@@ -1303,14 +1364,21 @@ def smart_search():
 # ==================== 话题管理 API ====================
 
 @ai_bp.route('/api/topics', methods=['GET'])
+@conditional_get('topics', 'messages')
 def get_topics():
-    """获取所有话题"""
+    """获取所有话题（只返回摘要字段，消息数来自一个分组子查询，不加载消息）"""
     try:
-        from models import Topic
-        topics = Topic.query.order_by(Topic.updated_at.desc()).all()
+        from models import Topic, Message
+        message_counts = db.session.query(
+            Message.topic_id.label('topic_id'),
+            db.func.count(Message.id).label('message_count')
+        ).group_by(Message.topic_id).subquery()
+        rows = db.session.query(Topic, message_counts.c.message_count).outerjoin(
+            message_counts, message_counts.c.topic_id == Topic.id
+        ).order_by(Topic.updated_at.desc()).all()
         return jsonify({
             'success': True,
-            'topics': [topic.to_dict() for topic in topics]
+            'topics': [topic.to_dict(message_count=message_count) for topic, message_count in rows]
         }), 200
     except Exception as e:
         return jsonify({
@@ -1374,16 +1442,68 @@ def create_topic():
 
 @ai_bp.route('/api/topics/<topic_id>', methods=['GET'])
 def get_topic(topic_id):
-    """获取指定话题及其消息"""
+    """获取指定话题及其最新一页消息（更早的消息通过 next_cursor 继续读取）"""
     try:
         from models import Topic
         topic = Topic.query.get_or_404(topic_id)
+        messages, next_cursor = get_topic_messages_page(topic_id, parse_limit(request.args.get('limit')))
         return jsonify({
-            'topic': topic.to_dict()
+            'topic': {
+                **topic.to_dict(),
+                'summary': topic.summary,
+                'summaryUpdatedAt': topic.summary_updated_at.isoformat() if topic.summary_updated_at else None,
+                'messages': messages
+            },
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         }), 200
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'获取话题Failed: {str(e)}'}), 500
 
+def get_topic_messages_page(topic_id, limit, cursor=None):
+    """从最新消息向前分页读取话题消息，返回 (按时间正序的消息列表, 更早一页的游标或None)
+
+    按 (timestamp, id) 倒序走 (topic_id, timestamp) 索引，只读取一页。
+    """
+    from models import Message
+    query = Message.query.filter(Message.topic_id == topic_id)
+    if cursor:
+        cursor_timestamp, cursor_id = decode_cursor(cursor, 2)
+        query = query.filter(keyset_condition(Message.timestamp, parse_datetime(cursor_timestamp), Message.id, cursor_id))
+    rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None
+    return [message.to_dict() for message in reversed(rows)], next_cursor
+
+@ai_bp.route('/api/topics/<topic_id>/messages', methods=['GET'])
+@conditional_get('messages')
+def get_topic_messages(topic_id):
+    """分页获取话题消息：从最新消息向前翻页
+
+    查询参数：
+    - limit: 每页条数，默认50，最大200
+    - cursor: 上一页返回的 next_cursor（读取更早的消息）
+    """
+    try:
+        from models import Topic
+        if db.session.query(Topic.id).filter(Topic.id == topic_id).first() is None:
+            return jsonify({'error': '话题不存在'}), 404
+        messages, next_cursor = get_topic_messages_page(
+            topic_id, parse_limit(request.args.get('limit')), request.args.get('cursor')
+        )
+        return jsonify({
+            'messages': messages,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }), 200
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'获取消息Failed: {str(e)}'}), 500
+
 @ai_bp.route('/api/topics/<topic_id>', methods=['PUT'])
 def update_topic(topic_id):
     """更新话题Info"""
@@ -1497,6 +1617,9 @@ def add_message_to_topic(topic_id):
         db.session.add(message)
         db.session.commit()
         
+        # 未摘要的消息较多时在后台并入话题摘要
+        topic_summarizer.schedule(topic, get_summary_completion(get_api_settings()))
+        
         return jsonify({
             'message': '消息添加Success',
             'messageData': message.to_dict()
@@ -1,22 +1,119 @@
-from flask import Blueprint, request, jsonify
-from models import db, Note
+from flask import Blueprint, request, jsonify, current_app
+from models import db, Note, NoteRevision
+from sqlalchemy.orm import undefer
 from datetime import datetime
 from utils.time_utils import TimeUtils
+from utils.http_cache import conditional_get
+from utils.note_revisions import revision_store
+from utils.import_jobs import import_job_manager
+from utils.write_behind import note_write_buffer
+from utils.search_index import search_index
+from utils.compression import decompress_prefix
+from utils.content_hash import note_content_hash, parse_import_datetime
+from utils.text_patch import PatchError, apply_text_operations, apply_unified_diff, revision_token
+from utils.pagination import CursorError, encode_cursor, decode_cursor, parse_datetime, parse_limit
+import re
 
 notes_bp = Blueprint('notes', __name__)
 
+# 列表预览长度（字符）
+NOTE_PREVIEW_LENGTH = 120
+
+@notes_bp.before_request
+def flush_buffered_note_writes():
+    """读取前写入延迟保存的内容，保证读到自己刚保存的数据"""
+    if not note_write_buffer.enabled or request.method == 'PUT':
+        return
+    note_id = (request.view_args or {}).get('note_id')
+    if note_id is None:
+        note_write_buffer.flush_before_read()
+    elif request.method == 'DELETE':
+        note_write_buffer.discard([note_id])
+    else:
+        note_write_buffer.flush_before_read([note_id])
+
+def build_note_preview(text):
+    """生成笔记列表预览：合并空白并截断"""
+    if not text:
+        return ''
+    preview = re.sub(r'\s+', ' ', text).strip()
+    return preview[:NOTE_PREVIEW_LENGTH] + '...' if len(preview) > NOTE_PREVIEW_LENGTH else preview
+
 @notes_bp.route('/api/notes', methods=['GET'])
+@conditional_get('notes')
 def get_notes():
-    """获取所有笔记列表"""
+    """获取笔记列表（键集分页，仅返回摘要字段）
+
+    查询参数：
+    - limit: 每页条数，默认50，最大200
+    - cursor: 上一页返回的 next_cursor
+    """
     try:
-        notes = Note.query.order_by(Note.updated_at.desc()).all()
-        return jsonify({'notes': [note.to_dict() for note in notes]}), 200
+        limit = parse_limit(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        
+        # 只读取摘要所需的列，正文仅截取预览所需的前缀（压缩存储的正文只解压该前缀）
+        query = db.session.query(
+            Note.id,
+            Note.title,
+            Note.created_at,
+            Note.updated_at,
+            db.func.substr(Note.content, 1, NOTE_PREVIEW_LENGTH * 4).label('preview')
+        )
+        
+        if cursor:
+            cursor_updated_at, cursor_id = decode_cursor(cursor, 2)
+            cursor_updated_at = parse_datetime(cursor_updated_at)
+            query = query.filter(
+                db.or_(
+                    Note.updated_at < cursor_updated_at,
+                    db.and_(Note.updated_at == cursor_updated_at, Note.id < cursor_id)
+                )
+            )
+        
+        rows = query.order_by(Note.updated_at.desc(), Note.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        notes = [{
+            'id': row.id,
+            'title': row.title,
+            'preview': build_note_preview(decompress_prefix(row.preview, NOTE_PREVIEW_LENGTH * 2)),
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'updated_at': row.updated_at.isoformat() if row.updated_at else None
+        } for row in rows]
+        
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id) if has_more else None
+        
+        return jsonify({
+            'notes': notes,
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }), 200
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def build_note_import_row(note_data):
+    """把导入文件中的笔记转换为插入参数（保留创建时间并计算内容指纹）"""
+    if 'title' not in note_data or 'content' not in note_data:
+        return None
+    created_at = parse_import_datetime(note_data.get('created_at'))
+    return {
+        'title': note_data['title'],
+        'content': note_data['content'],
+        'created_at': created_at or TimeUtils.now_local().replace(tzinfo=None),
+        'content_hash': note_content_hash(note_data['title'], note_data['content'], created_at)
+    }
+
 @notes_bp.route('/api/notes/import', methods=['POST'])
 def import_notes():
-    """导入笔记数据"""
+    """导入笔记数据（流式解析，后台分批写入，按内容指纹去重）
+
+    返回导入任务ID，通过 GET /api/import-jobs/<job_id> 查询进度；
+    查询参数 wait=true 时等待导入完成后返回结果。
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': '没有上传文件'}), 400
@@ -28,51 +125,56 @@ def import_notes():
         if not file.filename.endswith('.json'):
             return jsonify({'error': '只支持JSON格式文件'}), 400
         
-        import json
-        
-        # 读取文件内容
-        file_content = file.read().decode('utf-8')
-        data = json.loads(file_content)
-        
-        imported_count = 0
-        
-        # 如果是完整导出数据，提取notes部分
-        if isinstance(data, dict) and 'notes' in data:
-            notes_data = data['notes']
-        elif isinstance(data, list):
-            notes_data = data
-        else:
-            return jsonify({'error': '文件格式不正确'}), 400
-        
-        # 导入笔记
-        for note_data in notes_data:
-            if 'title' in note_data and 'content' in note_data:
-                note = Note(
-                    title=note_data['title'],
-                    content=note_data['content']
-                )
-                db.session.add(note)
-                imported_count += 1
+        # 支持完整导出数据（读取notes字段）或笔记数组
+        job_id, thread = import_job_manager.start(
+            current_app._get_current_object(),
+            'notes',
+            file,
+            'notes',
+            Note.__table__,
+            build_note_import_row,
+            after_import=search_index.index_notes_after
+        )
         
-        db.session.commit()
+        if request.args.get('wait') == 'true':
+            thread.join()
+            job = import_job_manager.get(job_id)
+            if job['status'] == 'failed':
+                return jsonify({'error': f"导入Failed: {job['error']}", 'job': job}), 400
+            return jsonify({
+                'message': f"Success导入 {job['imported_count']} 条笔记",
+                'imported_count': job['imported_count'],
+                'unchanged_count': job['unchanged_count'],
+                'job': job
+            }), 200
         
         return jsonify({
-            'message': f'Success导入 {imported_count} 条笔记',
-            'imported_count': imported_count
-        }), 200
+            'message': '导入任务已开始',
+            'job_id': job_id,
+            'status_url': f'/api/import-jobs/{job_id}'
+        }), 202
         
-    except json.JSONDecodeError:
-        return jsonify({'error': 'JSON文件格式Error'}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': f'导入Failed: {str(e)}'}), 500
 
+def note_detail(note):
+    """笔记详情：完整字段加上用于增量更新的revision_token"""
+    note_dict = note.to_dict()
+    note_dict['revision_token'] = revision_token(note.content)
+    return note_dict
+
+def note_row_version(note_id):
+    """单篇笔记的版本标记：只查询updated_at，不加载正文"""
+    updated_at = db.session.query(Note.updated_at).filter(Note.id == note_id).scalar()
+    return f'{note_id}:{updated_at.isoformat()}' if updated_at else None
+
 @notes_bp.route('/api/notes/<int:note_id>', methods=['GET'])
+@conditional_get(row_version=note_row_version)
 def get_note(note_id):
     """获取单篇笔记详情"""
     try:
-        note = Note.query.get_or_404(note_id)
-        return jsonify(note.to_dict()), 200
+        note = Note.query.options(undefer(Note.content)).get_or_404(note_id)
+        return jsonify(note_detail(note)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -86,10 +188,12 @@ def create_note():
             content=data.get('content', '')
         )
         db.session.add(note)
+        db.session.flush()
+        revision_store.record(note)
         db.session.commit()
         
         # 确保返回的数据包含所有必要字段
-        note_dict = note.to_dict()
+        note_dict = note_detail(note)
         return jsonify({
             'message': '笔记创建Success',
             'note': note_dict
@@ -102,17 +206,95 @@ def create_note():
 def update_note(note_id):
     """更新笔记"""
     try:
-        note = Note.query.get_or_404(note_id)
+        note = Note.query.options(undefer(Note.content)).get_or_404(note_id)
         data = request.get_json()
         
+        if note_write_buffer.enabled:
+            return buffered_update_note(note, data)
+        
+        previous_content = note.content
         note.title = data.get('title', note.title)
         note.content = data.get('content', note.content)
         note.updated_at = TimeUtils.now_local().replace(tzinfo=None)
         
+        # 记录版本历史（与更新在同一事务中提交）
+        revision_store.record(note, previous_content)
+        db.session.commit()
+        return jsonify({
+            'message': '笔记更新Success',
+            'note': note_detail(note)
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def buffered_update_note(note, data):
+    """延迟写入模式：只更新写缓冲区，响应中返回合并后的内容"""
+    fields = {field: data[field] for field in ('title', 'content') if field in data}
+    updated_at = TimeUtils.now_local().replace(tzinfo=None)
+    merged = note_write_buffer.enqueue(note.id, fields, updated_at)
+    
+    # 响应基于分离的对象生成，修改不会被会话提交
+    db.session.expunge(note)
+    for field, value in merged.items():
+        setattr(note, field, value)
+    note.updated_at = updated_at
+    return jsonify({
+        'message': '笔记更新Success',
+        'note': note_detail(note),
+        'buffered': True
+    }), 200
+
+@notes_bp.route('/api/notes/<int:note_id>', methods=['PATCH'])
+def patch_note(note_id):
+    """增量更新笔记内容
+
+    请求体：
+    - base: 客户端持有内容的 revision_token
+    - ops: 位置操作 [{'pos', 'delete', 'insert'}]，位置相对于base内容
+    - diff: 或者提供相对于base内容的unified diff
+    - unit: ops的位置单位，utf16（默认）或 codepoint
+    - title: 可选，同时更新标题
+    base与服务器当前内容不一致时返回409。
+    """
+    try:
+        note = Note.query.options(undefer(Note.content)).get_or_404(note_id)
+        data = request.get_json() or {}
+        
+        if 'base' not in data or ('ops' not in data and 'diff' not in data):
+            return jsonify({'error': '请求必须包含base以及ops或diff'}), 400
+        
+        previous_content = note.content or ''
+        current_token = revision_token(previous_content)
+        if data['base'] != current_token:
+            return jsonify({
+                'error': '笔记已被修改，请基于最新内容重新提交',
+                'revision_token': current_token
+            }), 409
+        
+        try:
+            if 'diff' in data:
+                content = apply_unified_diff(previous_content, data['diff'])
+            else:
+                content = apply_text_operations(previous_content, data['ops'], data.get('unit', 'utf16'))
+        except PatchError as e:
+            return jsonify({'error': f'补丁无法应用: {str(e)}'}), 422
+        
+        note.content = content
+        if 'title' in data:
+            note.title = data['title']
+        note.updated_at = TimeUtils.now_local().replace(tzinfo=None)
+        
+        revision_store.record(note, previous_content)
         db.session.commit()
+        
+        # 只返回元数据，不回传完整正文
         return jsonify({
             'message': '笔记更新Success',
-            'note': note.to_dict()
+            'id': note.id,
+            'revision_token': revision_token(content),
+            'content_length': len(content),
+            'updated_at': note.updated_at.isoformat()
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -128,4 +310,49 @@ def delete_note(note_id):
         return jsonify({'message': '笔记DeleteSuccess'}), 200
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@notes_bp.route('/api/notes/<int:note_id>/revisions', methods=['GET'])
+def get_note_revisions(note_id):
+    """获取笔记的版本列表（仅元数据）"""
+    try:
+        Note.query.get_or_404(note_id)
+        return jsonify({'revisions': revision_store.list_revisions(note_id)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@notes_bp.route('/api/notes/<int:note_id>/revisions/<int:revision>', methods=['GET'])
+def get_note_revision(note_id, revision):
+    """获取指定版本的完整内容"""
+    try:
+        content = revision_store.get_content(note_id, revision)
+        if content is None or not NoteRevision.query.filter_by(note_id=note_id, revision=revision).first():
+            return jsonify({'error': '版本不存在'}), 404
+        return jsonify({
+            'note_id': note_id,
+            'revision': revision,
+            'content': content
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@notes_bp.route('/api/notes/<int:note_id>/revisions/<int:revision>/diff', methods=['GET'])
+def diff_note_revision(note_id, revision):
+    """比较两个版本
+
+    查询参数 against: 目标版本号，缺省时与笔记当前内容比较
+    """
+    try:
+        note = Note.query.options(undefer(Note.content)).get_or_404(note_id)
+        against = request.args.get('against', type=int)
+        diff = revision_store.diff(note_id, revision, against, current_content=note.content)
+        if diff is None:
+            return jsonify({'error': '版本不存在'}), 404
+        return jsonify({
+            'note_id': note_id,
+            'from': revision,
+            'to': against if against is not None else 'current',
+            'diff': diff
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,16 +1,29 @@
-from flask import Blueprint, request, jsonify
-from models import db, Project, Task
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from models import db, Project, Task, TaskDependency, TaskEvent, TaskFlowDaily, PROJECT_TASK_STATUSES, project_task_counts_subquery
 from utils.ai_client import OpenRouterClient
+from utils.http_cache import conditional_get
+from utils.task_ordering import task_ordering, TaskMoveError
+from utils.project_planner import project_planner, build_breakdown_prompt, format_event
+from utils.task_graph import task_graph, parse_duration_hours, TaskGraphError
+from utils.task_events import task_event_log
+from utils.time_utils import TimeUtils
+from datetime import date, timedelta
 import json
 
 projects_bp = Blueprint('projects', __name__)
 
 @projects_bp.route('/api/projects', methods=['GET'])
+@conditional_get('projects', 'tasks')
 def get_projects():
-    """获取所有项目列表"""
+    """获取所有项目列表（任务数和各状态数来自一个分组子查询，不加载任务对象）"""
     try:
-        projects = Project.query.order_by(Project.created_at.desc()).all()
-        return jsonify([project.to_dict() for project in projects])
+        task_counts = project_task_counts_subquery()
+        rows = db.session.query(
+            Project,
+            task_counts.c.task_count,
+            *[task_counts.c[status] for status in PROJECT_TASK_STATUSES]
+        ).outerjoin(task_counts, task_counts.c.project_id == Project.id).order_by(Project.created_at.desc()).all()
+        return jsonify([project.to_dict(task_counts=counts) for project, *counts in rows])
     except Exception as e:
         print(f"[ERROR] get_projects exception: {str(e)}")
         print(f"[ERROR] Exception type: {type(e).__name__}")
@@ -18,9 +31,34 @@ def get_projects():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def _wants_event_stream(data):
+    """客户端请求Server-Sent Events（Accept: text/event-stream 或请求体 stream=true）"""
+    return bool(data.get('stream')) or request.accept_mimetypes.best == 'text/event-stream'
+
+def _planning_response(events, first_events=(), status=200):
+    """把规划事件以Server-Sent Events推送，每个任务写入后立即发送"""
+    def generate():
+        for event, payload in first_events:
+            yield format_event(event, payload)
+        try:
+            for event, payload in events:
+                yield format_event(event, payload)
+        except Exception as e:
+            db.session.rollback()
+            yield format_event('error', {'error': str(e)})
+    
+    response = Response(stream_with_context(generate()), status=status, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @projects_bp.route('/api/projects', methods=['POST'])
 def create_project():
-    """创建新项目"""
+    """创建新项目
+
+    use_ai_planning为true时由AI流式生成初始任务，每个任务解析完成即写入；
+    请求流式响应时依次推送 project、task、done 事件，否则规划结束后返回项目。
+    """
     try:
         data = request.get_json()
         name = data.get('name')
@@ -30,87 +68,30 @@ def create_project():
         if not name:
             return jsonify({'error': '项目名称不能为空'}), 400
         
-        # 创建项目
+        # 先提交项目，规划生成的任务逐个提交
         project = Project(name=name, description=description)
         db.session.add(project)
-        db.session.flush()  # 获取项目ID
+        db.session.commit()
         
         # 如果启用AI规划，生成初始任务
-        if use_ai_planning:
+        api_key = project_planner.get_api_key() if use_ai_planning else None
+        if api_key:
+            events = project_planner.stream_tasks(
+                project.id,
+                OpenRouterClient(api_key),
+                build_breakdown_prompt(name, description),
+                use_defaults=True
+            )
+            if _wants_event_stream(data):
+                return _planning_response(events, first_events=[('project', project.to_dict())], status=201)
             try:
-                # 获取OpenRouter API密钥
-                from models import Setting
-                api_key_setting = Setting.query.filter_by(key='openrouter_api_key').first()
-                if api_key_setting and api_key_setting.value:
-                    client = OpenRouterClient(api_key_setting.value)
-                    
-                    # AI项目规划提示词
-                    prompt = f"""你是一个项目规划专家。根据用户提供的项目名称，分解成一个JSON数组的任务。每个任务对象包含'title'和'description'。
-                    
-项目名称：{name}
-描述：{description}
-
-请返回一个JSON数组，包含5-8个具体的任务，每个任务都应该是可执行的步骤。
-格式示例：
-[
-  {{"title": "需求分析", "description": "分析项目需求和目标"}},
-  {{"title": "技术选型", "description": "选择合适的技术栈和工具"}}
-]"""
-                    
-                    ai_response = client.chat_completion([
-                        {"role": "user", "content": prompt}
-                    ])
-                    
-                    # 解析AI响应
-                    try:
-                        # 提取JSON部分
-                        response_text = ai_response.strip()
-                        if '```json' in response_text:
-                            json_start = response_text.find('[', response_text.find('```json'))
-                            json_end = response_text.rfind(']') + 1
-                            json_text = response_text[json_start:json_end]
-                        elif response_text.startswith('['):
-                            json_text = response_text
-                        else:
-                            json_start = response_text.find('[')
-                            json_end = response_text.rfind(']') + 1
-                            json_text = response_text[json_start:json_end]
-                        
-                        tasks_data = json.loads(json_text)
-                        
-                        # 创建任务
-                        for task_data in tasks_data:
-                            if isinstance(task_data, dict) and 'title' in task_data:
-                                task = Task(
-                                    project_id=project.id,
-                                    title=task_data['title'],
-                                    description=task_data.get('description', ''),
-                                    status='todo'
-                                )
-                                db.session.add(task)
-                    except (json.JSONDecodeError, KeyError) as e:
-                        # AI响应解析Failed，创建默认任务
-                        default_tasks = [
-                            {'title': '项目启动', 'description': '初始化项目环境和Configuration'},
-                            {'title': '需求分析', 'description': '分析和整理项目需求'},
-                            {'title': '设计阶段', 'description': 'Completed项目设计和架构'},
-                            {'title': '开发实现', 'description': '编码实现核心功能'},
-                            {'title': '测试验证', 'description': '测试功能和Repair问题'},
-                            {'title': '项目交付', 'description': 'Completed项目并交付成果'}
-                        ]
-                        for task_data in default_tasks:
-                            task = Task(
-                                project_id=project.id,
-                                title=task_data['title'],
-                                description=task_data['description'],
-                                status='todo'
-                            )
-                            db.session.add(task)
+                for _ in events:
+                    pass
             except Exception as ai_error:
-                # AI调用Failed，不影响项目创建
+                # AI规划Failed，不影响项目创建（已写入的任务保留）
+                db.session.rollback()
                 print(f"AI规划Failed: {ai_error}")
         
-        db.session.commit()
         return jsonify(project.to_dict()), 201
         
     except Exception as e:
@@ -125,39 +106,26 @@ def ai_project_planning(project_id):
         data = request.get_json()
         planning_type = data.get('type', 'breakdown')  # breakdown, estimate, risks
         
-        # 获取OpenRouter API密钥
-        from models import Setting
-        from utils.encryption import EncryptionManager
-        
-        # 首先尝试获取加密的API密钥
-        api_key_setting = Setting.query.filter_by(key='apiProviders.openrouter.apiKey', is_encrypted=True).first()
-        
-        if api_key_setting and api_key_setting.value:
-            # 解密API密钥
-            encryption_manager = EncryptionManager()
-            decrypted_api_key = encryption_manager.decrypt(api_key_setting.value)
-        else:
-            # 如果没有找到加密的密钥，尝试未加密的
-            api_key_setting = Setting.query.filter_by(key='openrouter_api_key').first()
-            if not api_key_setting or not api_key_setting.value:
-                return jsonify({'error': '请先ConfigurationOpenRouter API密钥'}), 400
-            decrypted_api_key = api_key_setting.value
+        api_key = project_planner.get_api_key()
+        if not api_key:
+            return jsonify({'error': '请先ConfigurationOpenRouter API密钥'}), 400
         
-        client = OpenRouterClient(decrypted_api_key)
+        client = OpenRouterClient(api_key)
         
         if planning_type == 'breakdown':
-            # 项目任务分解
-            prompt = f"""你是一个项目规划专家。根据用户提供的项目Info，分解成一个JSON数组的任务。每个任务对象包含'title'和'description'。
-                    
-项目名称：{project.name}
-描述：{project.description}
-
-请返回一个JSON数组，包含5-8个具体的任务，每个任务都应该是可执行的步骤。
-格式示例：
-[
-  {{"title": "需求分析", "description": "分析项目需求和目标"}},
-  {{"title": "技术选型", "description": "选择合适的技术栈和工具"}}
-]"""
+            # 项目任务分解：流式生成，每个任务解析完成即写入
+            events = project_planner.stream_tasks(
+                project.id, client, build_breakdown_prompt(project.name, project.description)
+            )
+            if _wants_event_stream(data):
+                return _planning_response(events)
+            tasks = []
+            for event, payload in events:
+                if event == 'task':
+                    tasks.append(payload)
+                else:
+                    summary = payload
+            return jsonify({'result': tasks, 'truncated': summary['truncated'], 'error': summary['error']})
             
         elif planning_type == 'estimate':
             # 项目时间预估
@@ -257,7 +225,10 @@ def delete_project(project_id):
     try:
         project = Project.query.get_or_404(project_id)
         
-        # Delete项目相关的所有任务
+        # Delete项目相关的所有任务、任务依赖和任务事件
+        TaskDependency.query.filter_by(project_id=project_id).delete()
+        TaskEvent.query.filter_by(project_id=project_id).delete()
+        TaskFlowDaily.query.filter_by(project_id=project_id).delete()
         Task.query.filter_by(project_id=project_id).delete()
         
         # Delete项目
@@ -271,10 +242,10 @@ def delete_project(project_id):
 
 @projects_bp.route('/api/projects/<int:project_id>/tasks', methods=['GET'])
 def get_project_tasks(project_id):
-    """获取项目的所有任务"""
+    """获取项目的所有任务（按看板列和列内位置排序）"""
     try:
         project = Project.query.get_or_404(project_id)
-        tasks = Task.query.filter_by(project_id=project_id).order_by(Task.created_at.desc()).all()
+        tasks = Task.query.filter_by(project_id=project_id).order_by(Task.status, Task.position, Task.id).all()
         return jsonify([task.to_dict() for task in tasks])
     except Exception as e:
         print(f"[ERROR] get_project_tasks exception: {str(e)}")
@@ -296,6 +267,12 @@ def create_task():
         if not project_id or not title:
             return jsonify({'error': '项目ID和任务标题不能为空'}), 400
         
+        estimated_hours = data.get('estimated_hours')
+        if estimated_hours is not None:
+            estimated_hours = parse_duration_hours(estimated_hours)
+            if estimated_hours is None:
+                return jsonify({'error': 'Invalid预估工时'}), 400
+        
         # 验证项目是否存在
         project = Project.query.get(project_id)
         if not project:
@@ -305,7 +282,8 @@ def create_task():
             project_id=project_id,
             title=title,
             description=description,
-            status=status
+            status=status,
+            estimated_hours=estimated_hours
         )
         
         db.session.add(task)
@@ -327,8 +305,41 @@ def update_task(task_id):
             task.title = data['title']
         if 'description' in data:
             task.description = data['description']
-        if 'status' in data:
-            task.status = data['status']
+        if 'status' in data and data['status'] != task.status:
+            # 换列时放到新列的列尾
+            task_ordering.move(task, data['status'])
+        if 'estimated_hours' in data:
+            estimated_hours = data['estimated_hours']
+            if estimated_hours is not None:
+                estimated_hours = parse_duration_hours(estimated_hours)
+                if estimated_hours is None:
+                    return jsonify({'error': 'Invalid预估工时'}), 400
+            task.estimated_hours = estimated_hours
+        
+        db.session.commit()
+        return jsonify(task.to_dict())
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@projects_bp.route('/api/tasks/<int:task_id>/move', methods=['POST'])
+def move_task(task_id):
+    """在看板中移动任务
+
+    请求体：status（目标列，默认当前列）、after_id（放在该任务之后）、before_id（放在该任务之前），
+    相邻任务都不提供时放到列尾。只更新被移动的任务一行。
+    """
+    try:
+        task = Task.query.get_or_404(task_id)
+        data = request.get_json() or {}
+        status = data.get('status') or task.status
+        if status not in PROJECT_TASK_STATUSES:
+            return jsonify({'error': f'Invalid任务状态: {status}'}), 400
+        
+        try:
+            task_ordering.move(task, status, after_id=data.get('after_id'), before_id=data.get('before_id'))
+        except TaskMoveError as e:
+            return jsonify({'error': str(e)}), 409
         
         db.session.commit()
         return jsonify(task.to_dict())
@@ -341,6 +352,7 @@ def delete_task(task_id):
     """Delete任务"""
     try:
         task = Task.query.get_or_404(task_id)
+        task_graph.remove_task(task.id)
         db.session.delete(task)
         db.session.commit()
         return jsonify({'message': '任务DeleteSuccess'})
@@ -348,6 +360,100 @@ def delete_task(task_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@projects_bp.route('/api/tasks/<int:task_id>/dependencies', methods=['POST'])
+def add_task_dependency(task_id):
+    """添加任务依赖：请求体 depends_on_id 为前置任务；会形成循环时返回409"""
+    try:
+        task = Task.query.get_or_404(task_id)
+        data = request.get_json() or {}
+        depends_on_id = data.get('depends_on_id')
+        if not isinstance(depends_on_id, int):
+            return jsonify({'error': '前置任务ID不能为空'}), 400
+        
+        depends_on = Task.query.get(depends_on_id)
+        if depends_on is None or depends_on.project_id != task.project_id or depends_on.id == task.id:
+            return jsonify({'error': '前置任务必须是同一项目中的其他任务'}), 400
+        
+        try:
+            dependency = task_graph.add_dependency(task, depends_on)
+        except TaskGraphError as e:
+            return jsonify({'error': str(e)}), 409
+        
+        if dependency is None:
+            return jsonify({'message': '依赖已存在'})
+        db.session.commit()
+        return jsonify(dependency.to_dict()), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@projects_bp.route('/api/tasks/<int:task_id>/dependencies/<int:depends_on_id>', methods=['DELETE'])
+def delete_task_dependency(task_id, depends_on_id):
+    """Delete任务依赖"""
+    try:
+        if not task_graph.remove_dependency(task_id, depends_on_id):
+            return jsonify({'error': '依赖不存在'}), 404
+        db.session.commit()
+        return jsonify({'message': '依赖DeleteSuccess'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@projects_bp.route('/api/tasks/<int:task_id>/events', methods=['GET'])
+def get_task_events(task_id):
+    """获取任务的事件历史（创建、状态变化）"""
+    try:
+        Task.query.get_or_404(task_id)
+        return jsonify([task_event.to_dict() for task_event in task_event_log.get_events(task_id)])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@projects_bp.route('/api/projects/<int:project_id>/burndown', methods=['GET'])
+def get_project_burndown(project_id):
+    """项目燃尽图/累积流图：每天结束时各状态的任务数
+
+    参数：start、end（YYYY-MM-DD，默认最近30天，包含两端）
+    """
+    try:
+        Project.query.get_or_404(project_id)
+        try:
+            end = date.fromisoformat(request.args['end']) if request.args.get('end') else TimeUtils.now_local().date()
+            start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=29)
+        except ValueError:
+            return jsonify({'error': 'Invalid日期格式，应为YYYY-MM-DD'}), 400
+        if start > end:
+            return jsonify({'error': '开始日期不能晚于结束日期'}), 400
+        if (end - start).days + 1 > task_event_log.MAX_DAYS:
+            return jsonify({'error': f'日期范围不能超过 {task_event_log.MAX_DAYS} 天'}), 400
+        
+        result = task_event_log.burndown(project_id, start, end)
+        return jsonify({'project_id': project_id, 'start': start.isoformat(), 'end': end.isoformat(), **result})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@projects_bp.route('/api/projects/<int:project_id>/schedule', methods=['GET'])
+def get_project_schedule(project_id):
+    """项目排期：按拓扑顺序返回任务及最早/最晚开始时间、浮动时间，以及关键路径（单位：小时）"""
+    try:
+        project = Project.query.get_or_404(project_id)
+        try:
+            result = task_graph.schedule(project)
+        except TaskGraphError as e:
+            return jsonify({'error': str(e)}), 409
+        
+        tasks = {task.id: task for task in Task.query.filter_by(project_id=project_id).all()}
+        return jsonify({
+            'project_id': project_id,
+            'tasks': [
+                {**tasks[task_id].to_dict(), **result['schedule'][task_id]}
+                for task_id in result['order'] if task_id in tasks
+            ],
+            'critical_path': result['critical_path'],
+            'total_hours': result['total_hours']
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @projects_bp.route('/api/tasks/<int:task_id>/enhance', methods=['POST'])
 def enhance_task(task_id):
     """AI增强任务功能"""
@@ -1,9 +1,16 @@
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, Response, stream_with_context
 from models import db, Setting
+from sqlalchemy import select, func
 from sqlalchemy.exc import SQLAlchemyError
 from utils.encryption import encrypt_api_key, decrypt_api_key, is_api_key_encrypted
 from utils.rate_limiter import rate_limit, security_check
 from utils.log_filter import create_secure_logger
+from utils.http_cache import conditional_get
+from utils.import_jobs import import_job_manager
+from utils.data_export import data_exporter, available_compressions, EXPORT_FORMATS
+from utils.write_behind import note_write_buffer
+from utils.reminders import reminder_scheduler
+from datetime import datetime
 import json
 import re
 
@@ -59,6 +66,7 @@ def should_encrypt_value(key: str, value: any) -> bool:
     return is_api_key_field(key)
 
 @settings_bp.route('/api/settings', methods=['GET'])
+@conditional_get('settings')
 def get_settings():
     """获取所有Settings"""
     try:
@@ -336,32 +344,39 @@ def delete_setting(key):
 
 @settings_bp.route('/api/export', methods=['GET'])
 def export_data():
-    """导出所有数据"""
-    try:
-        from models import Note, Todo, ChatHistory
-        
-        # 获取所有数据
-        notes = Note.query.all()
-        todos = Todo.query.all()
-        chat_history = ChatHistory.query.all()
-        settings = Setting.query.all()
-        
-        from datetime import datetime
-        
-        export_data = {
-            'notes': [note.to_dict() for note in notes],
-            'todos': [todo.to_dict() for todo in todos],
-            'chat_history': [chat.to_dict() for chat in chat_history],
-            'settings': [setting.to_dict() for setting in settings],
-            'export_time': datetime.now().isoformat()
-        }
-        
-        return jsonify(export_data), 200
-        
-    except SQLAlchemyError as e:
-        return jsonify({'error': '导出数据Failed', 'details': str(e)}), 500
-    except Exception as e:
-        return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
+    """导出所有数据（流式输出）
+
+    查询参数：
+    - format: json（默认，与原导出结构相同）或 ndjson（每行一条记录）
+    - compress: 可选，gzip 或 zstd
+    """
+    export_format = request.args.get('format', 'json')
+    compression = request.args.get('compress')
+    
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'不支持的导出格式: {export_format}'}), 400
+    if compression and compression not in available_compressions():
+        return jsonify({'error': f'不支持的压缩方式: {compression}'}), 400
+    
+    # 先写入延迟保存的笔记，导出内容包含最新修改
+    note_write_buffer.flush_before_read()
+    
+    filename = f"ai-notebook-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'application/json'
+    if compression == 'gzip':
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    elif compression == 'zstd':
+        filename += '.zst'
+        mimetype = 'application/zstd'
+    
+    response = Response(
+        stream_with_context(data_exporter.generate(export_format, compression)),
+        mimetype=mimetype
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @settings_bp.route('/api/import', methods=['POST'])
 def import_data():
@@ -378,7 +393,6 @@ def import_data():
             return jsonify({'error': '只支持JSON格式文件'}), 400
         
         from models import Note, Todo, ChatHistory
-        from datetime import datetime
         import json
         
         # 读取文件内容
@@ -395,39 +409,32 @@ def import_data():
             'settings': 0
         }
         
-        # 导入笔记
-        if 'notes' in data and isinstance(data['notes'], list):
-            for note_data in data['notes']:
-                if 'title' in note_data and 'content' in note_data:
-                    note = Note(
-                        title=note_data['title'],
-                        content=note_data['content']
-                    )
-                    db.session.add(note)
-                    imported_counts['notes'] += 1
-        
-        # 导入待办事项
-        if 'todos' in data and isinstance(data['todos'], list):
-            for todo_data in data['todos']:
-                if 'title' in todo_data:
-                    # 处理截止日期
-                    due_date = None
-                    if 'due_date' in todo_data and todo_data['due_date']:
-                        try:
-                            due_date = datetime.fromisoformat(todo_data['due_date'].replace('Z', '+00:00'))
-                        except ValueError:
-                            pass
-                    
-                    todo = Todo(
-                        title=todo_data['title'],
-                        description=todo_data.get('description', ''),
-                        priority=todo_data.get('priority', 'medium'),
-                        category=todo_data.get('category', '默认'),
-                        due_date=due_date,
-                        is_completed=todo_data.get('completed', todo_data.get('is_completed', False))
-                    )
-                    db.session.add(todo)
-                    imported_counts['todos'] += 1
+        # 导入笔记和待办事项：按内容指纹批量去重，重复导入同一备份时不产生写入
+        from routes.notes import build_note_import_row
+        from routes.todos import build_todo_import_row, TODO_IMPORT_MERGE_COLUMNS
+        from utils.search_index import search_index
+        from utils.todo_categories import todo_categories
+        
+        conn = db.session.connection()
+        merged_counts = {}
+        unchanged_counts = {}
+        imports = (
+            ('notes', Note.__table__, build_note_import_row, None, (), search_index.index_notes_after),
+            ('todos', Todo.__table__, build_todo_import_row, todo_categories.assign_ids,
+             TODO_IMPORT_MERGE_COLUMNS, search_index.index_todos_after)
+        )
+        for key, table, build_row, prepare_batch, merge_columns, after_import in imports:
+            if key not in data or not isinstance(data[key], list):
+                continue
+            start_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+            counts = import_job_manager.import_items(
+                conn, data[key], table, build_row,
+                prepare_batch=prepare_batch, merge_columns=merge_columns
+            )
+            after_import(conn, start_id)
+            imported_counts[key] = counts['imported']
+            merged_counts[key] = counts['merged']
+            unchanged_counts[key] = counts['unchanged']
         
         # 导入聊天记录
         if 'chat_history' in data and isinstance(data['chat_history'], list):
@@ -457,12 +464,16 @@ def import_data():
                         imported_counts['settings'] += 1
         
         db.session.commit()
+        # 待办事项通过批量语句写入，提醒调度重新加载
+        reminder_scheduler.invalidate()
         
         total_imported = sum(imported_counts.values())
         
         return jsonify({
             'message': f'Success导入 {total_imported} 条数据',
-            'imported_counts': imported_counts
+            'imported_counts': imported_counts,
+            'merged_counts': merged_counts,
+            'unchanged_counts': unchanged_counts
         }), 200
         
     except json.JSONDecodeError:
@@ -474,6 +485,14 @@ def import_data():
         db.session.rollback()
         return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
 
+@settings_bp.route('/api/import-jobs/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """查询导入任务进度"""
+    job = import_job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': '导入任务不存在'}), 404
+    return jsonify(job), 200
+
 @settings_bp.route('/api/settings/factory-reset', methods=['POST'])
 def factory_reset():
     """恢复出厂Settings"""
@@ -515,15 +534,22 @@ def factory_reset():
 def clear_all_data():
     """清除所有数据"""
     try:
-        from models import Note, Todo, ChatHistory
+        from models import Note, NoteRevision, Todo, TodoOccurrenceException, TodoCategory, ChatHistory
+        from utils.search_index import search_index
         
-        # Delete所有数据
+        # Delete所有数据（批量Delete不触发ORM事件，需要同时清空全文索引和版本历史）
+        NoteRevision.query.delete()
         Note.query.delete()
+        note_write_buffer.discard()
+        TodoOccurrenceException.query.delete()
         Todo.query.delete()
+        TodoCategory.query.delete()
+        search_index.clear()
         ChatHistory.query.delete()
         # 保留Settings数据，只清除用户数据
         
         db.session.commit()
+        reminder_scheduler.invalidate()
         
         return jsonify({'message': '所有用户数据已清除'}), 200
         
@@ -1,23 +1,68 @@
-from flask import Blueprint, request, jsonify
-from models import db, Todo
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from models import db, Todo, priority_rank_for
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
 from utils.time_utils import TimeUtils
+from utils.http_cache import conditional_get
+from utils.import_jobs import import_job_manager
+from utils.search_index import search_index
+from utils.todo_stats import todo_stats
+from utils.todo_bulk import todo_bulk_processor, BulkOperationError
+from utils.reminders import reminder_scheduler
+from utils.pagination import CursorError, encode_cursor, decode_cursor, parse_datetime, parse_limit, keyset_condition
+from utils.recurring_todos import recurring_todos
+from utils.recurrence import RecurrenceError
+from utils.todo_categories import todo_categories, TodoCategoryError
+from utils.content_hash import todo_content_hash, parse_import_datetime
 
 todos_bp = Blueprint('todos', __name__)
 
+# 排序参数对应的列；排序键为 (列, id)，由对应索引支持
+TODO_SORT_COLUMNS = {
+    'created_at': Todo.created_at,
+    'due_date': Todo.due_date,
+    'priority': Todo.priority_rank
+}
+
+# 重新导入已有待办事项（指纹相同）时按导入数据覆盖的列
+TODO_IMPORT_MERGE_COLUMNS = (
+    'is_completed', 'priority', 'priority_rank', 'category_id', 'due_date', 'recurrence_rule', 'recurrence_end'
+)
+
 @todos_bp.route('/api/todos', methods=['GET'])
+@conditional_get('todos', 'todo_categories', 'todo_occurrence_exceptions')
 def get_todos():
-    """获取所有待办事项"""
+    """获取待办事项（键集分页）
+
+    查询参数：
+    - status: pending / completed / all
+    - category: 分类过滤
+    - sort: created_at（默认）/ due_date / priority（按等级 high > medium > low）
+    - order: desc（默认）/ asc
+    - limit: 每页条数，默认50，最大200
+    - cursor: 上一页返回的 next_cursor（需使用相同的排序参数）
+    - start, end: 可选，同时提供时按时间窗口 [start, end) 列出事项，
+      重复事项展开为窗口内的各次发生，按截止时间升序（忽略sort/order）
+    """
     try:
         # 获取查询参数
         status = request.args.get('status')  # pending, completed, all
         category = request.args.get('category')
         sort_by = request.args.get('sort', 'created_at')  # created_at, due_date, priority
         order = request.args.get('order', 'desc')  # asc, desc
+        limit = parse_limit(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        
+        if sort_by not in TODO_SORT_COLUMNS:
+            sort_by = 'created_at'
+        descending = order != 'asc'
+        sort_column = TODO_SORT_COLUMNS[sort_by]
         
         query = Todo.query
         
+        if request.args.get('start') and request.args.get('end'):
+            return get_todos_window(category, status, limit, cursor)
+        
         # 按状态过滤
         if status and status != 'all':
             if status == 'pending':
@@ -27,38 +72,119 @@ def get_todos():
         
         # 按分类过滤
         if category:
-            query = query.filter(Todo.category == category)
+            query = query.filter(todo_categories.category_filter(category))
+        
+        # 游标记录排序方式和最后一行的排序键
+        if cursor:
+            cursor_sort, cursor_value, cursor_id = decode_cursor(cursor, 3)
+            if cursor_sort != sort_by:
+                raise CursorError('Invalid cursor: sort mismatch')
+            if sort_by != 'priority':
+                cursor_value = parse_datetime(cursor_value)
+            query = query.filter(keyset_condition(sort_column, cursor_value, Todo.id, cursor_id, descending))
         
         # 排序
-        if sort_by == 'due_date':
-            if order == 'asc':
-                query = query.order_by(Todo.due_date.asc())
-            else:
-                query = query.order_by(Todo.due_date.desc())
-        elif sort_by == 'priority':
-            # 优先级排序：high > medium > low
-            priority_order = {'high': 3, 'medium': 2, 'low': 1}
-            if order == 'asc':
-                query = query.order_by(Todo.priority.asc())
-            else:
-                query = query.order_by(Todo.priority.desc())
-        else:  # created_at
-            if order == 'asc':
-                query = query.order_by(Todo.created_at.asc())
-            else:
-                query = query.order_by(Todo.created_at.desc())
+        if descending:
+            query = query.order_by(sort_column.desc(), Todo.id.desc())
+        else:
+            query = query.order_by(sort_column.asc(), Todo.id.asc())
+        
+        todos = query.limit(limit + 1).all()
+        has_more = len(todos) > limit
+        todos = todos[:limit]
         
-        todos = query.all()
-        return jsonify({'todos': [todo.to_dict() for todo in todos]}), 200
+        next_cursor = None
+        if has_more:
+            last = todos[-1]
+            next_cursor = encode_cursor(sort_by, getattr(last, sort_column.key), last.id)
         
+        return jsonify({
+            'todos': [todo.to_dict() for todo in todos],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }), 200
+        
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except SQLAlchemyError as e:
         return jsonify({'error': '获取待办事项Failed', 'details': str(e)}), 500
     except Exception as e:
         return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
 
+def get_todos_window(category, status, limit, cursor):
+    """按时间窗口列出待办事项，重复事项在窗口内惰性展开为各次发生"""
+    try:
+        window_start = datetime.fromisoformat(request.args['start'].replace('Z', '+00:00')).replace(tzinfo=None)
+        window_end = datetime.fromisoformat(request.args['end'].replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return jsonify({'error': '时间窗口格式Invalid'}), 400
+    if window_end <= window_start:
+        return jsonify({'error': 'end必须晚于start'}), 400
+    
+    query = Todo.query
+    if category:
+        query = query.filter(todo_categories.category_filter(category))
+    
+    after = None
+    if cursor:
+        cursor_mode, cursor_value, cursor_id = decode_cursor(cursor, 3)
+        if cursor_mode != 'window':
+            raise CursorError('Invalid cursor: sort mismatch')
+        after = (parse_datetime(cursor_value), cursor_id)
+    
+    items = recurring_todos.list_window(
+        query, window_start, window_end,
+        status=status if status in ('pending', 'completed') else None,
+        after=after, limit=limit
+    )
+    has_more = len(items) > limit
+    items = items[:limit]
+    
+    next_cursor = None
+    if has_more:
+        occurrence, todo_id, _ = items[-1]
+        next_cursor = encode_cursor('window', occurrence, todo_id)
+    
+    return jsonify({
+        'todos': [item for _, _, item in items],
+        'next_cursor': next_cursor,
+        'has_more': has_more
+    }), 200
+
+def build_todo_import_row(todo_data):
+    """把导入文件中的待办事项转换为插入参数
+
+    保留导出文件中的创建时间，指纹由标题、描述和创建时间计算（文件中没有创建时间时不含创建时间），
+    重复导入同一备份时匹配到已有记录。
+    """
+    if 'title' not in todo_data:
+        return None
+    
+    # 处理截止日期（忽略Invalid的日期格式）
+    due_date = parse_import_datetime(todo_data.get('due_date'))
+    created_at = parse_import_datetime(todo_data.get('created_at'))
+    description = todo_data.get('description', '')
+    
+    return {
+        'title': todo_data['title'],
+        'description': description,
+        'priority': todo_data.get('priority', 'medium'),
+        'priority_rank': priority_rank_for(todo_data.get('priority', 'medium')),
+        'category': todo_data.get('category', '默认'),
+        'due_date': due_date,
+        'is_completed': bool(todo_data.get('completed', todo_data.get('is_completed', False))),
+        **recurring_todos.build_import_fields(todo_data.get('recurrence_rule'), due_date),
+        'created_at': created_at or TimeUtils.now_local().replace(tzinfo=None),
+        'content_hash': todo_content_hash(todo_data['title'], description, created_at)
+    }
+
 @todos_bp.route('/api/todos/import', methods=['POST'])
 def import_todos():
-    """导入待办事项数据"""
+    """导入待办事项数据（流式解析，后台分批写入，按内容指纹去重）
+
+    返回导入任务ID，通过 GET /api/import-jobs/<job_id> 查询进度；
+    查询参数 wait=true 时等待导入完成后返回结果。
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': '没有上传文件'}), 400
@@ -70,55 +196,40 @@ def import_todos():
         if not file.filename.endswith('.json'):
             return jsonify({'error': '只支持JSON格式文件'}), 400
         
-        import json
-        
-        # 读取文件内容
-        file_content = file.read().decode('utf-8')
-        data = json.loads(file_content)
-        
-        imported_count = 0
+        # 支持完整导出数据（读取todos字段）或待办事项数组
+        job_id, thread = import_job_manager.start(
+            current_app._get_current_object(),
+            'todos',
+            file,
+            'todos',
+            Todo.__table__,
+            build_todo_import_row,
+            prepare_batch=todo_categories.assign_ids,
+            merge_columns=TODO_IMPORT_MERGE_COLUMNS,
+            after_import=search_index.index_todos_after,
+            on_complete=reminder_scheduler.invalidate
+        )
         
-        # 如果是完整导出数据，提取todos部分
-        if isinstance(data, dict) and 'todos' in data:
-            todos_data = data['todos']
-        elif isinstance(data, list):
-            todos_data = data
-        else:
-            return jsonify({'error': '文件格式不正确'}), 400
-        
-        # 导入待办事项
-        for todo_data in todos_data:
-            if 'title' in todo_data:
-                # 处理截止日期
-                due_date = None
-                if 'due_date' in todo_data and todo_data['due_date']:
-                    try:
-                        due_date = datetime.fromisoformat(todo_data['due_date'].replace('Z', '+00:00'))
-                    except ValueError:
-                        pass  # 忽略Invalid的日期格式
-                
-                todo = Todo(
-                    title=todo_data['title'],
-                    description=todo_data.get('description', ''),
-                    priority=todo_data.get('priority', 'medium'),
-                    category=todo_data.get('category', '默认'),
-                    due_date=due_date,
-                    is_completed=todo_data.get('completed', todo_data.get('is_completed', False))
-                )
-                db.session.add(todo)
-                imported_count += 1
-        
-        db.session.commit()
+        if request.args.get('wait') == 'true':
+            thread.join()
+            job = import_job_manager.get(job_id)
+            if job['status'] == 'failed':
+                return jsonify({'error': f"导入Failed: {job['error']}", 'job': job}), 400
+            return jsonify({
+                'message': f"Success导入 {job['imported_count']} 条待办事项",
+                'imported_count': job['imported_count'],
+                'merged_count': job['merged_count'],
+                'unchanged_count': job['unchanged_count'],
+                'job': job
+            }), 200
         
         return jsonify({
-            'message': f'Success导入 {imported_count} 条待办事项',
-            'imported_count': imported_count
-        }), 200
+            'message': '导入任务已开始',
+            'job_id': job_id,
+            'status_url': f'/api/import-jobs/{job_id}'
+        }), 202
         
-    except json.JSONDecodeError:
-        return jsonify({'error': 'JSON文件格式Error'}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': f'导入Failed: {str(e)}'}), 500
 
 @todos_bp.route('/api/todos', methods=['POST'])
@@ -138,12 +249,15 @@ def create_todo():
             except ValueError:
                 return jsonify({'error': '截止日期格式Invalid'}), 400
         
+        recurrence_rule = recurring_todos.normalize_rule(data.get('recurrence_rule'), due_date)
+        
         new_todo = Todo(
             title=data['title'],
             description=data.get('description', ''),
             priority=data.get('priority', 'medium'),
             category=data.get('category', '默认'),
             due_date=due_date,
+            recurrence_rule=recurrence_rule,
             is_completed=data.get('completed', data.get('is_completed', False))
         )
         
@@ -152,6 +266,8 @@ def create_todo():
         
         return jsonify(new_todo.to_dict()), 201
         
+    except RecurrenceError as e:
+        return jsonify({'error': str(e)}), 400
     except SQLAlchemyError as e:
         db.session.rollback()
         return jsonify({'error': '创建待办事项Failed', 'details': str(e)}), 500
@@ -215,11 +331,20 @@ def update_todo(todo_id):
             else:
                 todo.due_date = None
         
+        # 重复规则：null取消重复；修改截止日期时重新校验已有规则
+        if 'recurrence_rule' in data or (todo.recurrence_rule and 'due_date' in data):
+            todo.recurrence_rule = recurring_todos.normalize_rule(
+                data.get('recurrence_rule', todo.recurrence_rule), todo.due_date
+            )
+        
         todo.updated_at = TimeUtils.now_local().replace(tzinfo=None)
         db.session.commit()
         
         return jsonify(todo.to_dict()), 200
         
+    except RecurrenceError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except SQLAlchemyError as e:
         db.session.rollback()
         return jsonify({'error': '更新待办事项Failed', 'details': str(e)}), 500
@@ -275,44 +400,107 @@ def toggle_todo(todo_id):
         db.session.rollback()
         return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
 
+@todos_bp.route('/api/todos/<int:todo_id>/occurrences', methods=['POST'])
+def set_todo_occurrence(todo_id):
+    """设置重复事项单次发生的状态
+
+    请求体：{'occurrence_date': '2024-01-01T09:00:00', 'status': 'completed' | 'skipped' | 'pending'}
+    只保存完成/跳过的例外记录，pending会Delete例外记录。
+    """
+    try:
+        todo = Todo.query.get(todo_id)
+        
+        if not todo:
+            return jsonify({'error': '待办事项不存在'}), 404
+        
+        data = request.get_json()
+        if not data or not data.get('occurrence_date'):
+            return jsonify({'error': 'occurrence_date不能为空'}), 400
+        
+        try:
+            occurrence_date = datetime.fromisoformat(data['occurrence_date'].replace('Z', '+00:00')).replace(tzinfo=None)
+        except (ValueError, AttributeError):
+            return jsonify({'error': '发生时间格式Invalid'}), 400
+        
+        occurrence = recurring_todos.set_occurrence_status(todo, occurrence_date, data.get('status', 'completed'))
+        db.session.commit()
+        
+        return jsonify(occurrence), 200
+        
+    except RecurrenceError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({'error': '更新重复事项Failed', 'details': str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
+
+@todos_bp.route('/api/todos/bulk', methods=['POST'])
+def bulk_todos():
+    """批量操作待办事项（单个事务）
+
+    请求体：
+    - operations: [{'op': 'create', 'data': {...}}, {'op': 'update', 'id': 1, 'data': {...}},
+                   {'op': 'toggle', 'id': 2}, {'op': 'delete', 'id': 3}]
+    - atomic: 可选，为true时任一操作无效则全部不执行
+    返回与operations顺序一致的逐项结果。
+    """
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('operations'), list):
+            return jsonify({'error': 'operations必须是数组'}), 400
+        
+        results, committed = todo_bulk_processor.execute(data['operations'], atomic=bool(data.get('atomic')))
+        if committed:
+            # 批量语句绕过ORM事件，提醒调度重新加载
+            reminder_scheduler.invalidate()
+        failed = sum(1 for result in results if result['status'] == 'error')
+        
+        return jsonify({
+            'results': results,
+            'applied': len(results) - failed if committed else 0,
+            'failed': failed
+        }), 200 if committed else 400
+        
+    except BulkOperationError as e:
+        return jsonify({'error': str(e)}), 400
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({'error': '批量操作Failed', 'details': str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
+
+@todos_bp.route('/api/todos/reminders/stream', methods=['GET'])
+def stream_todo_reminders():
+    """订阅待办事项到期提醒（Server-Sent Events）
+
+    待办事项到达截止时间时推送 todo_due 事件，客户端无需轮询统计接口。
+    """
+    if not reminder_scheduler.enabled:
+        return jsonify({'error': '到期提醒未启用'}), 503
+    
+    subscriber = reminder_scheduler.subscribe()
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            yield from reminder_scheduler.listen(subscriber)
+        finally:
+            reminder_scheduler.unsubscribe(subscriber)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @todos_bp.route('/api/todos/stats', methods=['GET'])
 def get_todo_stats():
-    """获取待办事项统计Info"""
+    """获取待办事项统计Info（计数器表或单次聚合查询）"""
     try:
-        total = Todo.query.count()
-        completed = Todo.query.filter(Todo.is_completed == True).count()
-        pending = total - completed
-        
-        # 按优先级统计
-        high_priority = Todo.query.filter(Todo.priority == 'high', Todo.is_completed == False).count()
-        medium_priority = Todo.query.filter(Todo.priority == 'medium', Todo.is_completed == False).count()
-        low_priority = Todo.query.filter(Todo.priority == 'low', Todo.is_completed == False).count()
-        
-        # 按分类统计
-        categories = db.session.query(Todo.category, db.func.count(Todo.id)).group_by(Todo.category).all()
-        category_stats = {category: count for category, count in categories}
-        
-        # 逾期任务
-        overdue = Todo.query.filter(
-            Todo.due_date < TimeUtils.now_local().replace(tzinfo=None),
-            Todo.is_completed == False
-        ).count()
-        
-        stats = {
-            'total': total,
-            'completed': completed,
-            'pending': pending,
-            'completion_rate': round((completed / total * 100) if total > 0 else 0, 1),
-            'priority_stats': {
-                'high': high_priority,
-                'medium': medium_priority,
-                'low': low_priority
-            },
-            'category_stats': category_stats,
-            'overdue': overdue
-        }
-        
-        return jsonify(stats), 200
+        return jsonify(todo_stats.get_stats()), 200
         
     except SQLAlchemyError as e:
         return jsonify({'error': '获取统计InfoFailed', 'details': str(e)}), 500
@@ -321,14 +509,44 @@ def get_todo_stats():
 
 @todos_bp.route('/api/todos/categories', methods=['GET'])
 def get_categories():
-    """获取所有分类"""
+    """获取所有分类（读取分类表，查询参数 with_counts=true 时返回各分类的事项数）"""
     try:
-        categories = db.session.query(Todo.category).distinct().all()
-        category_list = [category[0] for category in categories if category[0]]
+        categories = todo_categories.list_categories()
         
-        return jsonify(category_list), 200
+        if request.args.get('with_counts') == 'true':
+            return jsonify(categories), 200
+        return jsonify([category['name'] for category in categories]), 200
         
     except SQLAlchemyError as e:
         return jsonify({'error': '获取分类Failed', 'details': str(e)}), 500
     except Exception as e:
+        return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
+
+@todos_bp.route('/api/todos/categories/<path:name>', methods=['PUT'])
+def rename_category(name):
+    """重命名分类（只更新分类表中的一行）；新名称已存在时合并到该分类
+
+    请求体：{'name': '新名称'}
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': '请求数据为空'}), 400
+        
+        category = todo_categories.rename(name, data.get('name'))
+        if category is None:
+            return jsonify({'error': '分类不存在'}), 404
+        
+        db.session.commit()
+        
+        return jsonify(category.to_dict()), 200
+        
+    except TodoCategoryError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({'error': '重命名分类Failed', 'details': str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'error': '服务器内部Error', 'details': str(e)}), 500
\ No newline at end of file
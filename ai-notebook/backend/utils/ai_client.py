@@ -1,7 +1,7 @@
 import os
 import requests
 import json
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterator
 from dataclasses import dataclass
 
 @dataclass
@@ -12,6 +12,9 @@ class AIResponse:
     model: Optional[str] = None
     error: Optional[str] = None
 
+class AIStreamError(RuntimeError):
+    """流式请求Failed"""
+
 class OpenRouterClient:
     """OpenRouter API客户端"""
     
@@ -87,6 +90,64 @@ class OpenRouterClient:
                 error=f"Unknown Error: {str(e)}"
             )
     
+    def stream_chat_completion(self,
+                              messages: List[Dict[str, str]],
+                              model: str = "anthropic/claude-3-haiku",
+                              max_tokens: int = 1000,
+                              temperature: float = 0.7) -> Iterator[str]:
+        """发送流式聊天Completed请求，逐段产出生成的文本
+
+        请求Failed时抛出AIStreamError；已产出的文本由调用方自行保留。
+        """
+        
+        # 如果没有API密钥，分段返回模拟响应
+        if not self.api_key:
+            content = self._get_mock_response(messages).content
+            for start in range(0, len(content), 64):
+                yield content[start:start + 64]
+            return
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        }
+        
+        try:
+            with requests.post(
+                f"{self.base_url}/chat/completions",
+                headers=self.headers,
+                json=payload,
+                timeout=30,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    raise AIStreamError(f"API Request Failed: {response.status_code} - {response.text}")
+                
+                # Server-Sent Events：每个 data 行是一个增量，": ..." 为保活注释
+                # text/event-stream 未声明charset时requests默认按ISO-8859-1解码
+                response.encoding = 'utf-8'
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        return
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    if chunk.get('error'):
+                        raise AIStreamError(f"API Stream Error: {chunk['error']}")
+                    choices = chunk.get('choices') or [{}]
+                    content = (choices[0].get('delta') or {}).get('content')
+                    if content:
+                        yield content
+        except requests.exceptions.RequestException as e:
+            raise AIStreamError(f"Network Request Error: {str(e)}")
+    
     def _get_mock_response(self, messages: List[Dict[str, str]]) -> AIResponse:
         """获取模拟AI响应（当没有API密钥时使用）"""
         
@@ -0,0 +1,28 @@
+"""
+后台数据库连接模块
+应用的SQLite引擎使用StaticPool（所有请求共享一个连接），后台线程在共享连接上提交或回滚
+会连带提交或丢弃请求中尚未完成的事务，因此文件数据库的后台写入使用独立的NullPool引擎
+"""
+
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from models import db
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def get_background_engine():
+    """后台写入专用引擎（需要在应用上下文中调用）
+
+    内存数据库无法从另一个连接访问，此时返回应用引擎。
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return engine
+    key = str(engine.url)
+    with _lock:
+        if key not in _engines:
+            _engines[key] = create_engine(engine.url, poolclass=NullPool, connect_args={'timeout': 30})
+        return _engines[key]
@@ -0,0 +1,88 @@
+"""
+文本压缩模块
+为大文本列提供透明压缩：超过阈值的值以带格式标记的压缩字节存储，短文本保持原样
+"""
+
+import os
+import zlib
+from sqlalchemy.types import TypeDecorator, Text
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # 未安装时只使用zlib
+
+# 格式标记：压缩值以标记开头，便于识别编码方式和日后更换算法
+ZLIB_MARKER = b'\x00zl1'
+ZSTD_MARKER = b'\x00zs1'
+
+COMPRESSION_THRESHOLD = int(os.getenv('NOTE_COMPRESSION_THRESHOLD', '4096'))
+COMPRESSION_CODEC = os.getenv('NOTE_COMPRESSION_CODEC', 'zlib')
+
+
+def compress_text(value, threshold=None):
+    """超过阈值且压缩后更小时返回带标记的字节，否则返回原字符串"""
+    if value is None:
+        return None
+    threshold = COMPRESSION_THRESHOLD if threshold is None else threshold
+    raw = value.encode('utf-8')
+    if threshold < 0 or len(raw) < threshold:
+        return value
+
+    if COMPRESSION_CODEC == 'zstd' and zstandard is not None:
+        packed = ZSTD_MARKER + zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        packed = ZLIB_MARKER + zlib.compress(raw, 6)
+    return packed if len(packed) < len(raw) else value
+
+
+def decompress_text(value):
+    """还原compress_text的结果；普通字符串原样返回"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value.startswith(ZLIB_MARKER):
+        return zlib.decompress(value[len(ZLIB_MARKER):]).decode('utf-8')
+    if value.startswith(ZSTD_MARKER):
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd-compressed text')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(value[len(ZSTD_MARKER):]).decode('utf-8')
+    return value.decode('utf-8')
+
+
+def decompress_prefix(value, max_chars):
+    """只解压压缩值的开头部分，用于从截断的前缀字节生成预览"""
+    if value is None or isinstance(value, str):
+        return (value or '')[:max_chars]
+    value = bytes(value)
+    max_bytes = max_chars * 4
+    if value.startswith(ZLIB_MARKER):
+        raw = zlib.decompressobj().decompress(value[len(ZLIB_MARKER):], max_bytes)
+    elif value.startswith(ZSTD_MARKER) and zstandard is not None:
+        raw = zstandard.ZstdDecompressor().decompressobj().decompress(value[len(ZSTD_MARKER):])[:max_bytes]
+    else:
+        raw = value[:max_bytes]
+    return raw.decode('utf-8', errors='ignore')[:max_chars]
+
+
+class CompressedText(TypeDecorator):
+    """透明压缩的文本列
+
+    仅在SQLite上压缩（SQLite允许TEXT列保存BLOB值），已有的未压缩数据可以照常读取，
+    下次写入时再按阈值压缩。
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def coerce_compared_value(self, op, value):
+        # 比较和LIKE查询的参数按普通文本绑定，不做压缩
+        return Text()
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name != 'sqlite':
+            return value
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
@@ -0,0 +1,96 @@
+"""
+内容指纹模块
+为笔记和待办事项计算稳定的内容指纹（SHA-256），导入时按指纹批量去重并合并已有记录
+"""
+
+import hashlib
+from datetime import datetime
+from sqlalchemy import select, bindparam
+
+
+def _fingerprint(kind, *parts):
+    # 各字段以单元分隔符连接（标题、正文中不会出现）
+    payload = '\x1f'.join(
+        [kind] + ['' if part is None else part.isoformat() if isinstance(part, datetime) else str(part) for part in parts]
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def note_content_hash(title, content, created_at):
+    """笔记指纹：标题、正文和创建时间"""
+    return _fingerprint('note', title, content or '', created_at)
+
+
+def todo_content_hash(title, description, created_at):
+    """待办事项指纹：标题、描述和创建时间
+
+    完成状态、优先级、分类、截止日期等可变字段不参与指纹，重新导入时按导入数据合并。
+    """
+    return _fingerprint('todo', title, description or '', created_at)
+
+
+def parse_import_datetime(value):
+    """解析导入数据中的时间（ISO格式），Invalid时返回None；结果为不带时区的时间，与数据库存储一致"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except (ValueError, AttributeError):
+        return None
+
+
+class ContentHashUpserter:
+    """按 content_hash 批量写入：新指纹插入，已有指纹只在合并列不同时更新
+
+    每批一次查询已有指纹；没有变化的记录不产生任何写入。
+    """
+
+    def upsert(self, connection, table, rows, merge_columns=()):
+        """写入一批行（每行都有content_hash），返回 {'inserted', 'merged', 'unchanged'}"""
+        counts = {'inserted': 0, 'merged': 0, 'unchanged': 0}
+        # 同一批中重复的指纹只保留第一条
+        unique = {}
+        for row in rows:
+            unique.setdefault(row['content_hash'], row)
+        counts['unchanged'] += len(rows) - len(unique)
+        if not unique:
+            return counts
+
+        columns = [table.c.id, table.c.content_hash] + [table.c[name] for name in merge_columns]
+        existing = {
+            content_hash: (row_id, tuple(values))
+            for row_id, content_hash, *values in connection.execute(
+                select(*columns).where(table.c.content_hash.in_(list(unique)))
+            ).all()
+        }
+
+        inserts = []
+        updates = []
+        for content_hash, row in unique.items():
+            current = existing.get(content_hash)
+            if current is None:
+                inserts.append(row)
+                continue
+            row_id, current_values = current
+            values = tuple(row[name] for name in merge_columns)
+            if values != current_values:
+                updates.append({'_id': row_id, **{f'_{name}': value for name, value in zip(merge_columns, values)}})
+            else:
+                counts['unchanged'] += 1
+
+        if inserts:
+            connection.execute(table.insert(), inserts)
+        if updates:
+            connection.execute(
+                table.update()
+                .where(table.c.id == bindparam('_id'))
+                .values({name: bindparam(f'_{name}') for name in merge_columns}),
+                updates
+            )
+        counts['inserted'] += len(inserts)
+        counts['merged'] += len(updates)
+        return counts
+
+
+# 全局按指纹写入实例
+content_hash_upserter = ContentHashUpserter()
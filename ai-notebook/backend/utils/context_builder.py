@@ -0,0 +1,183 @@
+"""
+对话上下文构建模块
+在本地估算token数，按模型的token预算组装发给AI的消息：最早的历史消息最先被丢弃或截断，
+注入的操作数据、文件内容和搜索结果压缩后再放入提示词
+"""
+
+import os
+import re
+import json
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符大约各占一个token，其他字符约4个一个token
+CJK_CHARS = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+MESSAGE_OVERHEAD_TOKENS = 4  # 每条消息的角色和分隔符
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = '\n...[已省略 {count} 个字符]...\n'
+
+
+def estimate_tokens(text):
+    """估算文本的token数（不依赖分词器，偏保守）"""
+    if not text:
+        return 0
+    cjk = len(CJK_CHARS.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / CHARS_PER_TOKEN)
+
+
+def _prefix_within(text, max_tokens):
+    """不超过max_tokens的最长前缀"""
+    # 每个字符至少占1/CHARS_PER_TOKEN个token，先按字符数上限截取，避免扫描整个大文本
+    text = text[:max_tokens * CHARS_PER_TOKEN]
+    cost = 0.0
+    for index, char in enumerate(text):
+        cost += 1 if CJK_CHARS.match(char) else 1 / CHARS_PER_TOKEN
+        if cost > max_tokens:
+            return text[:index]
+    return text
+
+
+def clip_text(text, max_tokens, keep_tail=False):
+    """把文本截断到max_tokens以内并标记省略的字符数
+
+    keep_tail为True时保留开头和结尾（适合文件内容），否则只保留开头。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max(max_tokens - estimate_tokens(TRUNCATION_MARKER.format(count=len(text))), 0)
+    if not keep_tail:
+        head = _prefix_within(text, budget)
+        return head + TRUNCATION_MARKER.format(count=len(text) - len(head)).rstrip('\n')
+    head = _prefix_within(text, budget * 2 // 3)
+    tail = _prefix_within(text[::-1], budget - budget * 2 // 3)[::-1]
+    return head + TRUNCATION_MARKER.format(count=len(text) - len(head) - len(tail)) + tail
+
+
+def compact_payload(value, max_tokens):
+    """压缩注入提示词的工具数据：结构化数据转为紧凑JSON，文本保留首尾摘录
+
+    返回 (压缩后的文本, 是否被截断)
+    """
+    if isinstance(value, str):
+        compacted = clip_text(value, max_tokens, keep_tail=True)
+        return compacted, compacted is not value
+    text = json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+    compacted = clip_text(text, max_tokens)
+    return compacted, compacted is not text
+
+
+class ContextBuilder:
+    """按token预算组装对话消息
+
+    预算分配顺序：系统提示词、话题摘要和当前用户消息 → 注入的工具数据（不超过 PAYLOAD_TOKEN_LIMIT）→
+    从最新到最早填入历史消息，放不下的最早消息被截断或丢弃。
+    """
+
+    DEFAULT_TOKEN_BUDGET = int(os.getenv('AI_CONTEXT_TOKEN_BUDGET', '8000'))
+    PAYLOAD_TOKEN_LIMIT = int(os.getenv('AI_CONTEXT_PAYLOAD_TOKENS', '2000'))
+    SUMMARY_TOKEN_LIMIT = int(os.getenv('AI_CONTEXT_SUMMARY_TOKENS', '1000'))
+    MIN_TRUNCATED_TOKENS = 32  # 剩余预算少于此值时直接丢弃而不是截断
+
+    # 各模型的提示词预算（token），可用 AI_CONTEXT_TOKEN_BUDGETS（JSON对象）覆盖
+    MODEL_TOKEN_BUDGETS = {
+        'openai/gpt-5-chat': 16000,
+        'anthropic/claude-sonnet-4': 16000,
+        'google/gemini-2.5-pro-preview': 16000,
+        'deepseek/deepseek-chat-v3.1:free': 8000,
+        'deepseek/deepseek-r1-0528:free': 8000,
+    }
+
+    def __init__(self):
+        self.model_budgets = dict(self.MODEL_TOKEN_BUDGETS)
+        overrides = os.getenv('AI_CONTEXT_TOKEN_BUDGETS')
+        if overrides:
+            try:
+                self.model_budgets.update({model: int(budget) for model, budget in json.loads(overrides).items()})
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.warning(f"Invalid AI_CONTEXT_TOKEN_BUDGETS: {e}")
+
+    def budget_for(self, model):
+        return self.model_budgets.get(model, self.DEFAULT_TOKEN_BUDGET)
+
+    def build(self, model, system_prompt, history, user_content, attachments=(), summary=None):
+        """组装消息列表，返回 (messages, 预算明细)
+
+        history: 之前的对话 [{'role', 'content'}]，按时间正序
+        user_content: 当前用户消息（包括操作结果说明）
+        attachments: [(标签, 数据)]，数据为文本或可序列化为JSON的对象，压缩后附加到当前用户消息
+        summary: 可选，history之前的对话摘要，作为系统消息放在历史消息前
+        """
+        budget = self.budget_for(model)
+        system_tokens = estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+
+        preamble = []
+        summary_tokens = 0
+        if summary:
+            summary_content = clip_text(f"[之前对话的摘要]:\n{summary}", self.SUMMARY_TOKEN_LIMIT)
+            preamble.append({'role': 'system', 'content': summary_content})
+            summary_tokens = estimate_tokens(summary_content) + MESSAGE_OVERHEAD_TOKENS
+            system_tokens += summary_tokens
+
+        # 当前用户消息必须保留，过长时只保留开头部分
+        user_limit = max(budget - system_tokens - MESSAGE_OVERHEAD_TOKENS, self.MIN_TRUNCATED_TOKENS)
+        user_content = clip_text(user_content, user_limit)
+        user_tokens = estimate_tokens(user_content) + MESSAGE_OVERHEAD_TOKENS
+
+        payload_tokens = 0
+        payload_truncated = False
+        for label, value in attachments:
+            header = f"\n\n[{label}]:\n"
+            remaining = min(
+                self.PAYLOAD_TOKEN_LIMIT - payload_tokens,
+                budget - system_tokens - user_tokens - payload_tokens
+            ) - estimate_tokens(header)
+            if remaining < self.MIN_TRUNCATED_TOKENS:
+                payload_truncated = True
+                break
+            compacted, clipped = compact_payload(value, remaining)
+            payload_truncated = payload_truncated or clipped
+            payload_tokens += estimate_tokens(header) + estimate_tokens(compacted)
+            user_content += header + compacted
+
+        # 从最新的历史消息开始填入剩余预算
+        remaining = budget - system_tokens - user_tokens - payload_tokens
+        kept = []
+        truncated = 0
+        for message in reversed(history):
+            content = message.get('content') or ''
+            if not isinstance(content, str):
+                content = str(content)
+            cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            if cost > remaining:
+                if remaining - MESSAGE_OVERHEAD_TOKENS >= self.MIN_TRUNCATED_TOKENS:
+                    content = clip_text(content, remaining - MESSAGE_OVERHEAD_TOKENS)
+                    kept.append({'role': message.get('role', 'user'), 'content': content})
+                    remaining -= estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+                    truncated += 1
+                break
+            kept.append({'role': message.get('role', 'user'), 'content': content})
+            remaining -= cost
+        kept.reverse()
+        history_tokens = sum(estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in kept)
+
+        messages = [{'role': 'system', 'content': system_prompt}] + preamble + kept + [{'role': 'user', 'content': user_content}]
+        usage = {
+            'budget': budget,
+            'estimated_total': system_tokens + history_tokens + user_tokens + payload_tokens,
+            'system': system_tokens - summary_tokens,
+            'summary': summary_tokens,
+            'history': history_tokens,
+            'user': user_tokens,
+            'payload': payload_tokens,
+            'history_messages': len(kept),
+            'dropped_messages': len(history) - len(kept),
+            'truncated_messages': truncated,
+            'payload_truncated': payload_truncated
+        }
+        return messages, usage
+
+
+# 全局上下文构建实例
+context_builder = ContextBuilder()
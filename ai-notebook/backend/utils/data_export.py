@@ -0,0 +1,120 @@
+"""
+数据导出模块
+以生成器方式分批读取数据并流式输出JSON或NDJSON，可选在线gzip/zstd压缩
+"""
+
+import json
+import os
+import zlib
+import logging
+from sqlalchemy.orm import undefer
+from models import db, Note, Todo, ChatHistory, Setting
+from utils.time_utils import TimeUtils
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # 未安装时不提供zstd压缩
+
+logger = logging.getLogger(__name__)
+
+# 导出的数据集：(字段名, NDJSON记录类型, 模型)
+EXPORT_SECTIONS = (
+    ('notes', 'note', Note),
+    ('todos', 'todo', Todo),
+    ('chat_history', 'chat_history', ChatHistory),
+    ('settings', 'setting', Setting),
+)
+
+EXPORT_FORMATS = ('json', 'ndjson')
+
+
+def available_compressions():
+    """当前环境支持的压缩方式"""
+    return ('gzip', 'zstd') if zstandard is not None else ('gzip',)
+
+
+class DataExporter:
+    """流式数据导出器"""
+
+    BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+    # 累积到该字节数后再向客户端输出一块，避免过多的小块
+    FLUSH_BYTES = 64 * 1024
+
+    def _iter_records(self, model):
+        """按主键顺序分批读取记录（yield_per使用流式游标，不一次性加载全部行）"""
+        primary_key = model.__mapper__.primary_key[0]
+        # undefer('*')：一并读取延迟加载的列（例如笔记正文），避免逐行补查
+        query = model.query.options(undefer('*')).order_by(primary_key).execution_options(stream_results=True)
+        for record in query.yield_per(self.BATCH_SIZE):
+            yield record.to_dict()
+            # 已序列化的对象不再需要保留在会话中
+            db.session.expunge(record)
+
+    def _iter_json(self):
+        """输出与原导出格式相同的单个JSON文档"""
+        yield '{'
+        for index, (field, _, model) in enumerate(EXPORT_SECTIONS):
+            yield ('' if index == 0 else ',') + json.dumps(field) + ':['
+            first = True
+            for item in self._iter_records(model):
+                yield ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+                first = False
+            yield ']'
+        export_time = TimeUtils.now_local().replace(tzinfo=None).isoformat()
+        yield ',"export_time":' + json.dumps(export_time) + '}'
+
+    def _iter_ndjson(self):
+        """每行一条记录：{"type": ..., "data": {...}}"""
+        export_time = TimeUtils.now_local().replace(tzinfo=None).isoformat()
+        yield json.dumps({'type': 'export', 'data': {'export_time': export_time}}) + '\n'
+        for _, record_type, model in EXPORT_SECTIONS:
+            for item in self._iter_records(model):
+                yield json.dumps({'type': record_type, 'data': item}, ensure_ascii=False) + '\n'
+
+    def _buffered(self, pieces):
+        """把小片段合并为较大的字节块"""
+        buffer = []
+        size = 0
+        for piece in pieces:
+            data = piece.encode('utf-8')
+            buffer.append(data)
+            size += len(data)
+            if size >= self.FLUSH_BYTES:
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield b''.join(buffer)
+
+    def _compressed(self, chunks, compression):
+        if compression == 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
+        elif compression == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=3).compressobj()
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
+        else:
+            yield from chunks
+
+    def generate(self, export_format='json', compression=None):
+        """生成导出数据的字节流"""
+        pieces = self._iter_ndjson() if export_format == 'ndjson' else self._iter_json()
+        try:
+            yield from self._compressed(self._buffered(pieces), compression)
+        except Exception as e:
+            # 响应头已发送，只能记录错误并中断输出
+            logger.error(f"Export stream failed: {e}")
+            raise
+
+
+# 全局导出器实例
+data_exporter = DataExporter()
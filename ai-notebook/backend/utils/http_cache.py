@@ -0,0 +1,117 @@
+"""
+HTTP条件请求模块
+基于数据表版本水位生成强ETag，支持 If-None-Match 提前返回304
+"""
+
+import hashlib
+import logging
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, DataVersion
+
+logger = logging.getLogger(__name__)
+
+
+class DataVersionTracker:
+    """数据表版本跟踪器
+
+    每张被跟踪的表在 data_versions 中有一行计数器，
+    由 INSERT/UPDATE/DELETE 触发器在同一事务内递增，因此批量SQL写入和多进程部署同样生效。
+    """
+
+    TRACKED_TABLES = (
+        'notes', 'todos', 'todo_categories', 'todo_occurrence_exceptions',
+        'projects', 'tasks', 'settings', 'topics', 'messages'
+    )
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        """创建版本计数行和触发器（幂等）"""
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                # 其他数据库没有触发器维护版本号，直接关闭条件请求
+                logger.info("Conditional GET disabled: database is not SQLite")
+                return
+
+            try:
+                with db.engine.begin() as conn:
+                    for table_name in self.TRACKED_TABLES:
+                        conn.execute(
+                            text("INSERT OR IGNORE INTO data_versions (table_name, version) VALUES (:name, 0)"),
+                            {'name': table_name}
+                        )
+                        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                            conn.execute(text(
+                                f"CREATE TRIGGER IF NOT EXISTS trg_{table_name}_version_{operation.lower()} "
+                                f"AFTER {operation} ON {table_name} "
+                                f"BEGIN UPDATE data_versions SET version = version + 1 "
+                                f"WHERE table_name = '{table_name}'; END"
+                            ))
+                self.enabled = True
+            except SQLAlchemyError as e:
+                logger.warning(f"Failed to setup data version triggers: {e}")
+                self.enabled = False
+
+    def get_versions(self, tables):
+        """读取若干表的当前版本号"""
+        rows = db.session.query(DataVersion.table_name, DataVersion.version).filter(
+            DataVersion.table_name.in_(tables)
+        ).all()
+        versions = dict(rows)
+        return [versions.get(table_name, 0) for table_name in tables]
+
+
+# 全局版本跟踪器实例
+data_version_tracker = DataVersionTracker()
+
+
+def build_etag(*parts):
+    """由版本水位和请求参数生成ETag"""
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def conditional_get(*tables, row_version=None):
+    """条件GET装饰器
+
+    tables: 响应依赖的表，任一表发生写入都会使ETag失效。
+    row_version: 可选，接收视图参数并返回单行版本标记的函数；返回None时交由视图处理（例如404）。
+    ETag在加载和序列化数据之前计算，命中 If-None-Match 时直接返回304。
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not data_version_tracker.enabled:
+                return f(*args, **kwargs)
+
+            try:
+                if row_version is not None:
+                    token = row_version(**kwargs)
+                    if token is None:
+                        return f(*args, **kwargs)
+                    parts = [request.path, token]
+                else:
+                    parts = [request.full_path] + data_version_tracker.get_versions(tables)
+                etag = build_etag(*parts)
+            except SQLAlchemyError as e:
+                logger.warning(f"Failed to compute ETag: {e}")
+                return f(*args, **kwargs)
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        return decorated_function
+    return decorator
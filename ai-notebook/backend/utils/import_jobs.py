@@ -0,0 +1,210 @@
+"""
+批量导入任务模块
+流式解析上传的JSON文件，在单个事务内分批执行Core executemany写入（按内容指纹去重），并提供可轮询的进度
+"""
+
+import os
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from sqlalchemy import func, select
+from utils.background_engine import get_background_engine
+from utils.json_stream import JSONArrayStream
+from utils.time_utils import TimeUtils
+from utils.content_hash import content_hash_upserter
+
+logger = logging.getLogger(__name__)
+
+
+class ImportJobManager:
+    """导入任务管理器"""
+
+    BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+    JOB_TTL_SECONDS = 3600  # 已结束的任务保留1小时供查询
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def _cleanup(self):
+        """清理过期的已结束任务"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job['finished_at'] and now - job['finished_at'] > self.JOB_TTL_SECONDS
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        """获取任务状态快照"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            status = {key: value for key, value in job.items() if key != 'finished_at'}
+        if status['status'] == 'completed':
+            status['progress'] = 100.0
+        elif status['total_bytes']:
+            status['progress'] = round(min(status['bytes_read'] / status['total_bytes'], 1.0) * 100, 1)
+        else:
+            status['progress'] = 0.0
+        return status
+
+    def start(self, app, kind, upload, key, table, build_row, prepare_batch=None, merge_columns=(),
+              after_import=None, on_complete=None):
+        """保存上传文件并启动后台导入线程
+
+        kind: 任务类型（notes/todos）
+        upload: werkzeug FileStorage
+        key: 顶层为对象时读取的数组字段名
+        table: 目标表（Core Table）
+        build_row: 把JSON元素转换为插入参数字典的函数，返回None表示跳过
+        prepare_batch: 可选，(connection, 插入参数列表) -> None，每批插入前在同一事务内补全参数
+        merge_columns: 按内容指纹匹配到已有记录时需要合并（覆盖）的列
+        after_import: 可选，(connection, 导入前最大id) -> None，在同一事务内执行的后续处理
+        on_complete: 可选，无参数函数，导入事务提交后调用
+        """
+        # 先把上传内容流式写入临时文件，请求结束后后台线程仍可读取
+        fd, path = tempfile.mkstemp(prefix=f'import_{kind}_', suffix='.json')
+        with os.fdopen(fd, 'wb') as temp_file:
+            upload.save(temp_file)
+
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._cleanup()
+            self.jobs[job_id] = {
+                'id': job_id,
+                'kind': kind,
+                'status': 'pending',
+                'bytes_read': 0,
+                'total_bytes': os.path.getsize(path),
+                'processed_count': 0,
+                'imported_count': 0,
+                'merged_count': 0,
+                'unchanged_count': 0,
+                'skipped_count': 0,
+                'error': None,
+                'created_at': TimeUtils.now_local().replace(tzinfo=None).isoformat(),
+                'finished_at': None
+            }
+
+        thread = threading.Thread(
+            target=self._run,
+            args=(app, job_id, path, key, table, build_row, prepare_batch, merge_columns, after_import, on_complete),
+            daemon=True
+        )
+        thread.start()
+        return job_id, thread
+
+    def import_items(self, conn, items, table, build_row, prepare_batch=None, merge_columns=(), on_batch=None):
+        """在给定连接的事务内分批写入items，返回各项计数
+
+        表有content_hash列时按指纹去重：已存在的记录只更新merge_columns中有变化的列，
+        没有变化时不写入；否则直接插入。
+        on_batch: 可选，(计数) -> None，每批写入后调用
+        """
+        counts = {'processed': 0, 'imported': 0, 'merged': 0, 'unchanged': 0, 'skipped': 0}
+        deduplicate = 'content_hash' in table.c
+
+        def write(batch):
+            if prepare_batch:
+                prepare_batch(conn, batch)
+            if deduplicate:
+                result = content_hash_upserter.upsert(conn, table, batch, merge_columns)
+                counts['imported'] += result['inserted']
+                counts['merged'] += result['merged']
+                counts['unchanged'] += result['unchanged']
+            else:
+                conn.execute(table.insert(), batch)
+                counts['imported'] += len(batch)
+            if on_batch:
+                on_batch(counts)
+
+        batch = []
+        for item in items:
+            counts['processed'] += 1
+            row = build_row(item) if isinstance(item, dict) else None
+            if row is None:
+                counts['skipped'] += 1
+            else:
+                batch.append(row)
+            if len(batch) >= self.BATCH_SIZE:
+                write(batch)
+                batch = []
+        if batch:
+            write(batch)
+        return counts
+
+    def _run(self, app, job_id, path, key, table, build_row, prepare_batch, merge_columns, after_import, on_complete):
+        self._update(job_id, status='running')
+        counts = {}
+        try:
+            with app.app_context(), open(path, 'rb') as source:
+                stream = JSONArrayStream(source)
+
+                def report(current):
+                    counts.update(current)
+                    self._update(
+                        job_id,
+                        bytes_read=stream.bytes_read,
+                        processed_count=current['processed'],
+                        imported_count=current['imported'],
+                        merged_count=current['merged'],
+                        unchanged_count=current['unchanged'],
+                        skipped_count=current['skipped']
+                    )
+
+                # 所有批次在同一个事务中提交，失败时整体回滚
+                with get_background_engine().begin() as conn:
+                    start_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+                    counts.update(self.import_items(
+                        conn, stream.iter_items(key), table, build_row,
+                        prepare_batch=prepare_batch, merge_columns=merge_columns, on_batch=report
+                    ))
+
+                    if after_import:
+                        after_import(conn, start_id)
+
+            if on_complete:
+                on_complete()
+
+            self._update(
+                job_id,
+                status='completed',
+                bytes_read=stream.bytes_read,
+                processed_count=counts['processed'],
+                imported_count=counts['imported'],
+                merged_count=counts['merged'],
+                unchanged_count=counts['unchanged'],
+                skipped_count=counts['skipped'],
+                finished_at=time.time()
+            )
+        except Exception as e:
+            logger.error(f"Import job {job_id} failed: {e}")
+            self._update(
+                job_id,
+                status='failed',
+                error=str(e),
+                processed_count=counts.get('processed', 0),
+                imported_count=0,
+                merged_count=0,
+                unchanged_count=0,
+                skipped_count=counts.get('skipped', 0),
+                finished_at=time.time()
+            )
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# 全局导入任务管理器实例
+import_job_manager = ImportJobManager()
@@ -0,0 +1,264 @@
+"""
+流式JSON解析模块
+增量读取大文件中的JSON数组，逐个产出元素，内存占用与单个元素大小相关而与文件大小无关
+"""
+
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+STRUCTURAL = re.compile(r'["\[\]{}]')
+STRING_SPECIAL = re.compile(r'["\\]')
+SCALAR_END = re.compile(r'[,\]}\s]')
+
+
+class JSONStreamError(ValueError):
+    """JSON流格式Error"""
+
+
+class JSONArrayStream:
+    """从文件对象中流式读取JSON数组
+
+    支持两种顶层结构：
+    - 数组本身：[{...}, {...}]
+    - 对象中的某个数组字段：{"notes": [{...}], ...}
+    """
+
+    def __init__(self, fileobj, chunk_size=64 * 1024):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self, keep_from):
+        """读取下一块数据，丢弃keep_from之前已处理的内容，返回丢弃的字符数"""
+        if self.eof:
+            raise JSONStreamError('Unexpected end of JSON input')
+        data = self.fileobj.read(self.chunk_size)
+        self.bytes_read += len(data)
+        if data:
+            text = self.decoder.decode(data)
+        else:
+            self.eof = True
+            text = self.decoder.decode(b'', final=True)
+        self.buffer = self.buffer[keep_from:] + text
+        self.pos -= keep_from
+        return keep_from
+
+    def _peek(self):
+        """跳过空白并返回下一个字符，数据结束时返回None"""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self._fill(self.pos)
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise JSONStreamError(f"Expected '{char}' at byte {self.bytes_read}")
+        self.pos += 1
+
+    def _string_end(self, index, keep):
+        """从字符串开头引号之后的位置开始，返回字符串结束后的位置"""
+        while True:
+            match = STRING_SPECIAL.search(self.buffer, index)
+            if match is None:
+                index = len(self.buffer)
+            elif match.group() == '"':
+                return match.end()
+            elif match.end() < len(self.buffer):
+                index = match.end() + 1
+                continue
+            else:
+                # 反斜杠位于缓冲区末尾，需要读取被转义的字符
+                index = match.start()
+            index -= self._fill(self.pos if keep else index)
+
+    def _value_end(self, keep=True):
+        """返回从self.pos开始的JSON值的结束位置
+
+        keep为False时表示只需跳过该值，读取新数据时会丢弃已扫描的内容。
+        """
+        first = self._peek()
+        if first is None:
+            raise JSONStreamError('Unexpected end of JSON input')
+
+        if first == '"':
+            return self._string_end(self.pos + 1, keep)
+
+        if first not in '[{':
+            while True:
+                match = SCALAR_END.search(self.buffer, self.pos)
+                if match:
+                    return match.start()
+                if self.eof:
+                    return len(self.buffer)
+                self._fill(self.pos)
+
+        index = self.pos
+        depth = 0
+        while True:
+            match = STRUCTURAL.search(self.buffer, index)
+            if match is None:
+                index = len(self.buffer)
+                index -= self._fill(self.pos if keep else index)
+                continue
+            char = match.group()
+            index = match.end()
+            if char == '"':
+                index = self._string_end(index, keep)
+            elif char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return index
+
+    def _compact(self):
+        if self.pos > self.chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+    def _iter_array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            self._peek()
+            end = self._value_end()
+            try:
+                item = json.loads(self.buffer[self.pos:end])
+            except json.JSONDecodeError as e:
+                raise JSONStreamError(f'Invalid JSON value: {e}')
+            self.pos = end
+            self._compact()
+            yield item
+
+            separator = self._peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise JSONStreamError(f'Expected \',\' or \']\' at byte {self.bytes_read}')
+
+    def iter_items(self, key=None):
+        """逐个产出数组元素
+
+        key: 顶层为对象时要读取的数组字段名；顶层为数组时忽略。
+        """
+        first = self._peek()
+        if first == '[':
+            yield from self._iter_array()
+            return
+        if first != '{' or key is None:
+            raise JSONStreamError('Top-level JSON value must be an array or an object')
+
+        self.pos += 1
+        if self._peek() == '}':
+            return
+        while True:
+            if self._peek() != '"':
+                raise JSONStreamError(f'Expected object key at byte {self.bytes_read}')
+            end = self._value_end()
+            field = json.loads(self.buffer[self.pos:end])
+            self.pos = end
+            self._expect(':')
+
+            if field == key:
+                if self._peek() != '[':
+                    raise JSONStreamError(f'Field "{key}" must be an array')
+                yield from self._iter_array()
+                return
+
+            # 跳过不需要的字段（不解析、不保留内容）
+            self._peek()
+            self.pos = self._value_end(keep=False)
+            self._compact()
+
+            separator = self._peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise JSONStreamError(f'Expected \',\' or \'}}\' at byte {self.bytes_read}')
+
+
+class JSONObjectStream:
+    """从分段到达的文本（如AI的流式响应）中逐个提取数组内的JSON对象
+
+    文本中数组前后可以有说明文字或Markdown代码块。数组元素对象的右括号一到达就产出该对象，
+    响应在中途截断时已产出的对象不受影响。
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.start = None  # 当前正在接收的数组元素对象的开始位置
+        self.start_depth = 0
+
+    def feed(self, text):
+        """追加一段文本，返回本段中完整到达的对象列表"""
+        self.buffer += text
+        items = []
+        while True:
+            if self.in_string:
+                match = STRING_SPECIAL.search(self.buffer, self.pos)
+                if match is None:
+                    self.pos = len(self.buffer)
+                    break
+                if match.group() == '\\':
+                    if match.end() >= len(self.buffer):
+                        # 反斜杠位于末尾，等待被转义的字符
+                        self.pos = match.start()
+                        break
+                    self.pos = match.end() + 1
+                    continue
+                self.in_string = False
+                self.pos = match.end()
+                continue
+
+            match = STRUCTURAL.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                break
+            char = match.group()
+            self.pos = match.end()
+            if not self.stack:
+                # JSON结构之外的说明文字：只关心数组或对象的开始
+                if char in '[{':
+                    self.stack.append(char)
+            elif char == '"':
+                self.in_string = True
+            elif char in '[{':
+                if char == '{' and self.start is None and self.stack[-1] == '[':
+                    self.start = match.start()
+                    self.start_depth = len(self.stack)
+                self.stack.append(char)
+            else:
+                self.stack.pop()
+                if char == '}' and self.start is not None and len(self.stack) == self.start_depth:
+                    try:
+                        item = json.loads(self.buffer[self.start:self.pos])
+                    except json.JSONDecodeError:
+                        item = None
+                    if isinstance(item, dict):
+                        items.append(item)
+                    self.start = None
+
+        # 丢弃不再需要的已扫描内容
+        keep_from = self.pos if self.start is None else self.start
+        if keep_from:
+            self.buffer = self.buffer[keep_from:]
+            self.pos -= keep_from
+            if self.start is not None:
+                self.start = 0
+        return items
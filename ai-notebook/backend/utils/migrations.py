@@ -0,0 +1,280 @@
+"""
+数据库迁移模块
+db.create_all() 只创建缺少的表，不会修改已有表；已部署的数据库通过启动时按版本顺序执行的迁移补齐索引和列
+"""
+
+import logging
+from sqlalchemy import inspect, text, select, bindparam
+from sqlalchemy.sql import visitors
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from models import db, SchemaMigration, Note, Todo, Project, Task, TaskEvent, Topic, Message, PRIORITY_RANKS
+from utils.content_hash import note_content_hash, todo_content_hash
+from utils.task_ordering import evenly_spaced_keys
+from utils.task_events import add_flow, DEFAULT_TASK_STATUS
+from utils.time_utils import TimeUtils
+from utils.context_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def ensure_declared_indexes(conn):
+    """创建模型中声明但数据库中缺少的索引（已存在的跳过）
+
+    引用了尚未添加的列的索引（包括部分索引的WHERE条件）也跳过，由添加该列的迁移负责创建。
+    """
+    inspector = inspect(conn)
+    for table in db.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+        existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            columns = {column.name for column in index.columns}
+            where = index.dialect_options['sqlite']['where']
+            if where is not None:
+                columns.update(element.name for element in visitors.iterate(where) if element.__visit_name__ == 'column')
+            if columns <= existing_columns:
+                index.create(conn, checkfirst=True)
+
+
+def add_column(conn, column):
+    """为已有表添加模型中声明的列（已存在的跳过）
+
+    SQLite的 ALTER TABLE ADD COLUMN 不支持非常量默认值，新列的默认值需使用server_default。
+    """
+    table_name = column.table.name
+    existing = {col['name'] for col in inspect(conn).get_columns(table_name)}
+    if column.name in existing:
+        return False
+
+    ddl = f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}'
+    if column.server_default is not None:
+        ddl += f' DEFAULT {column.server_default.arg}'
+        if not column.nullable:
+            ddl += ' NOT NULL'
+    conn.execute(text(ddl))
+    return True
+
+
+def add_todo_priority_rank(conn):
+    """添加todos.priority_rank并按priority回填"""
+    add_column(conn, Todo.__table__.c.priority_rank)
+    cases = ' '.join(f"WHEN '{label}' THEN {rank}" for label, rank in PRIORITY_RANKS.items())
+    conn.execute(text(f"UPDATE todos SET priority_rank = CASE priority {cases} ELSE {PRIORITY_RANKS['medium']} END"))
+    ensure_declared_indexes(conn)
+
+
+def add_todo_recurrence(conn):
+    """添加重复规则相关的列和索引"""
+    add_column(conn, Todo.__table__.c.recurrence_rule)
+    add_column(conn, Todo.__table__.c.recurrence_end)
+    ensure_declared_indexes(conn)
+
+
+def move_todo_categories(conn):
+    """把todos.category字符串迁移到todo_categories表，todos改为通过category_id引用
+
+    旧的category列保留在表中但不再使用（SQLite旧版本不支持DROP COLUMN）。
+    """
+    add_column(conn, Todo.__table__.c.category_id)
+    existing = {col['name'] for col in inspect(conn).get_columns('todos')}
+    if 'category' in existing:
+        conn.execute(text(
+            "INSERT OR IGNORE INTO todo_categories (name, todo_count, completed_count, created_at) "
+            "SELECT DISTINCT category, 0, 0, :now FROM todos WHERE category IS NOT NULL AND category != ''"
+        ), {'now': TimeUtils.now_local().replace(tzinfo=None)})
+        conn.execute(text(
+            "UPDATE todos SET category_id = "
+            "(SELECT id FROM todo_categories WHERE todo_categories.name = todos.category) "
+            "WHERE category IS NOT NULL"
+        ))
+        conn.execute(text("DROP INDEX IF EXISTS ix_todos_category_completed"))
+    # 统计计数器不再按分类计数，删除旧触发器后由启动时重新创建
+    for operation in ('insert', 'delete', 'update'):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS trg_todos_counters_{operation}"))
+    ensure_declared_indexes(conn)
+
+
+def add_content_hashes(conn):
+    """添加notes/todos.content_hash并为已有数据回填指纹
+
+    已有的完全相同的记录只有id最小的一条获得指纹，其余保持为空以满足唯一索引。
+    """
+    for table, body, build_hash in (
+        (Note.__table__, 'content', note_content_hash),
+        (Todo.__table__, 'description', todo_content_hash)
+    ):
+        add_column(conn, table.c.content_hash)
+        seen = {row[0] for row in conn.execute(select(table.c.content_hash).where(table.c.content_hash.isnot(None)))}
+        values = {'content_hash': bindparam('_hash')}
+        if 'updated_at' in table.c:
+            # 回填不是用户修改，保留原更新时间
+            values['updated_at'] = table.c.updated_at
+        statement = table.update().where(table.c.id == bindparam('_id')).values(values)
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(table.c.id, table.c.title, table.c[body], table.c.created_at)
+                .where(table.c.id > last_id, table.c.content_hash.is_(None))
+                .order_by(table.c.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            updates = []
+            for row_id, title, text_body, created_at in rows:
+                content_hash = build_hash(title, text_body, created_at)
+                if content_hash not in seen:
+                    seen.add(content_hash)
+                    updates.append({'_id': row_id, '_hash': content_hash})
+            if updates:
+                conn.execute(statement, updates)
+            last_id = rows[-1][0]
+    ensure_declared_indexes(conn)
+
+
+def add_task_positions(conn):
+    """添加tasks.position并为已有任务回填位置键
+
+    每个 (项目, 状态) 列按原来的显示顺序（创建时间倒序）分配等间距的键。
+    """
+    tasks = Task.__table__
+    add_column(conn, tasks.c.position)
+    rows = conn.execute(
+        select(tasks.c.id, tasks.c.project_id, tasks.c.status)
+        .where(tasks.c.position == '')
+        .order_by(tasks.c.project_id, tasks.c.status, tasks.c.created_at.desc(), tasks.c.id.desc())
+    ).all()
+    columns = {}
+    for task_id, project_id, status in rows:
+        columns.setdefault((project_id, status), []).append(task_id)
+    updates = []
+    for ids in columns.values():
+        updates.extend({'_id': task_id, '_position': key} for task_id, key in zip(ids, evenly_spaced_keys(len(ids))))
+    statement = tasks.update().where(tasks.c.id == bindparam('_id')).values(
+        position=bindparam('_position'), updated_at=tasks.c.updated_at
+    )
+    for start in range(0, len(updates), BACKFILL_BATCH_SIZE):
+        conn.execute(statement, updates[start:start + BACKFILL_BATCH_SIZE])
+    conn.execute(text("DROP INDEX IF EXISTS ix_tasks_project_id_status"))
+    ensure_declared_indexes(conn)
+
+
+def add_task_graph_columns(conn):
+    """添加tasks.estimated_hours和projects.graph_version（task_dependencies表由create_all创建）"""
+    add_column(conn, Task.__table__.c.estimated_hours)
+    add_column(conn, Project.__table__.c.graph_version)
+    ensure_declared_indexes(conn)
+
+
+def seed_task_events(conn):
+    """为已有任务补记创建事件并汇总到 task_flow_daily（task_events表由create_all创建）
+
+    迁移前没有状态历史，已有任务按“创建时即为当前状态”记录。
+    """
+    tasks = Task.__table__
+    events = TaskEvent.__table__
+    now = TimeUtils.now_local().replace(tzinfo=None)
+    rows = conn.execute(
+        select(tasks.c.id, tasks.c.project_id, tasks.c.status, tasks.c.created_at)
+        .where(~tasks.c.id.in_(select(events.c.task_id)))
+        .order_by(tasks.c.id)
+    ).all()
+    flows = {}
+    for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+        batch = rows[start:start + BACKFILL_BATCH_SIZE]
+        conn.execute(events.insert(), [{
+            'project_id': project_id,
+            'task_id': task_id,
+            'event_type': 'created',
+            'from_status': None,
+            'to_status': status or DEFAULT_TASK_STATUS,
+            'created_at': created_at or now
+        } for task_id, project_id, status, created_at in batch])
+        for task_id, project_id, status, created_at in batch:
+            key = (project_id, (created_at or now).date(), status or DEFAULT_TASK_STATUS)
+            flows[key] = flows.get(key, 0) + 1
+    for (project_id, day, status), count in flows.items():
+        add_flow(conn, project_id, day, status, count)
+    ensure_declared_indexes(conn)
+
+
+def add_topic_summary_columns(conn):
+    """添加话题滚动摘要列（已有话题的摘要在下次新增消息时由后台生成）"""
+    topics = Topic.__table__
+    for column in (topics.c.summary, topics.c.summary_message_id, topics.c.summary_updated_at):
+        add_column(conn, column)
+
+
+def add_message_token_counts(conn):
+    """添加messages.token_count并为已有消息回填估算token数"""
+    messages = Message.__table__
+    add_column(conn, messages.c.token_count)
+    statement = messages.update().where(messages.c.id == bindparam('_id')).values(token_count=bindparam('_tokens'))
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(messages.c.id, messages.c.content)
+            .where(messages.c.id > last_id, messages.c.token_count.is_(None))
+            .order_by(messages.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        conn.execute(statement, [{'_id': row_id, '_tokens': estimate_tokens(content)} for row_id, content in rows])
+        last_id = rows[-1][0]
+
+
+# 迁移列表：(版本号, 说明, 迁移函数)，版本号只增不改，迁移函数必须可重复执行
+MIGRATIONS = [
+    (1, 'Create declared indexes for common query shapes', ensure_declared_indexes),
+    (2, 'Add todos.priority_rank for ordinal priority sorting', add_todo_priority_rank),
+    (3, 'Add todos.recurrence_rule and recurrence_end', add_todo_recurrence),
+    (4, 'Move todo categories into todo_categories', move_todo_categories),
+    (5, 'Add content hashes to notes and todos for deduplicating imports', add_content_hashes),
+    (6, 'Add tasks.position for kanban ordering', add_task_positions),
+    (7, 'Add task estimates and project dependency graph versions', add_task_graph_columns),
+    (8, 'Seed task events and daily task flow rollups', seed_task_events),
+    (9, 'Add rolling conversation summaries to topics', add_topic_summary_columns),
+    (10, 'Add messages.token_count for summary thresholds', add_message_token_counts),
+]
+
+
+class MigrationRunner:
+    """按版本顺序执行尚未应用的迁移"""
+
+    def __init__(self, migrations=None):
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda migration: migration[0])
+
+    def get_applied_versions(self):
+        return {version for (version,) in db.session.query(SchemaMigration.version).all()}
+
+    def init_app(self, app):
+        """启动时执行迁移，每个迁移在独立事务中提交，失败时停止后续迁移"""
+        with app.app_context():
+            applied = self.get_applied_versions()
+            db.session.remove()
+
+            for version, description, migrate in self.migrations:
+                if version in applied:
+                    continue
+                try:
+                    with db.engine.begin() as conn:
+                        migrate(conn)
+                        conn.execute(SchemaMigration.__table__.insert().values(
+                            version=version,
+                            description=description,
+                            applied_at=TimeUtils.now_local().replace(tzinfo=None)
+                        ))
+                    logger.info(f"Applied migration {version}: {description}")
+                except IntegrityError:
+                    # 其他进程已同时应用了该迁移
+                    logger.info(f"Migration {version} already applied by another process")
+                except SQLAlchemyError as e:
+                    logger.error(f"Migration {version} failed: {e}")
+                    break
+
+
+# 全局迁移执行器实例
+migration_runner = MigrationRunner()
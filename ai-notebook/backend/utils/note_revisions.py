@@ -0,0 +1,263 @@
+"""
+笔记版本历史模块
+周期性保存完整快照，快照之间只保存相对上一版本的压缩差异
+"""
+
+import difflib
+import hashlib
+import json
+import os
+import zlib
+import logging
+from datetime import timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import defer
+from models import db, Note, NoteRevision
+from utils.time_utils import TimeUtils
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = 'snapshot'
+DELTA = 'delta'
+
+
+def content_checksum(content):
+    return hashlib.sha1((content or '').encode('utf-8')).hexdigest()
+
+
+def encode_delta(old, new):
+    """计算行级差异操作序列
+
+    操作格式：
+    - ['=', n]            保留旧文本接下来的n行
+    - ['-', n]            跳过旧文本接下来的n行
+    - ['+', text]         插入文本
+    - ['*', p, s, text]   改写旧文本的下一行：保留前p个和后s个字符，中间替换为text
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i2 - i1])
+        elif tag == 'delete':
+            ops.append(['-', i2 - i1])
+        elif tag == 'insert':
+            ops.append(['+', ''.join(new_lines[j1:j2])])
+        elif i2 - i1 == 1 and j2 - j1 == 1:
+            # 单行改写（例如长段落中的少量字符修改），只保存变化的部分
+            old_line, new_line = old_lines[i1], new_lines[j1]
+            prefix = 0
+            limit = min(len(old_line), len(new_line))
+            while prefix < limit and old_line[prefix] == new_line[prefix]:
+                prefix += 1
+            suffix = 0
+            limit -= prefix
+            while suffix < limit and old_line[-1 - suffix] == new_line[-1 - suffix]:
+                suffix += 1
+            ops.append(['*', prefix, suffix, new_line[prefix:len(new_line) - suffix]])
+        else:
+            ops.append(['-', i2 - i1])
+            ops.append(['+', ''.join(new_lines[j1:j2])])
+    return ops
+
+
+def apply_delta(old, ops):
+    """把差异操作序列应用到旧文本上"""
+    old_lines = old.splitlines(keepends=True)
+    position = 0
+    output = []
+    for op in ops:
+        if op[0] == '=':
+            output.extend(old_lines[position:position + op[1]])
+            position += op[1]
+        elif op[0] == '-':
+            position += op[1]
+        elif op[0] == '+':
+            output.append(op[1])
+        elif op[0] == '*':
+            line = old_lines[position]
+            output.append(line[:op[1]] + op[3] + line[len(line) - op[2]:])
+            position += 1
+        else:
+            raise ValueError(f'Unknown delta op: {op[0]}')
+    return ''.join(output)
+
+
+class NoteRevisionStore:
+    """笔记版本存储
+
+    读取任意版本最多需要一个快照加上不超过 SNAPSHOT_INTERVAL - 1 个差异。
+    """
+
+    # 每隔多少个版本保存一次完整快照
+    SNAPSHOT_INTERVAL = int(os.getenv('NOTE_REVISION_SNAPSHOT_INTERVAL', '20'))
+    # 距离最新版本创建不足该秒数的保存会合并进最新版本（0表示不合并）
+    COALESCE_SECONDS = int(os.getenv('NOTE_REVISION_COALESCE_SECONDS', '60'))
+    # 每篇笔记最多保留的版本数（0表示不限）
+    MAX_REVISIONS = int(os.getenv('NOTE_REVISION_MAX_COUNT', '200'))
+    # 版本最长保留天数（0表示不限），最新版本始终保留
+    MAX_AGE_DAYS = int(os.getenv('NOTE_REVISION_MAX_AGE_DAYS', '0'))
+
+    def _latest(self, note_id, session=None):
+        return (session or db.session).query(NoteRevision).filter_by(note_id=note_id).order_by(NoteRevision.revision.desc()).first()
+
+    def _store(self, revision, base_content, content, allow_delta):
+        """优先保存差异；差异不比快照小时保存快照"""
+        snapshot = zlib.compress(content.encode('utf-8'))
+        if allow_delta and base_content is not None:
+            delta = zlib.compress(json.dumps(encode_delta(base_content, content), ensure_ascii=False).encode('utf-8'))
+            if len(delta) < len(snapshot):
+                revision.kind = DELTA
+                revision.data = delta
+                revision.stored_size = len(delta)
+                return
+        revision.kind = SNAPSHOT
+        revision.data = snapshot
+        revision.stored_size = len(snapshot)
+
+    def _chain_allows_delta(self, note_id, revision_number, session=None):
+        """判断在该版本号写入差异是否仍在快照间隔之内"""
+        last_snapshot = (session or db.session).query(db.func.max(NoteRevision.revision)).filter(
+            NoteRevision.note_id == note_id,
+            NoteRevision.kind == SNAPSHOT,
+            NoteRevision.revision < revision_number
+        ).scalar()
+        return last_snapshot is not None and revision_number - last_snapshot < self.SNAPSHOT_INTERVAL
+
+    def get_content(self, note_id, revision_number, session=None):
+        """重建指定版本的内容：最近的快照 + 之后的差异链"""
+        session = session or db.session
+        snapshot = session.query(NoteRevision).filter(
+            NoteRevision.note_id == note_id,
+            NoteRevision.kind == SNAPSHOT,
+            NoteRevision.revision <= revision_number
+        ).order_by(NoteRevision.revision.desc()).first()
+        if snapshot is None:
+            return None
+
+        content = zlib.decompress(snapshot.data).decode('utf-8')
+        deltas = session.query(NoteRevision).filter(
+            NoteRevision.note_id == note_id,
+            NoteRevision.revision > snapshot.revision,
+            NoteRevision.revision <= revision_number
+        ).order_by(NoteRevision.revision.asc()).all()
+        for delta in deltas:
+            content = apply_delta(content, json.loads(zlib.decompress(delta.data).decode('utf-8')))
+        return content
+
+    def record(self, note, previous_content=None, session=None):
+        """记录笔记的当前内容为新版本（加入当前会话，由调用方提交）
+
+        previous_content: 本次修改前的内容；与最新版本一致时可直接作为差异基准，避免重建。
+        session: 可选，note所在的会话（默认db.session）
+        """
+        session = session or db.session
+        content = note.content or ''
+        checksum = content_checksum(content)
+        now = TimeUtils.now_local().replace(tzinfo=None)
+        tip = self._latest(note.id, session)
+
+        if tip and tip.checksum == checksum and tip.title == note.title:
+            return tip
+
+        if tip and self.COALESCE_SECONDS > 0 and tip.created_at and \
+                now - tip.created_at < timedelta(seconds=self.COALESCE_SECONDS):
+            # 合并到最新版本：相对其前一版本重新计算
+            base_content = self.get_content(note.id, tip.revision - 1, session) if tip.kind == DELTA else None
+            self._store(tip, base_content, content, allow_delta=tip.kind == DELTA)
+            tip.title = note.title
+            tip.checksum = checksum
+            tip.content_length = len(content)
+            return tip
+
+        revision = NoteRevision(
+            note_id=note.id,
+            revision=tip.revision + 1 if tip else 1,
+            title=note.title,
+            checksum=checksum,
+            content_length=len(content),
+            created_at=now
+        )
+        if tip:
+            if previous_content is not None and content_checksum(previous_content) == tip.checksum:
+                base_content = previous_content
+            else:
+                base_content = self.get_content(note.id, tip.revision, session)
+            allow_delta = self._chain_allows_delta(note.id, revision.revision, session)
+        else:
+            base_content, allow_delta = None, False
+        self._store(revision, base_content, content, allow_delta)
+        session.add(revision)
+        session.flush()
+
+        self.prune(note.id, revision.revision, session)
+        return revision
+
+    def prune(self, note_id, latest_revision, session=None):
+        """按数量和时间清理旧版本，保留的第一个版本若是差异则转为快照"""
+        session = session or db.session
+        cutoff = 0
+        if self.MAX_REVISIONS > 0:
+            cutoff = max(cutoff, latest_revision - self.MAX_REVISIONS)
+        if self.MAX_AGE_DAYS > 0:
+            expire_before = TimeUtils.now_local().replace(tzinfo=None) - timedelta(days=self.MAX_AGE_DAYS)
+            expired = session.query(db.func.max(NoteRevision.revision)).filter(
+                NoteRevision.note_id == note_id,
+                NoteRevision.created_at < expire_before,
+                NoteRevision.revision < latest_revision
+            ).scalar()
+            cutoff = max(cutoff, expired or 0)
+        if cutoff <= 0:
+            return
+
+        first_kept = session.query(NoteRevision).filter(
+            NoteRevision.note_id == note_id,
+            NoteRevision.revision > cutoff
+        ).order_by(NoteRevision.revision.asc()).first()
+        if first_kept is None:
+            return
+        if first_kept.kind == DELTA:
+            content = self.get_content(note_id, first_kept.revision, session)
+            self._store(first_kept, None, content, allow_delta=False)
+
+        session.query(NoteRevision).filter(
+            NoteRevision.note_id == note_id,
+            NoteRevision.revision <= cutoff
+        ).delete(synchronize_session=False)
+
+    def list_revisions(self, note_id):
+        """列出版本元数据（不读取数据列）"""
+        revisions = NoteRevision.query.options(defer(NoteRevision.data)).filter_by(
+            note_id=note_id
+        ).order_by(NoteRevision.revision.desc()).all()
+        return [revision.to_dict() for revision in revisions]
+
+    def diff(self, note_id, from_revision, to_revision=None, current_content=None):
+        """生成两个版本之间的unified diff；to_revision为None时与当前内容比较"""
+        old = self.get_content(note_id, from_revision)
+        if old is None:
+            return None
+        if to_revision is None:
+            new, to_label = current_content or '', 'current'
+        else:
+            new, to_label = self.get_content(note_id, to_revision), f'r{to_revision}'
+            if new is None:
+                return None
+        return ''.join(difflib.unified_diff(
+            old.splitlines(keepends=True),
+            new.splitlines(keepends=True),
+            fromfile=f'r{from_revision}',
+            tofile=to_label
+        ))
+
+
+# 全局版本存储实例
+revision_store = NoteRevisionStore()
+
+
+@event.listens_for(Note, 'after_delete')
+def _delete_note_revisions(mapper, connection, target):
+    connection.execute(NoteRevision.__table__.delete().where(NoteRevision.note_id == target.id))
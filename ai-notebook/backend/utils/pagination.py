@@ -0,0 +1,73 @@
+"""
+分页工具模块
+提供键集（keyset）分页所需的游标编解码和参数解析
+"""
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class CursorError(ValueError):
+    """游标格式Invalid"""
+
+
+def encode_cursor(*values):
+    """把排序键编码为不透明的URL安全游标"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """解码游标，返回长度为size的排序键列表"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError) as e:
+        raise CursorError(f'Invalid cursor: {e}')
+
+    if not isinstance(values, list) or len(values) != size:
+        raise CursorError('Invalid cursor: unexpected payload')
+    return values
+
+
+def parse_datetime(value):
+    """解析游标中的ISO时间"""
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError) as e:
+        raise CursorError(f'Invalid cursor: {e}')
+
+
+def parse_limit(value, default=50, maximum=200):
+    """解析每页条数，限制在 [1, maximum] 范围内"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def keyset_condition(column, value, id_column, last_id, descending=True):
+    """生成“位于游标之后”的过滤条件，排序为 (column, id_column) 同向
+
+    按SQLite的NULL排序规则处理可空列：升序时NULL在最前，降序时NULL在最后。
+    """
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < last_id)
+        return or_(
+            column < value,
+            and_(column == value, id_column < last_id),
+            column.is_(None)
+        )
+    if value is None:
+        return or_(
+            and_(column.is_(None), id_column > last_id),
+            column.isnot(None)
+        )
+    return or_(column > value, and_(column == value, id_column > last_id))
@@ -0,0 +1,145 @@
+"""
+AI项目规划模块
+流式接收AI生成的任务数组，每个任务对象完整到达时立即写入数据库并推送给客户端；
+响应中途截断时已写入的任务保留
+"""
+
+import json
+import logging
+from models import db, Task, Setting
+from utils.ai_client import AIStreamError
+from utils.json_stream import JSONObjectStream
+from utils.task_graph import task_graph, parse_duration_hours, TaskGraphError
+
+logger = logging.getLogger(__name__)
+
+# AI没有返回任何任务时使用的默认任务
+DEFAULT_PLAN_TASKS = [
+    {'title': '项目启动', 'description': '初始化项目环境和Configuration'},
+    {'title': '需求分析', 'description': '分析和整理项目需求'},
+    {'title': '设计阶段', 'description': 'Completed项目设计和架构'},
+    {'title': '开发实现', 'description': '编码实现核心功能'},
+    {'title': '测试验证', 'description': '测试功能和Repair问题'},
+    {'title': '项目交付', 'description': 'Completed项目并交付成果'}
+]
+
+
+def build_breakdown_prompt(name, description):
+    """项目任务分解提示词"""
+    return f"""你是一个项目规划专家。根据用户提供的项目Info，分解成一个JSON数组的任务。每个任务对象包含'title'、'description'、
+'estimated_hours'（预估工时，小时）和'dependencies'（必须先Completed的前置任务标题列表）。
+
+项目名称：{name}
+描述：{description}
+
+请返回一个JSON数组，包含5-8个具体的任务，每个任务都应该是可执行的步骤，前置任务排在依赖它的任务之前。
+格式示例：
+[
+  {{"title": "需求分析", "description": "分析项目需求和目标", "estimated_hours": 16, "dependencies": []}},
+  {{"title": "技术选型", "description": "选择合适的技术栈和工具", "estimated_hours": 8, "dependencies": ["需求分析"]}}
+]"""
+
+
+def format_event(event, payload):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class ProjectPlanner:
+    """流式AI项目规划"""
+
+    def get_api_key(self):
+        """OpenRouter API密钥：优先使用加密保存的密钥，其次是未加密的旧Settings，都没有时返回None"""
+        api_key_setting = Setting.query.filter_by(key='apiProviders.openrouter.apiKey', is_encrypted=True).first()
+        if api_key_setting and api_key_setting.value:
+            from utils.encryption import EncryptionManager
+            return EncryptionManager().decrypt(api_key_setting.value)
+
+        api_key_setting = Setting.query.filter_by(key='openrouter_api_key').first()
+        if api_key_setting and api_key_setting.value:
+            return api_key_setting.value
+        return None
+
+    def _create_task(self, project_id, task_data, plan):
+        """把AI返回的任务对象写入数据库并提交，格式Invalid时返回None
+
+        plan: 本次规划的状态 {'titles': 标题→任务, 'waiting': 前置任务标题→等待它的任务, 'edges': 项目依赖边}
+        """
+        title = task_data.get('title')
+        if not isinstance(title, str) or not title.strip():
+            return None
+        description = task_data.get('description')
+        priority = task_data.get('priority')
+        task = Task(
+            project_id=project_id,
+            title=title.strip()[:200],
+            description=description if isinstance(description, str) else '',
+            status='todo',
+            priority=priority if priority in ('low', 'medium', 'high') else 'medium',
+            estimated_hours=parse_duration_hours(task_data.get('estimated_hours', task_data.get('estimated_time')))
+        )
+        db.session.add(task)
+        db.session.flush()
+
+        # 依赖按标题引用；引用了尚未到达的任务时，等该任务写入后再连边
+        dependencies = task_data.get('dependencies')
+        for name in dependencies if isinstance(dependencies, list) else ():
+            if not isinstance(name, str):
+                continue
+            prerequisite = plan['titles'].get(name.strip())
+            if prerequisite is None:
+                plan['waiting'].setdefault(name.strip(), []).append(task)
+            else:
+                self._link(task, prerequisite, plan)
+        for dependent in plan['waiting'].pop(task.title, []):
+            self._link(dependent, task, plan)
+        plan['titles'].setdefault(task.title, task)
+
+        db.session.commit()
+        return task
+
+    def _link(self, task, prerequisite, plan):
+        try:
+            task_graph.add_dependency(task, prerequisite, edges=plan['edges'])
+        except TaskGraphError as e:
+            logger.info(f"Skipped AI task dependency {task.id} -> {prerequisite.id}: {e}")
+
+    def stream_tasks(self, project_id, client, prompt, use_defaults=False):
+        """流式生成并写入任务，逐个产出 (事件名, 数据)
+
+        - ('task', 任务字典)：每个任务写入后立即产出
+        - ('done', {'project_id', 'task_count', 'truncated', 'error'})：规划结束
+        use_defaults: AI响应中没有任何任务时写入默认任务
+        """
+        parser = JSONObjectStream()
+        plan = {'titles': {}, 'waiting': {}, 'edges': list(task_graph.load_edges(project_id))}
+        task_count = 0
+        error = None
+        try:
+            for text in client.stream_chat_completion([{"role": "user", "content": prompt}]):
+                for task_data in parser.feed(text):
+                    task = self._create_task(project_id, task_data, plan)
+                    if task is not None:
+                        task_count += 1
+                        yield 'task', task.to_dict()
+        except AIStreamError as e:
+            error = str(e)
+            logger.warning(f"AI project planning stream failed after {task_count} tasks: {e}")
+
+        if task_count == 0 and use_defaults and error is None:
+            for task_data in DEFAULT_PLAN_TASKS:
+                task = self._create_task(project_id, task_data, plan)
+                task_count += 1
+                yield 'task', task.to_dict()
+
+        yield 'done', {
+            'project_id': project_id,
+            'task_count': task_count,
+            # 数组没有闭合或请求中途Failed
+            'truncated': error is not None or bool(parser.stack),
+            'error': error
+        }
+
+
+# 全局项目规划实例
+project_planner = ProjectPlanner()
@@ -0,0 +1,226 @@
+"""
+重复规则模块
+解析RRULE子集（FREQ=DAILY/WEEKLY/MONTHLY, INTERVAL, COUNT, UNTIL, BYDAY），
+按查询窗口直接定位并惰性生成重复事项的各次发生时间
+"""
+
+import calendar
+import re
+from datetime import datetime, timedelta
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+# 常用简写
+RULE_SHORTCUTS = {
+    'daily': 'FREQ=DAILY',
+    'weekly': 'FREQ=WEEKLY',
+    'monthly': 'FREQ=MONTHLY',
+    'weekdays': 'FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR'
+}
+
+MAX_COUNT = 10000
+UNTIL_FORMAT = re.compile(r'^(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2})Z?)?$')
+
+
+class RecurrenceError(ValueError):
+    """重复规则Invalid"""
+
+
+def _parse_until(value):
+    match = UNTIL_FORMAT.match(value)
+    try:
+        if match:
+            parts = [int(part) for part in match.groups() if part is not None]
+            if len(parts) == 3:
+                # 只有日期时包含当天全天
+                return datetime(*parts, 23, 59, 59)
+            return datetime(*parts)
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise RecurrenceError(f'Invalid UNTIL: {value}')
+
+
+class RecurrenceRule:
+    """重复规则，首次发生时间（DTSTART）为待办事项的截止时间"""
+
+    def __init__(self, freq, interval=1, count=None, until=None, byday=None):
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        # BYDAY只用于WEEKLY，保存为排序后的星期序号（0=周一）
+        self.byday = sorted(set(byday)) if byday else None
+
+    @classmethod
+    def parse(cls, value):
+        """解析规则字符串，支持简写（daily/weekly/monthly/weekdays）"""
+        if not isinstance(value, str) or not value.strip():
+            raise RecurrenceError('Recurrence rule must be a non-empty string')
+        value = value.strip()
+        value = RULE_SHORTCUTS.get(value.lower(), value)
+        if value.upper().startswith('RRULE:'):
+            value = value[6:]
+
+        fields = {}
+        for part in value.split(';'):
+            if not part:
+                continue
+            name, _, field_value = part.partition('=')
+            if not field_value:
+                raise RecurrenceError(f'Invalid rule part: {part}')
+            fields[name.strip().upper()] = field_value.strip()
+
+        freq = fields.pop('FREQ', '').upper()
+        if freq not in FREQUENCIES:
+            raise RecurrenceError(f'Unsupported FREQ: {freq or "missing"}')
+        try:
+            interval = int(fields.pop('INTERVAL', '1'))
+            count = int(fields.pop('COUNT')) if 'COUNT' in fields else None
+        except ValueError:
+            raise RecurrenceError('INTERVAL and COUNT must be integers')
+        if interval < 1 or (count is not None and not 1 <= count <= MAX_COUNT):
+            raise RecurrenceError('INTERVAL or COUNT out of range')
+        until = _parse_until(fields.pop('UNTIL')) if 'UNTIL' in fields else None
+
+        byday = None
+        if 'BYDAY' in fields:
+            if freq != 'WEEKLY':
+                raise RecurrenceError('BYDAY is only supported with FREQ=WEEKLY')
+            days = [day.strip().upper() for day in fields.pop('BYDAY').split(',')]
+            if not days or any(day not in WEEKDAYS for day in days):
+                raise RecurrenceError('Invalid BYDAY')
+            byday = [WEEKDAYS.index(day) for day in days]
+
+        if fields:
+            raise RecurrenceError(f'Unsupported rule parts: {", ".join(sorted(fields))}')
+        return cls(freq, interval, count, until, byday)
+
+    def to_string(self):
+        """规范化的规则字符串"""
+        parts = [f'FREQ={self.freq}']
+        if self.interval != 1:
+            parts.append(f'INTERVAL={self.interval}')
+        if self.byday:
+            parts.append('BYDAY=' + ','.join(WEEKDAYS[day] for day in self.byday))
+        if self.count is not None:
+            parts.append(f'COUNT={self.count}')
+        if self.until is not None:
+            parts.append('UNTIL=' + self.until.strftime('%Y%m%dT%H%M%S'))
+        return ';'.join(parts)
+
+    def _periods(self, start, window_start):
+        """从包含window_start的周期开始，产出 (该周期之前的发生次数, 周期内的发生时间列表)"""
+        if self.freq == 'MONTHLY':
+            # 跳过没有该日期的月份（例如31日）。有COUNT时需要从头计数，
+            # 否则直接从窗口前一个周期开始（序号不再使用）
+            period = 0
+            if self.count is None and window_start is not None and window_start > start:
+                months = (window_start.year - start.year) * 12 + window_start.month - start.month
+                period = max(months // self.interval - 1, 0)
+            index = 0
+            while True:
+                month_index = start.month - 1 + period * self.interval
+                year, month = start.year + month_index // 12, month_index % 12 + 1
+                if start.day <= calendar.monthrange(year, month)[1]:
+                    yield index, [start.replace(year=year, month=month)]
+                    index += 1
+                else:
+                    yield index, []
+                period += 1
+
+        if self.freq == 'WEEKLY' and self.byday:
+            week0 = (start - timedelta(days=start.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+            step = timedelta(weeks=self.interval)
+            first_week = [
+                week0 + timedelta(days=day) + (start - start.replace(hour=0, minute=0, second=0, microsecond=0))
+                for day in self.byday
+            ]
+            first_week = [occurrence for occurrence in first_week if occurrence >= start]
+            period = 0
+            if window_start is not None and window_start > week0:
+                period = (window_start - week0) // step
+            index = 0 if period == 0 else len(first_week) + (period - 1) * len(self.byday)
+            while True:
+                if period == 0:
+                    occurrences = first_week
+                else:
+                    week_start = week0 + period * step
+                    occurrences = [
+                        week_start + timedelta(days=day) + (start - start.replace(hour=0, minute=0, second=0, microsecond=0))
+                        for day in self.byday
+                    ]
+                yield index, occurrences
+                index += len(occurrences)
+                period += 1
+
+        # DAILY和不带BYDAY的WEEKLY：每个周期一次，直接计算窗口内第一次的序号
+        step = timedelta(days=self.interval) if self.freq == 'DAILY' else timedelta(weeks=self.interval)
+        index = 0
+        if window_start is not None and window_start > start:
+            index = -((start - window_start) // step)  # 向上取整
+        while True:
+            yield index, [start + index * step]
+            index += 1
+
+    def occurrences(self, start, window_start=None, window_end=None):
+        """按时间顺序产出 [window_start, window_end) 内的发生时间
+
+        生成从窗口所在周期开始，耗时只与窗口内的发生次数有关，与规则已持续的时间无关。
+        """
+        for index, period_occurrences in self._periods(start, window_start):
+            for occurrence in period_occurrences:
+                if self.count is not None and index >= self.count:
+                    return
+                if self.until is not None and occurrence > self.until:
+                    return
+                if window_end is not None and occurrence >= window_end:
+                    return
+                index += 1
+                if window_start is None or occurrence >= window_start:
+                    yield occurrence
+
+    def is_occurrence(self, start, value):
+        """value是否恰好是一次发生时间"""
+        return next(self.occurrences(start, value, value + timedelta(microseconds=1)), None) == value
+
+    def previous_occurrence(self, start, at_or_before, last_occurrence=None):
+        """不晚于指定时间的最后一次发生时间，没有时返回None
+
+        last_occurrence: 可选，已知的最后一次发生时间（例如保存的recurrence_end），避免重新计算
+        """
+        if self.until is not None:
+            at_or_before = min(at_or_before, self.until)
+        if last_occurrence is not None and at_or_before >= last_occurrence:
+            return last_occurrence
+        # 开始时间不一定是一次发生（例如WEEKLY的BYDAY不包含开始日期），早于第一次发生时没有结果
+        first = next(self.occurrences(start), None)
+        if first is None or at_or_before < first:
+            return None
+        if self.freq == 'DAILY':
+            lookback = timedelta(days=self.interval)
+        elif self.freq == 'WEEKLY':
+            lookback = timedelta(weeks=self.interval)
+        else:
+            # 跳过不存在日期的月份时间隔可能超过一个周期
+            lookback = timedelta(days=366 * self.interval)
+        last = None
+        for occurrence in self.occurrences(start, max(start, at_or_before - lookback), at_or_before + timedelta(microseconds=1)):
+            last = occurrence
+        if last is None and self.count is not None:
+            # 回看窗口内没有发生时间时，只有最后一次发生不晚于指定时间才说明COUNT已在此之前用完
+            last = self.last_occurrence(start)
+            if last is not None and last > at_or_before:
+                return None
+        return last
+
+    def last_occurrence(self, start):
+        """最后一次发生时间；无限重复时返回None"""
+        if self.count is not None:
+            last = None
+            for last in self.occurrences(start):
+                pass
+            return last
+        if self.until is not None:
+            return self.previous_occurrence(start, self.until)
+        return None
@@ -0,0 +1,165 @@
+"""
+重复待办事项模块
+重复事项只保存一行规则和已完成/跳过的例外记录，查询时在请求的时间窗口内惰性生成各次发生
+"""
+
+import heapq
+from itertools import islice
+from sqlalchemy import tuple_
+from models import db, Todo, TodoOccurrenceException, recurrence_end_for
+from utils.recurrence import RecurrenceRule, RecurrenceError
+from utils.pagination import keyset_condition
+
+OCCURRENCE_STATUSES = ('pending', 'completed', 'skipped')
+
+
+class RecurringTodoService:
+    """重复待办事项的校验、窗口展开和例外记录"""
+
+    def normalize_rule(self, recurrence_rule, due_date):
+        """校验重复规则并返回规范化字符串；空值表示取消重复"""
+        if not recurrence_rule:
+            return None
+        if due_date is None:
+            raise RecurrenceError('重复事项需要设置截止日期（首次发生时间）')
+        rule = RecurrenceRule.parse(recurrence_rule)
+        if (rule.count is not None or rule.until is not None) and rule.last_occurrence(due_date) is None:
+            raise RecurrenceError('重复规则在截止日期之后没有任何发生')
+        return rule.to_string()
+
+    def _occurrence_dict(self, base, occurrence, status):
+        item = dict(base)
+        item['due_date'] = occurrence.isoformat()
+        item['occurrence_date'] = occurrence.isoformat()
+        item['occurrence_status'] = status
+        item['completed'] = status == 'completed'
+        return item
+
+    def _iter_series(self, todo, exceptions, lower, window_end, after, status_filter):
+        """产出单个重复事项在窗口内的发生：(时间, id, dict)"""
+        rule = RecurrenceRule.parse(todo.recurrence_rule)
+        base = todo.to_dict()
+        for occurrence in rule.occurrences(todo.due_date, lower, window_end):
+            if after is not None and (occurrence, todo.id) <= after:
+                continue
+            status = 'completed' if todo.is_completed else exceptions.get((todo.id, occurrence), 'pending')
+            if status_filter and status != status_filter:
+                continue
+            yield occurrence, todo.id, self._occurrence_dict(base, occurrence, status)
+
+    def list_window(self, base_query, window_start, window_end, status=None, after=None, limit=50):
+        """列出 [window_start, window_end) 内的普通事项和重复事项的各次发生
+
+        按 (截止时间, id) 升序合并，after为上一页最后一项的 (截止时间, id)。
+        返回最多 limit + 1 项 (时间, id, dict)，调用方据此判断是否还有下一页。
+        status: pending / completed / None（全部）
+        """
+        lower = window_start if after is None else max(window_start, after[0])
+
+        single_query = base_query.filter(
+            Todo.recurrence_rule.is_(None),
+            Todo.due_date >= window_start,
+            Todo.due_date < window_end
+        )
+        if status == 'pending':
+            single_query = single_query.filter(Todo.is_completed == False)
+        elif status == 'completed':
+            single_query = single_query.filter(Todo.is_completed == True)
+        if after is not None:
+            single_query = single_query.filter(keyset_condition(Todo.due_date, after[0], Todo.id, after[1], descending=False))
+        singles = single_query.order_by(Todo.due_date.asc(), Todo.id.asc()).limit(limit + 1).all()
+
+        # 窗口开始前已结束的重复事项由 recurrence_end 排除
+        masters = base_query.filter(
+            Todo.recurrence_rule.isnot(None),
+            Todo.due_date < window_end,
+            db.or_(Todo.recurrence_end.is_(None), Todo.recurrence_end >= lower)
+        ).all()
+
+        exceptions = {}
+        if masters:
+            rows = db.session.query(
+                TodoOccurrenceException.todo_id,
+                TodoOccurrenceException.occurrence_date,
+                TodoOccurrenceException.status
+            ).filter(
+                TodoOccurrenceException.todo_id.in_([todo.id for todo in masters]),
+                TodoOccurrenceException.occurrence_date >= lower,
+                TodoOccurrenceException.occurrence_date < window_end
+            ).all()
+            exceptions = {(todo_id, occurrence): value for todo_id, occurrence, value in rows}
+
+        streams = [((todo.due_date, todo.id, todo.to_dict()) for todo in singles)]
+        streams.extend(
+            self._iter_series(todo, exceptions, lower, window_end, after, status)
+            for todo in masters
+        )
+        merged = heapq.merge(*streams, key=lambda item: (item[0], item[1]))
+        return list(islice(merged, limit + 1))
+
+    def set_occurrence_status(self, todo, occurrence_date, status):
+        """设置单次发生的状态：completed/skipped 写入例外记录，pending 删除例外记录"""
+        if not todo.recurrence_rule:
+            raise RecurrenceError('该待办事项不是重复事项')
+        if status not in OCCURRENCE_STATUSES:
+            raise RecurrenceError(f'Invalid status: {status}')
+        rule = RecurrenceRule.parse(todo.recurrence_rule)
+        if not rule.is_occurrence(todo.due_date, occurrence_date):
+            raise RecurrenceError('该时间不是此重复事项的一次发生')
+
+        exception = TodoOccurrenceException.query.filter_by(todo_id=todo.id, occurrence_date=occurrence_date).first()
+        if status == 'pending':
+            if exception is not None:
+                db.session.delete(exception)
+        elif exception is None:
+            db.session.add(TodoOccurrenceException(todo_id=todo.id, occurrence_date=occurrence_date, status=status))
+        else:
+            exception.status = status
+        return self._occurrence_dict(todo.to_dict(), occurrence_date, status)
+
+    def overdue_summary(self, now):
+        """重复事项的逾期统计：最近一次已到期的发生未完成（也未跳过）时计为逾期
+
+        每个重复事项只需计算一次发生时间并批量查询例外记录，成本与重复已持续的时间无关。
+        """
+        masters = db.session.query(
+            Todo.id, Todo.due_date, Todo.recurrence_rule, Todo.recurrence_end
+        ).filter(
+            Todo.recurrence_rule.isnot(None),
+            Todo.is_completed == False,
+            Todo.due_date <= now
+        ).all()
+
+        latest = {}
+        for todo_id, due_date, recurrence_rule, recurrence_end in masters:
+            try:
+                occurrence = RecurrenceRule.parse(recurrence_rule).previous_occurrence(due_date, now, recurrence_end)
+            except RecurrenceError:
+                continue
+            if occurrence is not None:
+                latest[todo_id] = occurrence
+
+        handled = set()
+        if latest:
+            handled = set(db.session.query(
+                TodoOccurrenceException.todo_id,
+                TodoOccurrenceException.occurrence_date
+            ).filter(
+                tuple_(TodoOccurrenceException.todo_id, TodoOccurrenceException.occurrence_date).in_(list(latest.items()))
+            ).all())
+        return {
+            'active_series': len(masters),
+            'overdue': sum(1 for key in latest.items() if key not in handled)
+        }
+
+    def build_import_fields(self, recurrence_rule, due_date):
+        """导入时的重复规则字段（规则无效时按普通事项导入）"""
+        try:
+            rule = self.normalize_rule(recurrence_rule, due_date)
+        except RecurrenceError:
+            rule = None
+        return {'recurrence_rule': rule, 'recurrence_end': recurrence_end_for(rule, due_date)}
+
+
+# 全局重复事项服务实例
+recurring_todos = RecurringTodoService()
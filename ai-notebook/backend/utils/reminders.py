@@ -0,0 +1,311 @@
+"""
+待办事项到期提醒模块
+后台线程按最小堆中最近的截止时间休眠，到期时向订阅的客户端推送提醒事件（SSE）；
+重复事项在堆中只有下一次发生，提醒后按规则推入再下一次
+"""
+
+import os
+import heapq
+import json
+import queue
+import threading
+import logging
+from datetime import timedelta
+from sqlalchemy import event, or_, select, tuple_
+from sqlalchemy.orm import Session
+from models import Todo, TodoCategory, TodoOccurrenceException
+from utils.recurrence import RecurrenceRule, RecurrenceError
+from utils.time_utils import TimeUtils
+from utils.pagination import keyset_condition
+from utils.background_engine import get_background_engine
+
+logger = logging.getLogger(__name__)
+
+
+class ReminderScheduler:
+    """到期提醒调度器
+
+    - 未完成且截止时间在未来的待办事项按 (due_date, id) 放入最小堆
+    - 堆在第一个客户端订阅时才通过 (is_completed, due_date) 索引范围查询分批加载
+    - 未结束的重复事项在首次加载时全部读入，堆中只保存下一次发生；提醒时跳过已完成/跳过的发生，
+      并按规则推入再下一次
+    - ORM写入提交后更新调度；绕过ORM的批量写入调用invalidate()重新加载
+    - 没有订阅者或没有待提醒事项时线程无限期等待，不做任何检查
+    """
+
+    ENABLED = os.getenv('TODO_REMINDERS_ENABLED', 'true').lower() == 'true'
+    LOAD_BATCH_SIZE = int(os.getenv('TODO_REMINDERS_LOAD_BATCH', '500'))
+    KEEPALIVE_SECONDS = 25
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.condition = threading.Condition()
+        self.heap = []
+        self.scheduled = {}  # todo_id -> due_date，用于识别堆中的过期条目
+        self.series = {}  # 重复事项 todo_id -> (规则, 首次发生时间)
+        self.loaded = False
+        self.loaded_until = None  # 已加载的 (due_date, id) 上界，None表示全部加载
+        self.subscribers = set()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        if not self.ENABLED or self._thread is not None:
+            return
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name='todo-reminders', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _now():
+        return TimeUtils.now_local().replace(tzinfo=None)
+
+    def _load_next_batch(self):
+        """加载下一批即将到期的待办事项（调用方持有condition）
+
+        在独立连接上只读查询，不使用db.session：共享连接归还时的回滚会丢弃其他请求已flush未提交的写入
+        """
+        now = self._now()
+        todos = Todo.__table__
+        with self.app.app_context():
+            engine = get_background_engine()
+        query = select(todos.c.id, todos.c.due_date).where(
+            todos.c.is_completed == False,
+            todos.c.recurrence_rule.is_(None)
+        )
+        if self.loaded:
+            due_date, todo_id = self.loaded_until
+            query = query.where(keyset_condition(todos.c.due_date, due_date, todos.c.id, todo_id, descending=False))
+        else:
+            query = query.where(todos.c.due_date > now)
+        query = query.order_by(todos.c.due_date.asc(), todos.c.id.asc()).limit(self.LOAD_BATCH_SIZE)
+        with engine.connect() as conn:
+            rows = conn.execute(query).all()
+            series = []
+            if not self.loaded:
+                series = conn.execute(
+                    select(todos.c.id, todos.c.due_date, todos.c.recurrence_rule).where(
+                        todos.c.is_completed == False,
+                        todos.c.recurrence_rule.isnot(None),
+                        or_(todos.c.recurrence_end.is_(None), todos.c.recurrence_end > now)
+                    )
+                ).all()
+
+        for todo_id, due_date in rows:
+            self._push(todo_id, due_date)
+        for todo_id, due_date, recurrence_rule in series:
+            self._schedule_series(todo_id, due_date, recurrence_rule, now)
+        self.loaded = True
+        # 未取满一批说明已加载全部；否则以最后一条为上界，之后的写入等到下次加载
+        self.loaded_until = (rows[-1][1], rows[-1][0]) if len(rows) == self.LOAD_BATCH_SIZE else None
+
+    def _push(self, todo_id, due_date):
+        self.scheduled[todo_id] = due_date
+        heapq.heappush(self.heap, (due_date, todo_id))
+
+    def _schedule_series(self, todo_id, due_date, recurrence_rule, after):
+        """把重复事项晚于after的下一次发生放入堆，没有下一次时移除（调用方持有condition）"""
+        try:
+            rule = RecurrenceRule.parse(recurrence_rule)
+        except RecurrenceError:
+            self.series.pop(todo_id, None)
+            return
+        self.series[todo_id] = (rule, due_date)
+        self._advance_series(todo_id, after)
+
+    def _advance_series(self, todo_id, after):
+        rule, start = self.series[todo_id]
+        occurrence = next(rule.occurrences(start, after + timedelta(microseconds=1)), None)
+        if occurrence is None:
+            del self.series[todo_id]
+            return
+        self._push(todo_id, occurrence)
+
+    def update(self, changes):
+        """应用已提交的待办事项变更：[(todo_id, due_date, is_completed, deleted, recurrence_rule)]"""
+        if not self.enabled:
+            return
+        with self.condition:
+            if not self.loaded:
+                return
+            now = self._now()
+            for todo_id, due_date, is_completed, deleted, recurrence_rule in changes:
+                self.scheduled.pop(todo_id, None)
+                self.series.pop(todo_id, None)
+                if deleted or is_completed or due_date is None:
+                    continue
+                if recurrence_rule:
+                    # 重复事项已全部加载，不受分批上界限制
+                    self._schedule_series(todo_id, due_date, recurrence_rule, now)
+                    continue
+                if due_date <= now:
+                    continue
+                if self.loaded_until is not None and (due_date, todo_id) > self.loaded_until:
+                    continue
+                self._push(todo_id, due_date)
+            self.condition.notify()
+
+    def invalidate(self):
+        """丢弃已加载的调度，下次需要时重新加载"""
+        if not self.enabled:
+            return
+        with self.condition:
+            self.heap = []
+            self.scheduled = {}
+            self.series = {}
+            self.loaded = False
+            self.loaded_until = None
+            self.condition.notify()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=100)
+        with self.condition:
+            self.subscribers.add(subscriber)
+            self.condition.notify()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.condition:
+            self.subscribers.discard(subscriber)
+        if not self.subscribers:
+            # 没有订阅者时释放调度数据，下次订阅时从当前时间重新加载
+            self.invalidate()
+
+    def listen(self, subscriber):
+        """逐条产出SSE格式的事件，空闲时定期发送注释保持连接"""
+        while True:
+            try:
+                payload = subscriber.get(timeout=self.KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield f"event: todo_due\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def _publish(self, due):
+        """推送到期提醒，due: [(todo_id, 到期时间)]；重复事项中已完成或跳过的发生不提醒"""
+        occurrences = dict(due)
+        todos = Todo.__table__
+        categories = TodoCategory.__table__
+        exceptions = TodoOccurrenceException.__table__
+        with self.app.app_context():
+            engine = get_background_engine()
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(
+                    todos.c.id, todos.c.title, todos.c.due_date, todos.c.priority,
+                    categories.c.name.label('category'), todos.c.recurrence_rule
+                ).select_from(
+                    todos.outerjoin(categories, todos.c.category_id == categories.c.id)
+                ).where(todos.c.id.in_(list(occurrences)), todos.c.is_completed == False)
+            ).all()
+            handled = set()
+            recurring = [(row.id, occurrences[row.id]) for row in rows if row.recurrence_rule]
+            if recurring:
+                handled = set(conn.execute(
+                    select(exceptions.c.todo_id, exceptions.c.occurrence_date).where(
+                        tuple_(exceptions.c.todo_id, exceptions.c.occurrence_date).in_(recurring)
+                    )
+                ).all())
+
+        payloads = []
+        for row in rows:
+            payload = {
+                'id': row.id,
+                'title': row.title,
+                'due_date': row.due_date.isoformat() if row.due_date else None,
+                'priority': row.priority,
+                'category': row.category
+            }
+            if row.recurrence_rule:
+                if (row.id, occurrences[row.id]) in handled:
+                    continue
+                payload['due_date'] = payload['occurrence_date'] = occurrences[row.id].isoformat()
+            payloads.append(payload)
+
+        with self.condition:
+            subscribers = list(self.subscribers)
+        for payload in payloads:
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(payload)
+                except queue.Full:
+                    logger.warning("Reminder subscriber queue full, dropping event")
+
+    def _next_timeout(self):
+        """距离下一次提醒的秒数；None表示无限期等待（调用方持有condition）"""
+        while self.heap:
+            due_date, todo_id = self.heap[0]
+            if self.scheduled.get(todo_id) != due_date:
+                heapq.heappop(self.heap)  # 已被修改或删除的过期条目
+                continue
+            return max((due_date - self._now()).total_seconds(), 0)
+        return None
+
+    def _run(self):
+        while True:
+            due = []
+            with self.condition:
+                if not self.subscribers:
+                    self.condition.wait()
+                    continue
+                try:
+                    if not self.loaded:
+                        self._load_next_batch()
+                    timeout = self._next_timeout()
+                    if timeout is None and self.loaded_until is not None:
+                        self._load_next_batch()
+                        continue
+                except Exception as e:
+                    logger.error(f"Failed to load todo reminders: {e}")
+                    self.condition.wait(60)
+                    continue
+
+                if timeout is None or timeout > 0:
+                    self.condition.wait(timeout)
+                    continue
+
+                now = self._now()
+                while self.heap and self.heap[0][0] <= now:
+                    due_date, todo_id = heapq.heappop(self.heap)
+                    if self.scheduled.get(todo_id) == due_date:
+                        del self.scheduled[todo_id]
+                        due.append((todo_id, due_date))
+                        if todo_id in self.series:
+                            # 错过的发生（例如线程被挂起）不再补发
+                            self._advance_series(todo_id, now)
+
+            if due:
+                try:
+                    self._publish(due)
+                except Exception as e:
+                    logger.error(f"Failed to publish todo reminders: {e}")
+
+
+# 全局提醒调度器实例
+reminder_scheduler = ReminderScheduler()
+
+
+@event.listens_for(Todo, 'after_insert')
+@event.listens_for(Todo, 'after_update')
+def _collect_todo_change(mapper, connection, target):
+    changes = Session.object_session(target).info.setdefault('todo_reminder_changes', [])
+    changes.append((target.id, target.due_date, bool(target.is_completed), False, target.recurrence_rule))
+
+
+@event.listens_for(Todo, 'after_delete')
+def _collect_todo_delete(mapper, connection, target):
+    changes = Session.object_session(target).info.setdefault('todo_reminder_changes', [])
+    changes.append((target.id, None, True, True, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_todo_changes(session):
+    changes = session.info.pop('todo_reminder_changes', None)
+    if changes:
+        reminder_scheduler.update(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_todo_changes(session):
+    session.info.pop('todo_reminder_changes', None)
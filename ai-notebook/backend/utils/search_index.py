@@ -0,0 +1,266 @@
+"""
+全文搜索索引模块
+基于SQLite FTS5为笔记和待办事项提供BM25排序、前缀匹配和高亮摘要
+"""
+
+import html
+import re
+import logging
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Note, Todo
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符范围（逐字切分，以支持任意子串搜索）
+CJK_RANGES = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+CJK_PATTERN = re.compile(f'([{CJK_RANGES}])')
+# 查询词元：单个CJK字符，或连续的字母数字
+QUERY_TOKEN_PATTERN = re.compile(f'[{CJK_RANGES}]|[^\\W_{CJK_RANGES}]+')
+
+# 零宽空格：unicode61分词器视其为分隔符，且在摘要中可以无损去除
+SEGMENT_SEPARATOR = '\u200b'
+HIGHLIGHT_OPEN = '\u0002'
+HIGHLIGHT_CLOSE = '\u0003'
+
+
+class SearchIndex:
+    """笔记和待办事项的FTS5全文索引"""
+
+    NOTES_TABLE = 'notes_fts'
+    TODOS_TABLE = 'todos_fts'
+
+    # BM25列权重：标题命中比正文命中更重要
+    TITLE_WEIGHT = 5.0
+    BODY_WEIGHT = 1.0
+
+    SNIPPET_TOKENS = 32
+    BACKFILL_BATCH_SIZE = 500
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        """创建索引表，并在首次创建时回填已有数据"""
+        with app.app_context():
+            engine = db.engine
+            if engine.dialect.name != 'sqlite':
+                logger.info("Full-text index disabled: database is not SQLite")
+                return
+
+            try:
+                with engine.begin() as conn:
+                    existing = {
+                        row[0] for row in conn.execute(text(
+                            "SELECT name FROM sqlite_master WHERE type = 'table' "
+                            "AND name IN ('notes_fts', 'todos_fts')"
+                        ))
+                    }
+                    if self.NOTES_TABLE not in existing:
+                        conn.execute(text(
+                            f"CREATE VIRTUAL TABLE {self.NOTES_TABLE} USING fts5(title, content)"
+                        ))
+                    if self.TODOS_TABLE not in existing:
+                        conn.execute(text(
+                            f"CREATE VIRTUAL TABLE {self.TODOS_TABLE} USING fts5(title, description)"
+                        ))
+
+                    if self.NOTES_TABLE not in existing:
+                        self._backfill(conn, Note.__table__, 'content', self.NOTES_TABLE)
+                    if self.TODOS_TABLE not in existing:
+                        self._backfill(conn, Todo.__table__, 'description', self.TODOS_TABLE)
+
+                self.enabled = True
+                logger.info("Full-text index ready")
+            except SQLAlchemyError as e:
+                # 例如SQLite未编译FTS5，此时回退到LIKE搜索
+                logger.warning(f"Full-text index unavailable, falling back to LIKE search: {e}")
+                self.enabled = False
+
+    @staticmethod
+    def segment(value):
+        """在CJK字符两侧插入分隔符，使每个汉字成为独立词元"""
+        if not value:
+            return ''
+        return CJK_PATTERN.sub(SEGMENT_SEPARATOR + r'\1' + SEGMENT_SEPARATOR, value)
+
+    @staticmethod
+    def build_match_query(query):
+        """将用户输入转换为安全的FTS5 MATCH表达式
+
+        每个空白分隔的词转换为一个短语前缀查询，词之间为AND关系。
+        返回None表示查询中没有可搜索的词元。
+        """
+        phrases = []
+        for term in (query or '').split():
+            tokens = QUERY_TOKEN_PATTERN.findall(term)
+            if tokens:
+                phrases.append('"' + ' '.join(tokens) + '"*')
+        return ' '.join(phrases) if phrases else None
+
+    @staticmethod
+    def _clean_snippet(value):
+        """去除分隔符并转义HTML，最后把高亮标记替换为<mark>"""
+        if value is None:
+            return None
+        value = html.escape(value.replace(SEGMENT_SEPARATOR, ''))
+        return value.replace(HIGHLIGHT_OPEN, '<mark>').replace(HIGHLIGHT_CLOSE, '</mark>')
+
+    def _backfill(self, conn, table, body_column, fts_table, after_id=0):
+        """分批把id大于after_id的已有数据写入索引"""
+        last_id = after_id
+        while True:
+            rows = conn.execute(
+                db.select(table.c.id, table.c.title, table.c[body_column])
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(self.BACKFILL_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            conn.execute(
+                text(f"INSERT OR REPLACE INTO {fts_table}(rowid, title, {body_column}) VALUES (:id, :title, :body)"),
+                [
+                    {'id': row[0], 'title': self.segment(row[1]), 'body': self.segment(row[2])}
+                    for row in rows
+                ]
+            )
+            last_id = rows[-1][0]
+
+    def _upsert(self, connection, fts_table, body_column, row_id, title, body):
+        connection.execute(text(f"DELETE FROM {fts_table} WHERE rowid = :id"), {'id': row_id})
+        connection.execute(
+            text(f"INSERT INTO {fts_table}(rowid, title, {body_column}) VALUES (:id, :title, :body)"),
+            {'id': row_id, 'title': self.segment(title), 'body': self.segment(body)}
+        )
+
+    def _remove(self, connection, fts_table, row_id):
+        connection.execute(text(f"DELETE FROM {fts_table} WHERE rowid = :id"), {'id': row_id})
+
+    def index_note(self, connection, note_id, title, content):
+        """写入或更新单篇笔记的索引（与数据写入处于同一事务）"""
+        if self.enabled:
+            self._upsert(connection, self.NOTES_TABLE, 'content', note_id, title, content)
+
+    def index_todo(self, connection, todo_id, title, description):
+        """写入或更新单个待办事项的索引"""
+        if self.enabled:
+            self._upsert(connection, self.TODOS_TABLE, 'description', todo_id, title, description)
+
+    def index_notes_after(self, connection, after_id):
+        """为批量导入（绕过ORM事件）的笔记建立索引"""
+        if self.enabled:
+            self._backfill(connection, Note.__table__, 'content', self.NOTES_TABLE, after_id)
+
+    def index_todos_after(self, connection, after_id):
+        """为批量导入的待办事项建立索引"""
+        if self.enabled:
+            self._backfill(connection, Todo.__table__, 'description', self.TODOS_TABLE, after_id)
+
+    def index_todos(self, connection, rows):
+        """批量写入或更新待办事项索引，rows为 (id, title, description) 列表"""
+        if self.enabled and rows:
+            connection.execute(
+                text(f"INSERT OR REPLACE INTO {self.TODOS_TABLE}(rowid, title, description) VALUES (:id, :title, :body)"),
+                [{'id': row[0], 'title': self.segment(row[1]), 'body': self.segment(row[2])} for row in rows]
+            )
+
+    def remove_todos(self, connection, todo_ids):
+        """批量移除待办事项索引"""
+        if self.enabled and todo_ids:
+            connection.execute(
+                text(f"DELETE FROM {self.TODOS_TABLE} WHERE rowid = :id"),
+                [{'id': todo_id} for todo_id in todo_ids]
+            )
+
+    def remove_note(self, connection, note_id):
+        if self.enabled:
+            self._remove(connection, self.NOTES_TABLE, note_id)
+
+    def remove_todo(self, connection, todo_id):
+        if self.enabled:
+            self._remove(connection, self.TODOS_TABLE, todo_id)
+
+    def clear(self, connection=None):
+        """清空索引（配合批量Delete使用）"""
+        if not self.enabled:
+            return
+        connection = connection or db.session.connection()
+        connection.execute(text(f"DELETE FROM {self.NOTES_TABLE}"))
+        connection.execute(text(f"DELETE FROM {self.TODOS_TABLE}"))
+
+    def _search(self, fts_table, body_column, query, limit):
+        match_query = self.build_match_query(query)
+        if not self.enabled or not match_query:
+            return None
+
+        sql = text(
+            f"SELECT rowid, bm25({fts_table}, :title_weight, :body_weight) AS rank, "
+            f"snippet({fts_table}, 0, :open, :close, '...', :tokens) AS title_snippet, "
+            f"snippet({fts_table}, 1, :open, :close, '...', :tokens) AS body_snippet "
+            f"FROM {fts_table} WHERE {fts_table} MATCH :query "
+            f"ORDER BY rank LIMIT :limit"
+        )
+        try:
+            rows = db.session.execute(sql, {
+                'title_weight': self.TITLE_WEIGHT,
+                'body_weight': self.BODY_WEIGHT,
+                'open': HIGHLIGHT_OPEN,
+                'close': HIGHLIGHT_CLOSE,
+                'tokens': self.SNIPPET_TOKENS,
+                'query': match_query,
+                'limit': limit
+            }).fetchall()
+        except SQLAlchemyError as e:
+            logger.warning(f"Full-text search failed, falling back to LIKE search: {e}")
+            return None
+
+        return [
+            {
+                'id': row[0],
+                'score': -row[1],
+                'highlight': {
+                    'title': self._clean_snippet(row[2]),
+                    body_column: self._clean_snippet(row[3])
+                }
+            }
+            for row in rows
+        ]
+
+    def search_notes(self, query, limit=10):
+        """搜索笔记，按BM25相关度排序
+
+        返回 [{'id', 'score', 'highlight'}]；索引不可用时返回None，调用方应回退到LIKE搜索。
+        """
+        return self._search(self.NOTES_TABLE, 'content', query, limit)
+
+    def search_todos(self, query, limit=10):
+        """搜索待办事项，返回格式同search_notes"""
+        return self._search(self.TODOS_TABLE, 'description', query, limit)
+
+
+# 全局搜索索引实例
+search_index = SearchIndex()
+
+
+# ORM事件：在同一连接（同一事务）内维护索引
+@event.listens_for(Note, 'after_insert')
+@event.listens_for(Note, 'after_update')
+def _index_note(mapper, connection, target):
+    search_index.index_note(connection, target.id, target.title, target.content)
+
+
+@event.listens_for(Note, 'after_delete')
+def _remove_note(mapper, connection, target):
+    search_index.remove_note(connection, target.id)
+
+
+@event.listens_for(Todo, 'after_insert')
+@event.listens_for(Todo, 'after_update')
+def _index_todo(mapper, connection, target):
+    search_index.index_todo(connection, target.id, target.title, target.description)
+
+
+@event.listens_for(Todo, 'after_delete')
+def _remove_todo(mapper, connection, target):
+    search_index.remove_todo(connection, target.id)
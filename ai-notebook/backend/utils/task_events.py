@@ -0,0 +1,118 @@
+"""
+任务事件日志模块
+任务的创建、状态变化和Delete在同一事务中追加到 task_events，并增量累加到按天汇总的 task_flow_daily；
+燃尽图/累积流图只读取按天汇总的数据，不扫描事件
+"""
+
+import logging
+from datetime import timedelta
+from sqlalchemy import event, func, inspect
+from models import db, Task, TaskEvent, TaskFlowDaily, PROJECT_TASK_STATUSES
+from utils.time_utils import TimeUtils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TASK_STATUS = 'todo'
+DONE_STATUS = 'done'
+
+
+def add_flow(connection, project_id, day, status, delta):
+    """在给定连接的事务内累加某天某状态的任务数变化量"""
+    flows = TaskFlowDaily.__table__
+    result = connection.execute(
+        flows.update()
+        .where(flows.c.project_id == project_id, flows.c.day == day, flows.c.status == status)
+        .values(delta=flows.c.delta + delta)
+    )
+    if result.rowcount == 0:
+        connection.execute(flows.insert().values(project_id=project_id, day=day, status=status, delta=delta))
+
+
+class TaskEventLog:
+    """任务事件日志和每日状态汇总
+
+    每个事件只更新当天的一到两行汇总；读取某段时间的序列时，
+    起始日之前的汇总做一次分组求和作为基数，之后逐日累加。
+    """
+
+    MAX_DAYS = 366
+
+    def record(self, connection, task, event_type, from_status=None, to_status=None):
+        """在给定连接的事务内记录一个任务事件并更新当天的汇总"""
+        now = TimeUtils.now_local().replace(tzinfo=None)
+        connection.execute(TaskEvent.__table__.insert().values(
+            project_id=task.project_id,
+            task_id=task.id,
+            event_type=event_type,
+            from_status=from_status,
+            to_status=to_status,
+            created_at=now
+        ))
+        if from_status is not None:
+            add_flow(connection, task.project_id, now.date(), from_status, -1)
+        if to_status is not None:
+            add_flow(connection, task.project_id, now.date(), to_status, 1)
+
+    def get_events(self, task_id):
+        """任务的事件历史，按时间顺序"""
+        return TaskEvent.query.filter_by(task_id=task_id).order_by(TaskEvent.created_at, TaskEvent.id).all()
+
+    def burndown(self, project_id, start, end):
+        """start到end（包含）每天结束时各状态的任务数、总数、剩余数和已完成数"""
+        base = dict(db.session.query(TaskFlowDaily.status, func.sum(TaskFlowDaily.delta)).filter(
+            TaskFlowDaily.project_id == project_id,
+            TaskFlowDaily.day < start
+        ).group_by(TaskFlowDaily.status).all())
+        changes = {}
+        for day, status, delta in db.session.query(TaskFlowDaily.day, TaskFlowDaily.status, TaskFlowDaily.delta).filter(
+            TaskFlowDaily.project_id == project_id,
+            TaskFlowDaily.day >= start,
+            TaskFlowDaily.day <= end
+        ).all():
+            changes.setdefault(day, []).append((status, delta))
+
+        statuses = list(PROJECT_TASK_STATUSES) + sorted(
+            {status for status in base if status not in PROJECT_TASK_STATUSES} |
+            {status for items in changes.values() for status, _ in items if status not in PROJECT_TASK_STATUSES}
+        )
+        counts = {status: base.get(status) or 0 for status in statuses}
+        series = []
+        day = start
+        while day <= end:
+            for status, delta in changes.get(day, ()):
+                counts[status] += delta
+            total = sum(counts.values())
+            series.append({
+                'date': day.isoformat(),
+                'counts': dict(counts),
+                'total': total,
+                'completed': counts[DONE_STATUS],
+                'remaining': total - counts[DONE_STATUS]
+            })
+            day += timedelta(days=1)
+        return {'statuses': statuses, 'series': series}
+
+
+# 全局任务事件日志实例
+task_event_log = TaskEventLog()
+
+
+@event.listens_for(Task, 'after_insert')
+def _record_task_created(mapper, connection, target):
+    task_event_log.record(connection, target, 'created', to_status=target.status or DEFAULT_TASK_STATUS)
+
+
+@event.listens_for(Task, 'after_update')
+def _record_task_status_change(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if not history.has_changes():
+        return
+    from_status = (history.deleted[0] if history.deleted else None) or DEFAULT_TASK_STATUS
+    to_status = target.status or DEFAULT_TASK_STATUS
+    if from_status != to_status:
+        task_event_log.record(connection, target, 'status_changed', from_status=from_status, to_status=to_status)
+
+
+@event.listens_for(Task, 'after_delete')
+def _record_task_deleted(mapper, connection, target):
+    task_event_log.record(connection, target, 'deleted', from_status=target.status or DEFAULT_TASK_STATUS)
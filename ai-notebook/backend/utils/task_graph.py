@@ -0,0 +1,266 @@
+"""
+任务依赖图模块
+项目内的任务依赖构成有向无环图：添加依赖时检测循环，排期按拓扑顺序一次遍历计算最早开始时间和关键路径，
+结果按项目的 graph_version 缓存，依赖图变化前重复请求不再计算
+"""
+
+import os
+import re
+import threading
+import logging
+from collections import OrderedDict, deque
+from sqlalchemy import text, select
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Project, Task, TaskDependency
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_DAY = 8
+HOURS_PER_WEEK = 40
+DURATION_UNITS = (
+    (re.compile(r'周|week', re.IGNORECASE), HOURS_PER_WEEK),
+    (re.compile(r'天|日|day', re.IGNORECASE), HOURS_PER_DAY),
+)
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+class TaskGraphError(ValueError):
+    """依赖Invalid（例如会形成循环）"""
+
+
+def parse_duration_hours(value):
+    """把AI返回的工期（数字小时，或 "3-5天"、"1-2周"、"4小时" 等文本）换算为小时，无法识别时返回None
+
+    范围取平均值。
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    if not isinstance(value, str):
+        return None
+    numbers = [float(number) for number in NUMBER.findall(value)]
+    if not numbers:
+        return None
+    hours = sum(numbers) / len(numbers)
+    for pattern, unit_hours in DURATION_UNITS:
+        if pattern.search(value):
+            hours *= unit_hours
+            break
+    return hours if hours > 0 else None
+
+
+def _graph_version_bump(project):
+    return f"UPDATE projects SET graph_version = graph_version + 1 WHERE id = {project}; "
+
+
+class TaskGraphService:
+    """任务依赖图
+
+    - 添加依赖前从前置任务沿依赖边搜索，能到达当前任务时拒绝（O(V+E)）
+    - 排期：Kahn拓扑排序 + 正向/反向各一次遍历，整体 O(V+E)
+    - SQLite上由触发器维护 projects.graph_version，排期结果按 (项目, 版本) 缓存
+    """
+
+    DEFAULT_TASK_HOURS = float(os.getenv('TASK_DEFAULT_HOURS', str(HOURS_PER_DAY)))
+    CACHE_SIZE = int(os.getenv('TASK_SCHEDULE_CACHE_SIZE', '256'))
+
+    def __init__(self):
+        self.enabled = False
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """创建依赖图版本触发器（幂等）"""
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                logger.info("Task schedule cache disabled: database is not SQLite")
+                return
+
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_tasks_graph_insert AFTER INSERT ON tasks "
+                        f"BEGIN {_graph_version_bump('NEW.project_id')}END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_tasks_graph_delete AFTER DELETE ON tasks "
+                        f"BEGIN {_graph_version_bump('OLD.project_id')}END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_tasks_graph_update "
+                        "AFTER UPDATE OF project_id, estimated_hours ON tasks "
+                        f"BEGIN {_graph_version_bump('OLD.project_id')}{_graph_version_bump('NEW.project_id')}END"
+                    ))
+                    for operation, row in (('insert', 'NEW'), ('delete', 'OLD')):
+                        conn.execute(text(
+                            f"CREATE TRIGGER IF NOT EXISTS trg_task_dependencies_graph_{operation} "
+                            f"AFTER {operation.upper()} ON task_dependencies "
+                            f"BEGIN {_graph_version_bump(f'{row}.project_id')}END"
+                        ))
+                self.enabled = True
+            except SQLAlchemyError as e:
+                logger.warning(f"Failed to setup task graph triggers: {e}")
+                self.enabled = False
+
+    def load_edges(self, project_id):
+        """项目的依赖边列表 [(task_id, depends_on_id)]"""
+        edges = TaskDependency.__table__
+        return db.session.execute(
+            select(edges.c.task_id, edges.c.depends_on_id).where(edges.c.project_id == project_id)
+        ).all()
+
+    def _find_path(self, edges, start, target):
+        """沿依赖边从start搜索到target的路径（任务id列表），不可达时返回None"""
+        prerequisites = {}
+        for task_id, depends_on_id in edges:
+            prerequisites.setdefault(task_id, []).append(depends_on_id)
+        previous = {start: None}
+        pending = deque([start])
+        while pending:
+            current = pending.popleft()
+            if current == target:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = previous[current]
+                return path[::-1]
+            for depends_on_id in prerequisites.get(current, ()):
+                if depends_on_id not in previous:
+                    previous[depends_on_id] = current
+                    pending.append(depends_on_id)
+        return None
+
+    def add_dependency(self, task, depends_on, edges=None):
+        """添加依赖：task 在 depends_on 完成后才能开始。不提交事务
+
+        edges: 可选，调用方已加载的项目依赖边（批量添加时复用，新边会追加进去）
+        """
+        if depends_on is None or depends_on.project_id != task.project_id:
+            raise TaskGraphError('前置任务必须属于同一项目')
+        if depends_on.id == task.id:
+            raise TaskGraphError('任务不能依赖自身')
+        if edges is None:
+            edges = self.load_edges(task.project_id)
+        if (task.id, depends_on.id) in edges:
+            return None
+
+        # 前置任务（直接或间接）依赖当前任务时，新边会形成循环
+        cycle = self._find_path(edges, depends_on.id, task.id)
+        if cycle is not None:
+            raise TaskGraphError(f"添加该依赖会形成循环: {' → '.join(str(task_id) for task_id in [task.id] + cycle)}")
+
+        dependency = TaskDependency(project_id=task.project_id, task_id=task.id, depends_on_id=depends_on.id)
+        db.session.add(dependency)
+        edges.append((task.id, depends_on.id))
+        return dependency
+
+    def remove_dependency(self, task_id, depends_on_id):
+        """Delete依赖，返回是否存在。不提交事务"""
+        return TaskDependency.query.filter_by(task_id=task_id, depends_on_id=depends_on_id).delete() > 0
+
+    def remove_task(self, task_id):
+        """Delete任务相关的全部依赖边。不提交事务"""
+        TaskDependency.query.filter(db.or_(
+            TaskDependency.task_id == task_id,
+            TaskDependency.depends_on_id == task_id
+        )).delete(synchronize_session=False)
+
+    def _compute(self, project_id):
+        tasks = Task.__table__
+        rows = db.session.execute(
+            select(tasks.c.id, tasks.c.estimated_hours).where(tasks.c.project_id == project_id).order_by(tasks.c.id)
+        ).all()
+        durations = {task_id: hours if hours is not None and hours > 0 else self.DEFAULT_TASK_HOURS for task_id, hours in rows}
+        successors = {task_id: [] for task_id in durations}
+        prerequisites = {task_id: [] for task_id in durations}
+        for task_id, depends_on_id in self.load_edges(project_id):
+            if task_id in durations and depends_on_id in durations:
+                successors[depends_on_id].append(task_id)
+                prerequisites[task_id].append(depends_on_id)
+
+        # Kahn拓扑排序，同一层按任务id顺序
+        in_degree = {task_id: len(items) for task_id, items in prerequisites.items()}
+        ready = deque(task_id for task_id in durations if in_degree[task_id] == 0)
+        order = []
+        while ready:
+            current = ready.popleft()
+            order.append(current)
+            for successor in successors[current]:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    ready.append(successor)
+        if len(order) != len(durations):
+            # 绕过接口直接写入的数据可能含有循环
+            raise TaskGraphError('任务依赖中存在循环，无法排期')
+
+        # 正向：最早开始 = 所有前置任务最早完成时间的最大值
+        earliest_start = {}
+        earliest_finish = {}
+        for task_id in order:
+            earliest_start[task_id] = max((earliest_finish[item] for item in prerequisites[task_id]), default=0.0)
+            earliest_finish[task_id] = earliest_start[task_id] + durations[task_id]
+        total = max(earliest_finish.values(), default=0.0)
+
+        # 反向：最晚完成 = 所有后继任务最晚开始时间的最小值
+        latest_start = {}
+        for task_id in reversed(order):
+            latest_finish = min((latest_start[item] for item in successors[task_id]), default=total)
+            latest_start[task_id] = latest_finish - durations[task_id]
+
+        schedule = {}
+        for task_id in order:
+            slack = latest_start[task_id] - earliest_start[task_id]
+            schedule[task_id] = {
+                'duration_hours': durations[task_id],
+                'earliest_start': earliest_start[task_id],
+                'earliest_finish': earliest_finish[task_id],
+                'latest_start': latest_start[task_id],
+                'slack': slack,
+                'critical': abs(slack) < 1e-9,
+                'depends_on': prerequisites[task_id]
+            }
+
+        # 关键路径：从最晚完成的任务沿“完成时间等于当前开始时间”的关键前置任务回溯
+        critical_path = []
+        current = max(order, key=lambda task_id: earliest_finish[task_id], default=None)
+        while current is not None:
+            critical_path.append(current)
+            current = next((
+                item for item in prerequisites[current]
+                if schedule[item]['critical'] and abs(earliest_finish[item] - earliest_start[current]) < 1e-9
+            ), None)
+
+        return {
+            'order': order,
+            'schedule': schedule,
+            'critical_path': critical_path[::-1],
+            'total_hours': total
+        }
+
+    def schedule(self, project):
+        """项目的拓扑顺序、各任务最早/最晚开始时间、浮动时间和关键路径（单位：小时）"""
+        if not self.enabled:
+            return self._compute(project.id)
+
+        # 读取最新版本号（同一会话中的Project对象可能是触发器更新之前加载的）
+        version = db.session.query(Project.graph_version).filter(Project.id == project.id).scalar()
+        key = (project.id, version)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        result = self._compute(project.id)
+        with self.lock:
+            self.cache[key] = result
+            # 同一项目的旧版本不会再被命中
+            for stale in [item for item in self.cache if item[0] == project.id and item != key]:
+                del self.cache[stale]
+            while len(self.cache) > self.CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return result
+
+
+# 全局任务依赖图实例
+task_graph = TaskGraphService()
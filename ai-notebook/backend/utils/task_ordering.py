@@ -0,0 +1,238 @@
+"""
+看板任务排序模块
+每个任务在所在 (项目, 状态) 列中有一个可按字符串比较的分数位置键，
+拖动时在相邻两个任务的键之间生成新键，只更新被移动的一行；键过长时在后台重新均匀分配
+"""
+
+import os
+import queue
+import threading
+import logging
+from sqlalchemy import event, select, bindparam
+from sqlalchemy.orm import Session
+from models import db, Task
+from utils.background_engine import get_background_engine
+
+logger = logging.getLogger(__name__)
+
+# 按ASCII顺序排列，SQLite默认的BINARY排序与字符串比较一致
+POSITION_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+class TaskMoveError(ValueError):
+    """移动目标Invalid"""
+
+
+def _increment(key):
+    """大于key的最短键（列尾追加）：首位能加一时键长不变"""
+    if not key:
+        return POSITION_DIGITS[len(POSITION_DIGITS) // 2]
+    digit = POSITION_DIGITS.index(key[0])
+    if digit < len(POSITION_DIGITS) - 1:
+        return POSITION_DIGITS[digit + 1]
+    return key[0] + _increment(key[1:])
+
+
+def _midpoint(a, b):
+    # 公共前缀（a不足的位按'0'比较）原样保留
+    n = 0
+    while (a[n] if n < len(a) else '0') == b[n]:
+        n += 1
+    if n > 0:
+        return b[:n] + _midpoint(a[n:], b[n:])
+    digit_a = POSITION_DIGITS.index(a[0]) if a else 0
+    digit_b = POSITION_DIGITS.index(b[0])
+    if digit_b - digit_a > 1:
+        return POSITION_DIGITS[(digit_a + digit_b + 1) // 2]
+    if len(b) > 1:
+        return b[0]
+    return POSITION_DIGITS[digit_a] + _increment(a[1:])
+
+
+def key_between(a, b):
+    """生成满足 a < 键 < b 的位置键；a为None表示列首之前，b为None表示列尾之后
+
+    键不以'0'结尾，因此任意两个键之间总能再插入新键。
+    """
+    a = a or ''
+    if b is None:
+        return _increment(a)
+    if a >= b:
+        raise TaskMoveError('位置键顺序Invalid')
+    return _midpoint(a, b)
+
+
+def evenly_spaced_keys(count):
+    """count个等间距的位置键（重新分配时使用），长度为能容纳count个键的最短长度"""
+    base = len(POSITION_DIGITS)
+    length = 1
+    while base ** length <= count * 2:
+        length += 1
+    step = base ** length // (count + 1)
+    keys = []
+    for index in range(1, count + 1):
+        value = index * step
+        digits = []
+        for _ in range(length):
+            value, digit = divmod(value, base)
+            digits.append(POSITION_DIGITS[digit])
+        keys.append(''.join(reversed(digits)).rstrip('0'))
+    return keys
+
+
+class TaskOrdering:
+    """看板列内的任务顺序
+
+    - 列内按 (position, id) 排序，由 (project_id, status, position) 索引支持
+    - 移动只读取相邻任务并更新被移动任务的一行
+    - 生成的键超过 REBALANCE_KEY_LENGTH 时，该列交给后台线程重新均匀分配
+    """
+
+    REBALANCE_KEY_LENGTH = int(os.getenv('TASK_POSITION_REBALANCE_LENGTH', '16'))
+
+    def __init__(self):
+        self.app = None
+        self.pending = queue.Queue()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='task-rebalance', daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _column(project_id, status, exclude_id):
+        return db.session.query(Task.position, Task.id).filter(
+            Task.project_id == project_id,
+            Task.status == status,
+            Task.id != exclude_id
+        )
+
+    def last_position(self, project_id, status, connection=None):
+        """列中最后一个任务的位置键，列为空时返回None"""
+        statement = select(Task.position).where(
+            Task.project_id == project_id,
+            Task.status == status
+        ).order_by(Task.position.desc(), Task.id.desc()).limit(1)
+        if connection is not None:
+            return connection.execute(statement).scalar()
+        return db.session.execute(statement).scalar()
+
+    def move(self, task, status, after_id=None, before_id=None):
+        """把任务移动到status列中after_id之后、before_id之前（都为空时放到列尾）
+
+        只给出一侧相邻任务时，另一侧通过索引查找它在列中的前驱/后继。
+        只修改task对象（一行），不提交事务。
+        """
+        if task.id in (after_id, before_id):
+            raise TaskMoveError('不能相对任务自身移动')
+
+        neighbors = {}
+        for neighbor_id in (after_id, before_id):
+            if neighbor_id is None:
+                continue
+            row = db.session.query(Task.project_id, Task.status, Task.position).filter(Task.id == neighbor_id).first()
+            if row is None or row.project_id != task.project_id or row.status != status:
+                raise TaskMoveError(f'相邻任务 {neighbor_id} 不在目标列中')
+            neighbors[neighbor_id] = (row.position, neighbor_id)
+
+        column = self._column(task.project_id, status, task.id)
+        lower = neighbors.get(after_id)
+        upper = neighbors.get(before_id)
+        if lower is not None and upper is None:
+            upper = column.filter(db.or_(
+                Task.position > lower[0],
+                db.and_(Task.position == lower[0], Task.id > lower[1])
+            )).order_by(Task.position.asc(), Task.id.asc()).first()
+        elif upper is not None and lower is None:
+            lower = column.filter(db.or_(
+                Task.position < upper[0],
+                db.and_(Task.position == upper[0], Task.id < upper[1])
+            )).order_by(Task.position.desc(), Task.id.desc()).first()
+        elif lower is None:
+            lower = column.order_by(Task.position.desc(), Task.id.desc()).first()
+
+        lower_key = lower[0] if lower is not None else None
+        upper_key = upper[0] if upper is not None else None
+        if lower_key is not None and upper_key is not None and lower_key >= upper_key:
+            # 相邻任务的键相同（例如并发插入）：重新分配后由客户端重试
+            self.schedule_rebalance(task.project_id, status)
+            raise TaskMoveError('目标位置冲突，请刷新后重试')
+
+        task.status = status
+        task.position = key_between(lower_key, upper_key)
+        self.check_key_length(task.project_id, status, task.position)
+        return task
+
+    def check_key_length(self, project_id, status, position):
+        if len(position) > self.REBALANCE_KEY_LENGTH:
+            self.schedule_rebalance(project_id, status)
+
+    def schedule_rebalance(self, project_id, status):
+        self.pending.put((project_id, status))
+
+    def rebalance(self, project_id, status):
+        """按当前顺序为一列任务重新分配等长的位置键
+
+        在独立连接的单个事务中执行，不会提交或回滚共享连接上其他请求未完成的修改。
+        """
+        tasks = Task.__table__
+        with get_background_engine().begin() as conn:
+            ids = [row[0] for row in conn.execute(
+                select(tasks.c.id)
+                .where(tasks.c.project_id == project_id, tasks.c.status == status)
+                .order_by(tasks.c.position.asc(), tasks.c.id.asc())
+            )]
+            if ids:
+                conn.execute(
+                    # 保留updated_at：重新分配不是用户修改
+                    tasks.update().where(tasks.c.id == bindparam('_id')).values(
+                        position=bindparam('_position'), updated_at=tasks.c.updated_at
+                    ),
+                    [{'_id': task_id, '_position': key} for task_id, key in zip(ids, evenly_spaced_keys(len(ids)))]
+                )
+        return len(ids)
+
+    def _run(self):
+        while True:
+            column = self.pending.get()
+            # 合并排队中的重复请求
+            columns = {column}
+            while True:
+                try:
+                    columns.add(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                for project_id, status in columns:
+                    try:
+                        count = self.rebalance(project_id, status)
+                        logger.info(f"Rebalanced {count} task positions in project {project_id} column {status}")
+                    except Exception as e:
+                        logger.error(f"Failed to rebalance task positions: {e}")
+
+
+# 全局任务排序实例
+task_ordering = TaskOrdering()
+
+
+@event.listens_for(Task, 'before_insert')
+def _assign_task_position(mapper, connection, target):
+    """新任务追加到所在列的列尾；同一次flush中的多个新任务按添加顺序排列"""
+    if target.position:
+        return
+    status = target.status or 'todo'
+    session = Session.object_session(target)
+    last_positions = session.info.setdefault('task_last_positions', {})
+    column = (target.project_id, status)
+    if column not in last_positions:
+        last_positions[column] = task_ordering.last_position(target.project_id, status, connection)
+    target.position = key_between(last_positions[column], None)
+    last_positions[column] = target.position
+    task_ordering.check_key_length(target.project_id, status, target.position)
+
+
+@event.listens_for(Session, 'after_flush')
+def _clear_task_positions(session, flush_context):
+    session.info.pop('task_last_positions', None)
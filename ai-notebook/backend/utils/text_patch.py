@@ -0,0 +1,120 @@
+"""
+文本补丁模块
+把位置操作或unified diff应用到基准文本上，用于笔记的增量保存
+"""
+
+import re
+from utils.note_revisions import content_checksum
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+class PatchError(ValueError):
+    """补丁无法应用"""
+
+
+def revision_token(content):
+    """笔记内容的版本标记（基于内容哈希，相同内容得到相同标记）"""
+    return content_checksum(content)[:16]
+
+
+def apply_text_operations(base, operations, unit='utf16'):
+    """应用位置操作
+
+    operations: [{'pos': int, 'delete': int, 'insert': str}, ...]，
+    位置均相对于基准文本，按位置排序且互不重叠。
+    unit: 位置单位，utf16（JavaScript字符串下标）或 codepoint（Python字符串下标）
+    """
+    if not isinstance(operations, list):
+        raise PatchError('ops must be a list')
+    if unit not in ('utf16', 'codepoint'):
+        raise PatchError(f'Unsupported offset unit: {unit}')
+
+    # utf16单位下在UTF-16编码上按2字节一个单位操作，无需逐字符换算
+    if unit == 'utf16':
+        source = base.encode('utf-16-le')
+        width = 2
+    else:
+        source = base
+        width = 1
+
+    pieces = []
+    cursor = 0
+    length = len(source) // width
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise PatchError('Each op must be an object')
+        position = operation.get('pos')
+        delete = operation.get('delete', 0)
+        insert = operation.get('insert', '')
+        if not isinstance(position, int) or not isinstance(delete, int) or not isinstance(insert, str):
+            raise PatchError('Invalid op fields')
+        if position < cursor or delete < 0 or position + delete > length:
+            raise PatchError(f'Op out of range or overlapping at pos {position}')
+
+        pieces.append(source[cursor * width:position * width])
+        pieces.append(insert.encode('utf-16-le') if unit == 'utf16' else insert)
+        cursor = position + delete
+    pieces.append(source[cursor * width:])
+
+    if unit == 'codepoint':
+        return ''.join(pieces)
+    try:
+        return b''.join(pieces).decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise PatchError('Op splits a surrogate pair')
+
+
+def apply_unified_diff(base, diff):
+    """应用unified diff，上下文和删除行必须与基准文本一致"""
+    if not isinstance(diff, str):
+        raise PatchError('diff must be a string')
+
+    base_lines = base.splitlines(keepends=True)
+    diff_lines = diff.splitlines(keepends=True)
+    output = []
+    cursor = 0
+    index = 0
+    previous_tag = None
+
+    # 跳过文件头
+    while index < len(diff_lines) and not diff_lines[index].startswith('@@'):
+        index += 1
+
+    while index < len(diff_lines):
+        match = HUNK_HEADER.match(diff_lines[index])
+        if not match:
+            raise PatchError(f'Invalid hunk header: {diff_lines[index].strip()}')
+        old_start = int(match.group(1))
+        old_count = int(match.group(2)) if match.group(2) is not None else 1
+        # 空范围（例如 -0,0）表示在该行之后插入
+        hunk_start = old_start - 1 if old_count > 0 else old_start
+        if hunk_start < cursor or hunk_start > len(base_lines):
+            raise PatchError('Hunks out of order or out of range')
+        output.extend(base_lines[cursor:hunk_start])
+        cursor = hunk_start
+        index += 1
+
+        while index < len(diff_lines) and not diff_lines[index].startswith('@@'):
+            line = diff_lines[index]
+            index += 1
+            if line.startswith('\\'):
+                # "\ No newline at end of file"：去掉上一行的换行符
+                if output and output[-1].endswith('\n') and previous_tag in ('+', ' '):
+                    output[-1] = output[-1][:-1]
+                continue
+            tag, text = line[:1], line[1:]
+            previous_tag = tag
+            if tag == '+':
+                output.append(text)
+            elif tag in (' ', '-'):
+                if cursor >= len(base_lines) or base_lines[cursor].rstrip('\n') != text.rstrip('\n'):
+                    raise PatchError(f'Context mismatch at line {cursor + 1}')
+                if tag == ' ':
+                    output.append(base_lines[cursor])
+                cursor += 1
+            else:
+                raise PatchError(f'Invalid diff line: {line.strip()}')
+
+    output.extend(base_lines[cursor:])
+    return ''.join(output)
@@ -0,0 +1,245 @@
+"""
+待办事项批量操作模块
+把一组创建/更新/切换/Delete操作合并为集合式SQL语句，在一个事务中执行
+"""
+
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import case, select, bindparam
+from models import db, Todo, TodoOccurrenceException, PomodoroSession, priority_rank_for, recurrence_end_for
+from utils.search_index import search_index
+from utils.todo_categories import todo_categories
+from utils.content_hash import todo_content_hash
+from utils.time_utils import TimeUtils
+
+BULK_OPERATIONS = ('create', 'update', 'toggle', 'delete')
+
+
+class BulkOperationError(ValueError):
+    """单个批量操作无效"""
+
+
+def parse_todo_changes(data, creating=False):
+    """把请求中的字段转换为列值"""
+    if not isinstance(data, dict):
+        raise BulkOperationError('data必须是对象')
+
+    changes = {}
+    if 'title' in data or creating:
+        title = data.get('title')
+        if not isinstance(title, str) or not title.strip():
+            raise BulkOperationError('标题不能为空')
+        changes['title'] = title
+    for field in ('description', 'category', 'priority'):
+        if field in data and data[field] is not None and not isinstance(data[field], str):
+            raise BulkOperationError(f'{field}必须是字符串')
+    for field in ('description', 'category'):
+        if field in data:
+            changes[field] = data[field]
+    if 'priority' in data:
+        changes['priority'] = data['priority']
+        changes['priority_rank'] = priority_rank_for(data['priority'])
+    if 'completed' in data or 'is_completed' in data:
+        changes['is_completed'] = bool(data.get('completed', data.get('is_completed')))
+    if 'due_date' in data:
+        if data['due_date']:
+            try:
+                changes['due_date'] = datetime.fromisoformat(data['due_date'].replace('Z', '+00:00'))
+            except (ValueError, AttributeError):
+                raise BulkOperationError('截止日期格式Invalid')
+        else:
+            changes['due_date'] = None
+
+    if creating:
+        changes.setdefault('description', '')
+        changes.setdefault('category', '默认')
+        changes.setdefault('priority', 'medium')
+        changes.setdefault('priority_rank', priority_rank_for(changes['priority']))
+        changes.setdefault('is_completed', False)
+        changes['created_at'] = TimeUtils.now_local().replace(tzinfo=None)
+    elif not changes:
+        raise BulkOperationError('没有需要更新的字段')
+    return changes
+
+
+class TodoBulkProcessor:
+    """待办事项批量操作执行器
+
+    同一批次中每个待办事项最多出现在一个操作中。操作按类型合并：
+    Delete和切换各一条语句，字段相同的更新合并为一条语句，创建逐条插入以返回新id。
+    语句直接在会话连接上执行（不经过ORM事件），全文索引在同一事务内同步维护。
+    """
+
+    MAX_OPERATIONS = int(os.getenv('TODO_BULK_MAX_OPERATIONS', '500'))
+
+    def _validate(self, operations):
+        results = [None] * len(operations)
+        valid = []
+        seen_ids = set()
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            todo_id = operation.get('id') if isinstance(operation, dict) else None
+            try:
+                if op not in BULK_OPERATIONS:
+                    raise BulkOperationError(f'不支持的操作: {op}')
+                if op == 'create':
+                    changes = parse_todo_changes(operation.get('data'), creating=True)
+                else:
+                    if not isinstance(todo_id, int):
+                        raise BulkOperationError('缺少待办事项id')
+                    if todo_id in seen_ids:
+                        raise BulkOperationError('同一待办事项在批次中重复出现')
+                    seen_ids.add(todo_id)
+                    changes = parse_todo_changes(operation.get('data')) if op == 'update' else None
+                valid.append((index, op, todo_id, changes))
+            except BulkOperationError as e:
+                results[index] = {'index': index, 'op': op, 'id': todo_id, 'status': 'error', 'error': str(e)}
+        return results, valid
+
+    def _refresh_recurrence_end(self, conn, todo_ids):
+        """截止日期改变后重新计算重复事项的结束时间（语句不经过ORM事件）"""
+        todos = Todo.__table__
+        rows = conn.execute(
+            select(todos.c.id, todos.c.recurrence_rule, todos.c.due_date)
+            .where(todos.c.id.in_(todo_ids), todos.c.recurrence_rule.isnot(None))
+        ).all()
+        for todo_id, recurrence_rule, due_date in rows:
+            if due_date is None:
+                # 没有首次发生时间时取消重复
+                values = {'recurrence_rule': None, 'recurrence_end': None}
+            else:
+                values = {'recurrence_end': recurrence_end_for(recurrence_rule, due_date)}
+            conn.execute(todos.update().where(todos.c.id == todo_id).values(**values))
+
+    def _refresh_content_hash(self, conn, todo_ids):
+        """标题或描述改变后重新计算指纹"""
+        todos = Todo.__table__
+        rows = conn.execute(
+            select(todos.c.id, todos.c.title, todos.c.description, todos.c.created_at).where(todos.c.id.in_(todo_ids))
+        ).all()
+        conn.execute(
+            todos.update().where(todos.c.id == bindparam('_id')).values(content_hash=bindparam('_hash')),
+            [{'_id': row.id, '_hash': todo_content_hash(row.title, row.description, row.created_at)} for row in rows]
+        )
+
+    def _assign_content_hash(self, changes, seen):
+        """新建事项的指纹；同一批次内标题、描述和创建时间都相同时创建时间顺延1微秒，保持指纹唯一"""
+        while True:
+            content_hash = todo_content_hash(changes['title'], changes['description'], changes['created_at'])
+            if content_hash not in seen:
+                break
+            changes['created_at'] += timedelta(microseconds=1)
+        seen.add(content_hash)
+        changes['content_hash'] = content_hash
+
+    def execute(self, operations, atomic=False):
+        """执行批量操作，返回 (逐项结果, 是否已提交)
+
+        atomic为True时，任一操作无效则不执行任何写入。
+        """
+        if len(operations) > self.MAX_OPERATIONS:
+            raise BulkOperationError(f'单次最多 {self.MAX_OPERATIONS} 个操作')
+
+        todos = Todo.__table__
+        results, valid = self._validate(operations)
+        conn = db.session.connection()
+
+        # 一次查询确认引用的待办事项存在
+        referenced = [todo_id for _, op, todo_id, _ in valid if op != 'create']
+        existing = set()
+        if referenced:
+            existing = {row[0] for row in conn.execute(select(todos.c.id).where(todos.c.id.in_(referenced)))}
+        operations_to_apply = []
+        for index, op, todo_id, changes in valid:
+            if op != 'create' and todo_id not in existing:
+                results[index] = {'index': index, 'op': op, 'id': todo_id, 'status': 'error', 'error': '待办事项不存在'}
+            else:
+                operations_to_apply.append((index, op, todo_id, changes))
+
+        if atomic and len(operations_to_apply) < len(operations):
+            for index, op, todo_id, _ in operations_to_apply:
+                results[index] = {'index': index, 'op': op, 'id': todo_id, 'status': 'skipped'}
+            return results, False
+
+        # 分类名称转换为分类id（不存在的分类在同一事务内创建）
+        todo_categories.assign_ids(conn, [changes for _, _, _, changes in operations_to_apply if changes])
+
+        delete_ids = [todo_id for _, op, todo_id, _ in operations_to_apply if op == 'delete']
+        toggle_ids = [todo_id for _, op, todo_id, _ in operations_to_apply if op == 'toggle']
+        update_groups = {}
+        for _, op, todo_id, changes in operations_to_apply:
+            if op == 'update':
+                update_groups.setdefault(tuple(sorted(changes.items())), []).append(todo_id)
+
+        if delete_ids:
+            # 与ORM Delete一致：解除番茄钟记录的关联
+            conn.execute(
+                PomodoroSession.__table__.update()
+                .where(PomodoroSession.__table__.c.associated_task_id.in_(delete_ids))
+                .values(associated_task_id=None)
+            )
+            exceptions = TodoOccurrenceException.__table__
+            conn.execute(exceptions.delete().where(exceptions.c.todo_id.in_(delete_ids)))
+            conn.execute(todos.delete().where(todos.c.id.in_(delete_ids)))
+            search_index.remove_todos(conn, delete_ids)
+
+        if toggle_ids:
+            conn.execute(
+                todos.update()
+                .where(todos.c.id.in_(toggle_ids))
+                .values(is_completed=case((todos.c.is_completed == True, False), else_=True))
+            )
+
+        for key, todo_ids in update_groups.items():
+            conn.execute(todos.update().where(todos.c.id.in_(todo_ids)).values(**dict(key)))
+            if 'due_date' in dict(key):
+                self._refresh_recurrence_end(conn, todo_ids)
+            if 'title' in dict(key) or 'description' in dict(key):
+                self._refresh_content_hash(conn, todo_ids)
+
+        created_ids = {}
+        creates = [(index, changes) for index, op, _, changes in operations_to_apply if op == 'create']
+        if creates:
+            created_hashes = set()
+            create_groups = {}
+            for _, changes in creates:
+                self._assign_content_hash(changes, created_hashes)
+                create_groups.setdefault(tuple(sorted(changes)), []).append(changes)
+            # 字段相同的新建事项用一次executemany插入，再按唯一的内容指纹一次查询读回id
+            for rows in create_groups.values():
+                conn.execute(todos.insert(), rows)
+            ids_by_hash = dict(conn.execute(
+                select(todos.c.content_hash, todos.c.id)
+                .where(todos.c.content_hash.in_([changes['content_hash'] for _, changes in creates]))
+            ).all())
+            created_ids = {index: ids_by_hash[changes['content_hash']] for index, changes in creates}
+
+        # 读取变更后的数据用于返回结果和更新索引
+        touched_ids = toggle_ids + [todo_id for ids in update_groups.values() for todo_id in ids] + list(created_ids.values())
+        touched = {}
+        if touched_ids:
+            touched = {
+                todo.id: todo for todo in Todo.query.populate_existing().filter(Todo.id.in_(touched_ids)).all()
+            }
+        reindex_ids = list(created_ids.values()) + [
+            todo_id for key, ids in update_groups.items()
+            if any(field in ('title', 'description') for field, _ in key)
+            for todo_id in ids
+        ]
+        search_index.index_todos(conn, [
+            (todo_id, touched[todo_id].title, touched[todo_id].description) for todo_id in reindex_ids
+        ])
+
+        for index, op, todo_id, _ in operations_to_apply:
+            todo_id = created_ids.get(index, todo_id)
+            result = {'index': index, 'op': op, 'id': todo_id, 'status': 'ok'}
+            if op != 'delete':
+                result['todo'] = touched[todo_id].to_dict()
+            results[index] = result
+
+        db.session.commit()
+        return results, True
+
+
+# 全局批量操作执行器实例
+todo_bulk_processor = TodoBulkProcessor()
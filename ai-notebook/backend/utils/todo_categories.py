@@ -0,0 +1,165 @@
+"""
+待办事项分类模块
+分类保存在 todo_categories 表中，待办事项通过 category_id 引用；
+各分类的事项数由todos表上的触发器在写入事务内维护
+"""
+
+import logging
+from sqlalchemy import text, case, select
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Todo, TodoCategory
+from utils.time_utils import TimeUtils
+
+logger = logging.getLogger(__name__)
+
+MAX_NAME_LENGTH = 50
+
+
+class TodoCategoryError(ValueError):
+    """分类名称Invalid"""
+
+
+def _count_changes(row, sign):
+    """生成一行待办事项对所属分类计数的增减语句（row为NEW或OLD）"""
+    return (
+        f"UPDATE todo_categories SET todo_count = todo_count {sign} 1, "
+        f"completed_count = completed_count {sign} (CASE WHEN {row}.is_completed = 1 THEN 1 ELSE 0 END) "
+        f"WHERE id = {row}.category_id; "
+    )
+
+
+class TodoCategoryService:
+    """待办事项分类
+
+    计数触发器启用时（SQLite），分类列表和各分类数量直接读取 todo_categories，
+    与待办事项数量无关；其他数据库按 category_id 分组统计。
+    重命名只更新分类表中的一行。
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        """创建分类计数触发器并按现有数据重建计数（幂等）"""
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                logger.info("Todo category counters disabled: database is not SQLite")
+                return
+
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_todos_category_insert AFTER INSERT ON todos "
+                        f"BEGIN {_count_changes('NEW', '+')}END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_todos_category_delete AFTER DELETE ON todos "
+                        f"BEGIN {_count_changes('OLD', '-')}END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_todos_category_update "
+                        "AFTER UPDATE OF category_id, is_completed ON todos "
+                        f"BEGIN {_count_changes('OLD', '-')}{_count_changes('NEW', '+')}END"
+                    ))
+                    self._rebuild(conn)
+                self.enabled = True
+            except SQLAlchemyError as e:
+                logger.warning(f"Failed to setup todo category counters: {e}")
+                self.enabled = False
+
+    def _rebuild(self, conn):
+        conn.execute(text(
+            "UPDATE todo_categories SET "
+            "todo_count = (SELECT COUNT(*) FROM todos WHERE todos.category_id = todo_categories.id), "
+            "completed_count = (SELECT COUNT(*) FROM todos "
+            "WHERE todos.category_id = todo_categories.id AND todos.is_completed = 1)"
+        ))
+
+    def list_categories(self):
+        """有待办事项的分类及其数量，按名称排序"""
+        if self.enabled:
+            return [category.to_dict() for category in TodoCategory.query.filter(
+                TodoCategory.todo_count > 0
+            ).order_by(TodoCategory.name).all()]
+
+        rows = db.session.query(
+            TodoCategory.id,
+            TodoCategory.name,
+            db.func.count(Todo.id),
+            db.func.sum(case((Todo.is_completed == True, 1), else_=0))
+        ).join(Todo, Todo.category_id == TodoCategory.id).group_by(
+            TodoCategory.id, TodoCategory.name
+        ).order_by(TodoCategory.name).all()
+        return [
+            {'id': category_id, 'name': name, 'todo_count': count, 'completed_count': completed or 0}
+            for category_id, name, count, completed in rows
+        ]
+
+    def category_counts(self):
+        """{分类名称: 事项数}"""
+        return {category['name']: category['todo_count'] for category in self.list_categories()}
+
+    def category_filter(self, name):
+        """按分类名称过滤待办事项的条件（走 (category_id, is_completed) 索引）"""
+        return Todo.category_id == db.session.query(TodoCategory.id).filter(
+            TodoCategory.name == name
+        ).scalar_subquery()
+
+    def resolve_ids(self, connection, names):
+        """在给定连接的事务内把分类名称解析为id，不存在的分类一并创建"""
+        names = {name for name in names if name}
+        if not names:
+            return {}
+        categories = TodoCategory.__table__
+        ids = dict(connection.execute(
+            select(categories.c.name, categories.c.id).where(categories.c.name.in_(names))
+        ).all())
+        now = TimeUtils.now_local().replace(tzinfo=None)
+        for name in sorted(names - set(ids)):
+            ids[name] = connection.execute(
+                categories.insert().values(name=name, todo_count=0, completed_count=0, created_at=now)
+            ).inserted_primary_key[0]
+        return ids
+
+    def assign_ids(self, connection, rows):
+        """把插入/更新参数中的 category 名称替换为 category_id（原地修改）"""
+        rows = [row for row in rows if 'category' in row]
+        ids = self.resolve_ids(connection, [row['category'] for row in rows])
+        for row in rows:
+            row['category_id'] = ids.get(row.pop('category'))
+
+    def rename(self, name, new_name):
+        """重命名分类；新名称已存在时把事项合并到该分类。返回分类，不存在时返回None
+
+        不提交事务，由调用方提交。
+        """
+        if not isinstance(new_name, str) or not new_name.strip():
+            raise TodoCategoryError('分类名称不能为空')
+        new_name = new_name.strip()
+        if len(new_name) > MAX_NAME_LENGTH:
+            raise TodoCategoryError(f'分类名称不能超过 {MAX_NAME_LENGTH} 个字符')
+
+        category = TodoCategory.query.filter_by(name=name).first()
+        if category is None or new_name == category.name:
+            return category
+
+        target = TodoCategory.query.filter_by(name=new_name).first()
+        if target is None:
+            category.name = new_name
+            db.session.flush()
+            return category
+
+        # 合并：移动该分类的事项（触发器同步两个分类的计数），再Delete空分类
+        db.session.execute(
+            Todo.__table__.update()
+            .where(Todo.__table__.c.category_id == category.id)
+            .values(category_id=target.id)
+        )
+        db.session.delete(category)
+        db.session.flush()
+        db.session.refresh(target)
+        return target
+
+
+# 全局待办事项分类实例
+todo_categories = TodoCategoryService()
@@ -0,0 +1,149 @@
+"""
+待办事项统计模块
+单次聚合查询计算统计，或读取由触发器增量维护的计数器表
+"""
+
+import os
+import logging
+from sqlalchemy import text, case
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Todo, TodoCounter, TodoCategory
+from utils.time_utils import TimeUtils
+from utils.recurring_todos import recurring_todos
+from utils.todo_categories import todo_categories
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ('high', 'medium', 'low')
+
+
+def _counter_changes(row, delta):
+    """生成一行待办事项对计数器的增减语句（row为NEW或OLD）"""
+    sign = '+' if delta > 0 else '-'
+    priority = f"COALESCE({row}.priority, '')"
+    return (
+        f"INSERT OR IGNORE INTO todo_counters (kind, key, count) VALUES "
+        f"('total', '', 0), ('completed', '', 0), ('open_priority', {priority}, 0); "
+        f"UPDATE todo_counters SET count = count {sign} 1 WHERE "
+        f"(kind = 'total' AND key = '') "
+        f"OR (kind = 'completed' AND key = '' AND {row}.is_completed = 1) "
+        f"OR (kind = 'open_priority' AND key = {priority} AND {row}.is_completed = 0); "
+    )
+
+
+class TodoStats:
+    """待办事项统计
+
+    计数器表启用时（SQLite且 TODO_STATS_COUNTERS 不为false），总数、完成数和
+    各优先级未完成数直接读取 todo_counters，分类数读取 todo_categories，与todos表大小无关；
+    逾期数量依赖当前时间，通过 (is_completed, due_date) 索引范围计数。
+    """
+
+    USE_COUNTERS = os.getenv('TODO_STATS_COUNTERS', 'true').lower() == 'true'
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        """创建计数器触发器并按现有数据重建计数（幂等）"""
+        with app.app_context():
+            if not self.USE_COUNTERS or db.engine.dialect.name != 'sqlite':
+                logger.info("Todo stats counters disabled, using aggregated query")
+                return
+
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_todos_counters_insert AFTER INSERT ON todos "
+                        f"BEGIN {_counter_changes('NEW', 1)}END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_todos_counters_delete AFTER DELETE ON todos "
+                        f"BEGIN {_counter_changes('OLD', -1)}END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS trg_todos_counters_update "
+                        "AFTER UPDATE OF is_completed, priority ON todos "
+                        f"BEGIN {_counter_changes('OLD', -1)}{_counter_changes('NEW', 1)}END"
+                    ))
+                    # 触发器创建之前写入的数据（或关闭计数器期间的写入）在启动时重新统计
+                    self._rebuild(conn)
+                self.enabled = True
+            except SQLAlchemyError as e:
+                logger.warning(f"Failed to setup todo stats counters: {e}")
+                self.enabled = False
+
+    def _rebuild(self, conn):
+        conn.execute(text("DELETE FROM todo_counters"))
+        conn.execute(text(
+            "INSERT INTO todo_counters (kind, key, count) "
+            "SELECT 'total', '', COUNT(*) FROM todos "
+            "UNION ALL SELECT 'completed', '', COUNT(*) FROM todos WHERE is_completed = 1 "
+            "UNION ALL SELECT 'open_priority', COALESCE(priority, ''), COUNT(*) FROM todos "
+            "WHERE is_completed = 0 GROUP BY COALESCE(priority, '')"
+        ))
+
+    def _count_overdue(self, now):
+        return db.session.query(db.func.count(Todo.id)).filter(
+            Todo.is_completed == False,
+            Todo.due_date < now,
+            Todo.recurrence_rule.is_(None)
+        ).scalar()
+
+    def _from_counters(self, now):
+        counts = {}
+        for kind, key, count in db.session.query(TodoCounter.kind, TodoCounter.key, TodoCounter.count):
+            counts.setdefault(kind, {})[key] = count
+        return {
+            'total': counts.get('total', {}).get('', 0),
+            'completed': counts.get('completed', {}).get('', 0),
+            'priority': {p: counts.get('open_priority', {}).get(p, 0) for p in PRIORITIES},
+            'category': todo_categories.category_counts(),
+            'overdue': self._count_overdue(now)
+        }
+
+    def _from_aggregate(self, now):
+        """按分类分组的一次扫描，用条件求和同时得到各项计数"""
+        open_todo = Todo.is_completed == False
+        rows = db.session.query(
+            Todo.category_id,
+            db.func.count(Todo.id),
+            db.func.sum(case((Todo.is_completed == True, 1), else_=0)),
+            *[db.func.sum(case((db.and_(open_todo, Todo.priority == p), 1), else_=0)) for p in PRIORITIES],
+            db.func.sum(case((db.and_(open_todo, Todo.due_date < now, Todo.recurrence_rule.is_(None)), 1), else_=0))
+        ).group_by(Todo.category_id).all()
+        names = dict(db.session.query(TodoCategory.id, TodoCategory.name).all())
+
+        result = {'total': 0, 'completed': 0, 'priority': dict.fromkeys(PRIORITIES, 0), 'category': {}, 'overdue': 0}
+        for category_id, total, completed, *priority_counts, overdue in rows:
+            result['total'] += total
+            result['completed'] += completed or 0
+            for p, count in zip(PRIORITIES, priority_counts):
+                result['priority'][p] += count or 0
+            if category_id in names:
+                result['category'][names[category_id]] = total
+            result['overdue'] += overdue or 0
+        return result
+
+    def get_stats(self):
+        """返回与原 /api/todos/stats 相同结构的统计"""
+        now = TimeUtils.now_local().replace(tzinfo=None)
+        counts = self._from_counters(now) if self.enabled else self._from_aggregate(now)
+        total = counts['total']
+        completed = counts['completed']
+        # 重复事项按一条计入总数，逾期按最近一次到期的发生是否完成计算
+        recurring = recurring_todos.overdue_summary(now)
+        return {
+            'total': total,
+            'completed': completed,
+            'pending': total - completed,
+            'completion_rate': round((completed / total * 100) if total > 0 else 0, 1),
+            'priority_stats': counts['priority'],
+            'category_stats': counts['category'],
+            'overdue': counts['overdue'] + recurring['overdue'],
+            'recurring': recurring
+        }
+
+
+# 全局待办事项统计实例
+todo_stats = TodoStats()
@@ -0,0 +1,179 @@
+"""
+话题滚动摘要模块
+每个话题保存一份覆盖早期消息的摘要；未摘要的消息超过token阈值时，后台线程把较早的部分并入摘要，
+ai_chat 只发送摘要和未摘要的最近消息，每轮提示词大小有上限
+"""
+
+import os
+import queue
+import threading
+import logging
+from sqlalchemy import func, select
+from models import db, Topic, Message
+from utils.context_builder import estimate_tokens, clip_text
+from utils.time_utils import TimeUtils
+from utils.background_engine import get_background_engine
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = "你是一个对话摘要助手。请把已有摘要和新的对话内容合并成一份简洁的摘要，保留用户的目标、偏好、已做出的决定、关键事实和未解决的问题，省略寒暄和重复内容。只返回摘要本身。"
+
+
+def build_summary_prompt(summary, messages):
+    """把已有摘要和一批新消息合并为新摘要的提示词"""
+    lines = [f"{'用户' if role == 'user' else '助手'}: {content}" for role, content in messages]
+    return f"""已有摘要：
+{summary or '（无）'}
+
+新的对话内容：
+{chr(10).join(lines)}
+
+请输出合并后的摘要。"""
+
+
+class TopicSummarizer:
+    """话题滚动摘要
+
+    - 新消息写入后，未摘要部分的估算token数（messages.token_count之和）超过 TRIGGER_TOKENS 时，把话题交给后台线程
+    - 后台线程保留最近 KEEP_RECENT_TOKENS 的消息原文，更早的消息按 CHUNK_TOKENS 分批并入摘要，
+      每批只发送旧摘要和这一批消息，成本与新增消息量成正比
+    - 摘要截断到 MAX_SUMMARY_TOKENS，写入时不修改话题的 updated_at
+    """
+
+    TRIGGER_TOKENS = int(os.getenv('TOPIC_SUMMARY_TRIGGER_TOKENS', '3000'))
+    KEEP_RECENT_TOKENS = int(os.getenv('TOPIC_SUMMARY_KEEP_TOKENS', '1500'))
+    CHUNK_TOKENS = int(os.getenv('TOPIC_SUMMARY_CHUNK_TOKENS', '4000'))
+    MAX_SUMMARY_TOKENS = int(os.getenv('TOPIC_SUMMARY_MAX_TOKENS', '600'))
+
+    def __init__(self):
+        self.app = None
+        self.pending = queue.Queue()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='topic-summaries', daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _tail_query(topic_id, summary_message_id):
+        return (
+            select(Message.id, Message.role, Message.content, Message.token_count)
+            .where(Message.topic_id == topic_id, Message.id > (summary_message_id or 0))
+            .order_by(Message.id)
+        )
+
+    def get_tail(self, topic):
+        """话题中尚未并入摘要的消息 [(id, role, content)]，按写入顺序"""
+        rows = db.session.execute(self._tail_query(topic.id, topic.summary_message_id)).all()
+        return [(message_id, role, content) for message_id, role, content, _ in rows]
+
+    def needs_summary(self, topic):
+        """未摘要消息的估算token数达到阈值时返回True，不加载消息内容（与后台线程使用同一估算）"""
+        tokens = db.session.query(func.sum(Message.token_count)).filter(
+            Message.topic_id == topic.id,
+            Message.id > (topic.summary_message_id or 0)
+        ).scalar()
+        return (tokens or 0) >= self.TRIGGER_TOKENS
+
+    def schedule(self, topic, complete):
+        """需要时把话题交给后台更新摘要
+
+        complete: 调用AI的函数，参数为消息列表，返回回复文本（失败时返回None或抛出异常）
+        """
+        if complete is None or not self.needs_summary(topic):
+            return False
+        self.pending.put((topic.id, complete))
+        return True
+
+    def summarize(self, topic_id, complete):
+        """把话题中较早的未摘要消息分批并入摘要，返回本次并入的消息数
+
+        读写都在独立连接上进行，等待AI响应期间不持有事务，也不会提交或回滚共享连接上其他请求的修改。
+        """
+        engine = get_background_engine()
+        topics = Topic.__table__
+        with engine.begin() as conn:
+            row = conn.execute(
+                select(topics.c.summary, topics.c.summary_message_id).where(topics.c.id == topic_id)
+            ).first()
+            if row is None:
+                return 0
+            summary, summary_message_id = row
+            tail = conn.execute(self._tail_query(topic_id, summary_message_id)).all()
+
+        costs = [tokens if tokens is not None else estimate_tokens(content) for _, _, content, tokens in tail]
+        if sum(costs) < self.TRIGGER_TOKENS:
+            return 0
+
+        # 最近的消息保留原文，随ai_chat发送
+        keep = 0
+        kept_tokens = 0
+        while keep < len(tail) and kept_tokens + costs[-1 - keep] <= self.KEEP_RECENT_TOKENS:
+            kept_tokens += costs[-1 - keep]
+            keep += 1
+        folding = tail[:len(tail) - keep]
+
+        folded = 0
+        while folded < len(folding):
+            chunk = []
+            chunk_tokens = 0
+            for message_id, role, content, _ in folding[folded:]:
+                content = clip_text(content, self.CHUNK_TOKENS, keep_tail=True)
+                if chunk and chunk_tokens + estimate_tokens(content) > self.CHUNK_TOKENS:
+                    break
+                chunk.append((message_id, role, content))
+                chunk_tokens += estimate_tokens(content)
+
+            text = complete([
+                {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT},
+                {'role': 'user', 'content': build_summary_prompt(summary, [(role, content) for _, role, content in chunk])}
+            ])
+            if not text or not text.strip():
+                logger.warning(f"Topic {topic_id} summary update returned no content")
+                break
+            summary = clip_text(text.strip(), self.MAX_SUMMARY_TOKENS)
+
+            with engine.begin() as conn:
+                result = conn.execute(
+                    # 只在摘要没有被其他进程推进时写入；保留updated_at：话题列表按用户最后活动排序
+                    topics.update().where(
+                        topics.c.id == topic_id,
+                        topics.c.summary_message_id.is_not_distinct_from(summary_message_id)
+                    ).values(
+                        summary=summary,
+                        summary_message_id=chunk[-1][0],
+                        summary_updated_at=TimeUtils.now_local().replace(tzinfo=None),
+                        updated_at=topics.c.updated_at
+                    )
+                )
+            if result.rowcount == 0:
+                break
+            summary_message_id = chunk[-1][0]
+            folded += len(chunk)
+        return folded
+
+    def _run(self):
+        while True:
+            topic_id, complete = self.pending.get()
+            # 合并排队中的重复请求，每个话题使用最新的AI调用
+            topics = {topic_id: complete}
+            while True:
+                try:
+                    topic_id, complete = self.pending.get_nowait()
+                    topics[topic_id] = complete
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                for topic_id, complete in topics.items():
+                    try:
+                        count = self.summarize(topic_id, complete)
+                        if count:
+                            logger.info(f"Folded {count} messages into topic {topic_id} summary")
+                    except Exception as e:
+                        logger.error(f"Failed to update topic summary: {e}")
+
+
+# 全局话题摘要实例
+topic_summarizer = TopicSummarizer()
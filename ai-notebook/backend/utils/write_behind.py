@@ -0,0 +1,189 @@
+"""
+笔记延迟写入模块
+编辑器频繁自动保存时，先在内存中按笔记合并，在时间窗口结束后用一个事务批量提交
+"""
+
+import os
+import atexit
+import threading
+import time
+import logging
+from sqlalchemy.orm import Session, undefer
+from models import Note
+from utils.background_engine import get_background_engine
+from utils.note_revisions import revision_store
+
+logger = logging.getLogger(__name__)
+
+
+class NoteWriteBuffer:
+    """按笔记id合并的写缓冲区
+
+    - 保存请求只更新缓冲区并立即返回
+    - 同一笔记在窗口期内的多次保存合并为一次写入
+    - 后台线程定期把到期的条目在一个事务中提交（使用独立连接，不影响请求中的会话）
+    - 读取同一笔记前、以及进程退出时先写入，保证读到最新内容
+    """
+
+    ENABLED = os.getenv('NOTE_WRITE_BEHIND', 'false').lower() == 'true'
+    # 最后一次保存后等待的秒数，期间没有新的保存才写入
+    WINDOW_SECONDS = float(os.getenv('NOTE_WRITE_BEHIND_WINDOW', '2'))
+    # 持续保存时最长延迟的秒数，避免一直输入导致长时间不落盘
+    MAX_DELAY_SECONDS = float(os.getenv('NOTE_WRITE_BEHIND_MAX_DELAY', '10'))
+
+    def __init__(self):
+        self.enabled = self.ENABLED
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.RLock()
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'saves': 0, 'flushes': 0, 'flushed_notes': 0}
+
+    def init_app(self, app):
+        """启动后台写入线程并注册退出时的写入"""
+        self.app = app
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='note-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+        logger.info(f"Note write-behind enabled (window {self.WINDOW_SECONDS}s, max delay {self.MAX_DELAY_SECONDS}s)")
+
+    def enqueue(self, note_id, fields, updated_at):
+        """缓存一次保存，返回合并后的待写入字段"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.get(note_id)
+            if entry is None:
+                entry = self.pending[note_id] = {'fields': {}, 'first_at': now, 'saves': 0}
+            entry['fields'].update(fields)
+            entry['updated_at'] = updated_at
+            entry['last_at'] = now
+            entry['saves'] += 1
+            self.stats['saves'] += 1
+            return dict(entry['fields'])
+
+    def has_pending(self, note_id=None):
+        with self.lock:
+            return bool(self.pending) if note_id is None else note_id in self.pending
+
+    def discard(self, note_ids=None):
+        """丢弃待写入的条目（笔记被删除时使用）"""
+        with self.lock:
+            if note_ids is None:
+                self.pending.clear()
+            else:
+                for note_id in note_ids:
+                    self.pending.pop(note_id, None)
+
+    def _is_due(self, entry, now):
+        return (now - entry['last_at'] >= self.WINDOW_SECONDS
+                or now - entry['first_at'] >= self.MAX_DELAY_SECONDS)
+
+    def flush(self, note_ids=None, due_only=False):
+        """把待写入的条目在一个事务中提交，返回写入的笔记数
+
+        需要在应用上下文中调用。note_ids为None时写入全部条目。
+        写入在独立连接上的会话中完成：ORM事件（内容指纹、搜索索引）照常执行，
+        提交和回滚不会波及共享连接上其他请求未完成的事务。
+        """
+        with self.flush_lock:
+            now = time.monotonic()
+            with self.lock:
+                selected = [
+                    note_id for note_id, entry in self.pending.items()
+                    if (note_ids is None or note_id in note_ids)
+                    and (not due_only or self._is_due(entry, now))
+                ]
+                entries = {note_id: self.pending.pop(note_id) for note_id in selected}
+            if not entries:
+                return 0
+
+            try:
+                with get_background_engine().begin() as conn:
+                    session = Session(bind=conn)
+                    try:
+                        # 已被删除的笔记直接忽略
+                        notes = session.query(Note).options(undefer(Note.content)).filter(Note.id.in_(list(entries))).all()
+                        for note in notes:
+                            entry = entries[note.id]
+                            previous_content = note.content
+                            for field, value in entry['fields'].items():
+                                setattr(note, field, value)
+                            note.updated_at = entry['updated_at']
+                            revision_store.record(note, previous_content, session=session)
+                        session.flush()
+                    finally:
+                        session.close()
+            except Exception:
+                self._requeue(entries)
+                raise
+
+            with self.lock:
+                self.stats['flushes'] += 1
+                self.stats['flushed_notes'] += len(notes)
+            return len(notes)
+
+    def _requeue(self, entries):
+        """写入失败时放回缓冲区，期间到达的新保存优先"""
+        with self.lock:
+            for note_id, entry in entries.items():
+                newer = self.pending.get(note_id)
+                if newer is None:
+                    self.pending[note_id] = entry
+                    continue
+                fields = dict(entry['fields'])
+                fields.update(newer['fields'])
+                newer['fields'] = fields
+                newer['first_at'] = min(entry['first_at'], newer['first_at'])
+                newer['saves'] += entry['saves']
+
+    def flush_before_read(self, note_ids=None):
+        """读取前写入相关笔记的待写入内容"""
+        if not self.enabled:
+            return
+        if note_ids is None and not self.has_pending():
+            return
+        if note_ids is not None and not any(self.has_pending(note_id) for note_id in note_ids):
+            return
+        self.flush(note_ids)
+
+    def _run(self):
+        interval = max(self.WINDOW_SECONDS / 2, 0.05)
+        while not self._stop.wait(interval):
+            if not self.has_pending():
+                continue
+            try:
+                with self.app.app_context():
+                    self.flush(due_only=True)
+            except Exception as e:
+                logger.error(f"Note write-behind flush failed: {e}")
+
+    def shutdown(self):
+        """停止后台线程并写入全部条目"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self.app is None or not self.has_pending():
+            return
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception as e:
+            logger.error(f"Note write-behind final flush failed: {e}")
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'pending': len(self.pending),
+                **self.stats
+            }
+
+
+# 全局笔记写缓冲区实例
+note_write_buffer = NoteWriteBuffer()